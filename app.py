@@ -4,19 +4,17 @@ import os
 
 import gradio as gr
 
-# 导入回调函数和 Ticker 实例
+# 导入回调函数
 from gapp.app_logic import (
-    poll_task_status_callback,
+    stream_ui_updates,
     start_generation_task,
     init_app_data,
     create_genai_client,
     start_chat_task,
-    poll_chat_task_status_callback,
+    release_session,
     restart_app
 )
-from common import logger_utils as app_logic_logger, database as db, i18n
-from common.logger_utils import get_logs
-from gapp.ticker import ticker_instance
+from common import logger_utils as app_logic_logger, database as db, i18n, metrics
 
 from gapp.component import history_page, chat_page, main_page, assets_block, settings_page, header
 from common.config import get_allowed_paths, UPLOAD_DIR, OUTPUT_DIR
@@ -34,11 +32,6 @@ if not os.path.exists(UPLOAD_DIR):
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 
-# 显式注册回调，确保顺序正确
-ticker_instance.register(poll_task_status_callback)
-ticker_instance.register(poll_chat_task_status_callback)
-ticker_instance.register(get_logs)
-
 # --- 顶层辅助函数 ---
 def save_and_update_client(key, path, prefix, lang):
     db.save_setting("api_key", key)
@@ -255,10 +248,10 @@ with gr.Blocks(title=i18n.get("app_title")) as app:
     )
 
 
-    # --- 全局定时器 ---
-    poll_timer = gr.Timer(1)
-    poll_timer.tick(
-        ticker_instance.tick,
+    # --- 任务结果和日志推送 ---
+    # 每个连接一个长期运行的流式事件, 只在有变化时推送; 不限并发, 否则多个标签页会互相排队
+    app.load(
+        stream_ui_updates,
         inputs=None,
         outputs=[
             main_ui["result_image"],
@@ -268,8 +261,11 @@ with gr.Blocks(title=i18n.get("app_title")) as app:
             chat_ui["chat_input"],
             chat_ui["chat_btn_clear"],
             main_ui["log_output"]
-        ]
+        ],
+        concurrency_limit=None,
+        show_progress="hidden"
     )
+    app.unload(release_session)
 
     # --- 主页: 结果触发历史刷新 ---
     main_ui["result_image"].change(
@@ -331,4 +327,6 @@ if __name__ == "__main__":
 
     allowed_paths = get_allowed_paths()
     print(f"✅ Allowed Paths: {len(allowed_paths)}")
+    if db.get_setting("metrics_port", ""):
+        metrics.start_http_server(int(db.get_setting("metrics_port")))
     app.launch(inbrowser=True, server_name="0.0.0.0", server_port=7860, allowed_paths=allowed_paths)
@@ -0,0 +1,84 @@
+"""
+无界面批处理:
+
+    python -m batchcli manifest.jsonl -o outputs/batch1 -w 4 --resume
+
+清单为 JSONL 或 CSV, 每行一个任务 (prompt, images, model, aspect_ratio, resolution, 可选 id)。
+生成的图片和 results.jsonl 写入输出目录; --resume 会跳过上次已成功的条目。
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import logger_utils, database as db  # pylint: disable=wrong-import-position
+from batchcli.manifest import load_manifest, pending_items  # pylint: disable=wrong-import-position
+from batchcli.runner import run_batch, ProgressReporter  # pylint: disable=wrong-import-position
+from geminiapi import key_pool, api_client  # pylint: disable=wrong-import-position
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m batchcli",
+                                     description="Run a manifest of image generation jobs without a UI.")
+    parser.add_argument("manifest", help="JSONL or CSV manifest of jobs")
+    parser.add_argument("-o", "--output-dir",
+                        help="Directory for generated images and results.jsonl "
+                             "(default: <manifest name>_outputs next to the manifest)")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Number of concurrent jobs (default: 2)")
+    parser.add_argument("--api-key", help="Google API key (default: $GEMINI_API_KEY, then the app settings)")
+    parser.add_argument("--model", help="Default model for rows without one")
+    parser.add_argument("--aspect-ratio", help="Default aspect ratio for rows without one")
+    parser.add_argument("--resolution", help="Default resolution for rows without one")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip rows already marked as successful in the output directory's results.jsonl")
+    parser.add_argument("--base-url", help="Send requests to another API endpoint, e.g. a local "
+                                           "devtools.fake_gemini_server (default: $GEMINI_BASE_URL)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print info-level logs to the console")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logger_utils.set_console_level(logger_utils.INFO if args.verbose else logger_utils.WARNING)
+
+    try:
+        items = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read manifest: {e}", file=sys.stderr)
+        return 2
+
+    if args.base_url:
+        api_client.set_base_url(args.base_url)
+    api_key = args.api_key or os.environ.get("GEMINI_API_KEY") or db.get_setting("api_key", "")
+    # Keys from the app's key pool are used in rotation next to this one
+    if not key_pool.pool.pick(api_key):
+        print("No API key: pass --api-key, set GEMINI_API_KEY or save one in the app settings.", file=sys.stderr)
+        return 2
+
+    output_dir = args.output_dir or os.path.splitext(os.path.abspath(args.manifest))[0] + "_outputs"
+    if args.resume:
+        total = len(items)
+        items = pending_items(items, output_dir)
+        print(f"Resuming: {total - len(items)} of {total} rows already done.", file=sys.stderr)
+    if not items:
+        print("Nothing to do.", file=sys.stderr)
+        return 0
+
+    print(f"Running {len(items)} jobs with {args.workers} workers, writing to {output_dir}", file=sys.stderr)
+    defaults = {"model_id": args.model, "aspect_ratio": args.aspect_ratio, "resolution": args.resolution}
+    try:
+        reporter = asyncio.run(run_batch(items, output_dir, api_key, args.workers, defaults,
+                                         reporter=ProgressReporter(len(items))))
+    except KeyboardInterrupt:
+        print("Interrupted, run again with --resume to continue.", file=sys.stderr)
+        return 130
+
+    print(f"Done: {reporter.done - reporter.failed} succeeded, {reporter.failed} failed.", file=sys.stderr)
+    return 1 if reporter.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
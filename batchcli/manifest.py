@@ -0,0 +1,140 @@
+import csv
+import json
+import os
+import re
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+
+# 结果清单文件名 (位于输出目录中), 每完成一个任务追加一行
+RESULTS_FILE_NAME = "results.jsonl"
+
+# 列名别名 -> 标准字段名
+_COLUMN_ALIASES = {
+    "id": "id",
+    "prompt": "prompt",
+    "images": "image_paths",
+    "image_paths": "image_paths",
+    "model": "model_id",
+    "model_id": "model_id",
+    "ar": "aspect_ratio",
+    "aspect_ratio": "aspect_ratio",
+    "resolution": "resolution",
+}
+
+
+@dataclass
+class BatchItem:
+    id: str
+    prompt: str = ""
+    image_paths: List[str] = field(default_factory=list)
+    model_id: Optional[str] = None
+    aspect_ratio: Optional[str] = None
+    resolution: Optional[str] = None
+
+    def output_file_name(self) -> str:
+        return re.sub(r"[^\w.-]", "_", self.id) + ".png"
+
+
+def _split_images(value: Any) -> List[str]:
+    """JSONL 中为列表; CSV 中为以 ';' 或 '|' 分隔的字符串"""
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value if v]
+    return [part.strip() for part in re.split(r"[;|]", str(value)) if part.strip()]
+
+
+def _to_item(raw: Dict[str, Any], index: int, base_dir: str) -> BatchItem:
+    values = {}
+    for key, value in raw.items():
+        name = _COLUMN_ALIASES.get(str(key).strip().lower())
+        if name and value not in (None, ""):
+            values[name] = value
+
+    image_paths = [path if os.path.isabs(path) else os.path.join(base_dir, path)
+                   for path in _split_images(values.get("image_paths"))]
+    item = BatchItem(
+        id=str(values.get("id") or f"row{index:05d}"),
+        prompt=str(values.get("prompt", "")),
+        image_paths=image_paths,
+        model_id=values.get("model_id"),
+        aspect_ratio=values.get("aspect_ratio"),
+        resolution=values.get("resolution"),
+    )
+    if not item.prompt and not item.image_paths:
+        raise ValueError(f"Manifest row {index} ({item.id}) has neither a prompt nor images.")
+    return item
+
+
+def load_manifest(path: str) -> List[BatchItem]:
+    """
+    读取 JSONL 或 CSV 清单。每行包含 prompt / images / model / aspect_ratio / resolution 以及可选的 id。
+    图片的相对路径相对于清单文件所在目录。
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    rows: List[Dict[str, Any]] = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON on line {line_no} of {path}: {e}") from e
+
+    items = [_to_item(row, index, base_dir) for index, row in enumerate(rows, 1)]
+    seen = set()
+    for item in items:
+        if item.id in seen:
+            raise ValueError(f"Duplicate id '{item.id}' in manifest.")
+        seen.add(item.id)
+    return items
+
+
+def load_results(output_dir: str) -> Dict[str, Dict[str, Any]]:
+    """读取已有的结果清单, 返回每个 id 的最后一条记录"""
+    results = {}
+    path = os.path.join(output_dir, RESULTS_FILE_NAME)
+    if not os.path.exists(path):
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 上次运行中断时最后一行可能不完整
+                continue
+            results[record.get("id")] = record
+    return results
+
+
+def pending_items(items: List[BatchItem], output_dir: str) -> List[BatchItem]:
+    """断点续跑: 跳过结果清单中已成功且输出文件仍然存在的条目"""
+    done = {
+        item_id for item_id, record in load_results(output_dir).items()
+        if record.get("status") == "success" and record.get("output") and os.path.exists(record["output"])
+    }
+    return [item for item in items if item.id not in done]
+
+
+class ResultWriter:
+    """以追加方式写结果清单, 每条记录立即落盘, 便于中断后续跑"""
+
+    def __init__(self, output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        self.path = os.path.join(output_dir, RESULTS_FILE_NAME)
+        self._file = open(self.path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def write(self, item: BatchItem, status: str, output: Optional[str] = None, error: Optional[str] = None,
+              duration: Optional[float] = None):
+        record = {**asdict(item), "status": status, "output": output, "error": error,
+                  "duration": round(duration, 3) if duration is not None else None}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
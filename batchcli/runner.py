@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+from typing import Callable, List, Optional, Dict, Any
+
+from common import tracing
+from common.config import MODEL_SELECTOR_DEFAULT
+from common.job_manager import JobManager, Job
+from batchcli.manifest import BatchItem, ResultWriter
+
+
+def generate_and_save(output_path: str, generate: Callable, **kwargs) -> str:
+    """在工作线程中执行: 调用 API 生成图片并保存, 返回输出路径"""
+    image = generate(**kwargs)
+    if image is None:
+        # call_google_genai 失败时只记录日志并返回 None
+        raise RuntimeError("No image returned, see log for details.")
+    with tracing.span(tracing.SPAN_SAVE):
+        image.save(output_path, format="PNG")
+    return output_path
+
+
+class ProgressReporter:
+    """在终端打印每个任务的结果、吞吐量和预计剩余时间"""
+
+    def __init__(self, total: int, stream=None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self.stream = stream or sys.stderr
+
+    def update(self, item: BatchItem, status: str, detail: str):
+        self.done += 1
+        if status != "success":
+            self.failed += 1
+        elapsed = time.time() - self.started_at
+        rate = self.done / elapsed * 60 if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / (self.done / elapsed) if self.done and elapsed > 0 else 0.0
+        print(f"[{self.done}/{self.total}] {status:<7} {item.id} {detail} | "
+              f"{rate:.1f} jobs/min, failed {self.failed}, ETA {int(eta // 60)}m{int(eta % 60):02d}s",
+              file=self.stream, flush=True)
+
+
+async def run_batch(items: List[BatchItem], output_dir: str, api_key: str, workers: int = 2,
+                    defaults: Optional[Dict[str, Any]] = None, generate: Optional[Callable] = None,
+                    reporter: Optional[ProgressReporter] = None) -> ProgressReporter:
+    """
+    通过 JobManager 以 workers 个并发工作协程执行所有条目, 输出图片和结果清单写入 output_dir。
+    """
+    if generate is None:
+        from geminiapi import api_client  # pylint: disable=import-outside-toplevel
+        generate = api_client.call_google_genai
+    defaults = defaults or {}
+    reporter = reporter or ProgressReporter(len(items))
+    os.makedirs(output_dir, exist_ok=True)
+    writer = ResultWriter(output_dir)
+    manager = JobManager(max_workers=workers, history_limit=max(50, workers * 2))
+
+    def make_job(item: BatchItem) -> Job:
+        output_path = os.path.abspath(os.path.join(output_dir, item.output_file_name()))
+        job = Job(
+            id=f"batch_{item.id}",
+            name=f"Batch: {item.id}",
+            task_func=generate_and_save,
+            kwargs={
+                "output_path": output_path,
+                "generate": generate,
+                "prompt": item.prompt,
+                "image_paths": item.image_paths,
+                "api_key": api_key,
+                "model_id": item.model_id or defaults.get("model_id") or MODEL_SELECTOR_DEFAULT,
+                "aspect_ratio": item.aspect_ratio or defaults.get("aspect_ratio") or "ar_none",
+                "resolution": item.resolution or defaults.get("resolution") or "2K",
+            },
+        )
+
+        def on_success(path):
+            duration = time.time() - job.started_at
+            writer.write(item, "success", output=path, duration=duration)
+            reporter.update(item, "success", f"-> {path} ({duration:.1f}s)")
+
+        def on_error(error_msg):
+            duration = time.time() - job.started_at
+            writer.write(item, "error", error=error_msg, duration=duration)
+            reporter.update(item, "error", error_msg)
+
+        job.on_success = on_success
+        job.on_error = on_error
+        return job
+
+    try:
+        for item in items:
+            await manager.add_job(make_job(item))
+        await manager.join()
+    finally:
+        await manager.stop_workers()
+        writer.close()
+    return reporter
@@ -0,0 +1,82 @@
+"""
+端到端基准测试, 结果写入 JSON 文件以便比较不同版本:
+
+    python -m benchmarks -o bench.json
+    python -m benchmarks --quick -o new.json --compare bench.json
+
+所有测试都在临时目录中运行 (独立的数据库、日志和图库文件), API 请求发往本地模拟服务
+(devtools/fake_gemini_server.py), 不需要网络和 API Key。
+"""
+import argparse
+import json
+import os
+import sys
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import harness, suites  # pylint: disable=wrong-import-position
+
+SUITES = ("jobs", "gallery", "history", "database", "logger")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Measure job throughput, file scans, DB and logger latency.")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--only", help=f"Comma-separated subset of: {', '.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes for a fast smoke run")
+    parser.add_argument("--workers", help="Comma-separated worker counts (default: 1,2,4,8)")
+    parser.add_argument("--jobs", type=int, help="Jobs per worker count (default: 200, quick: 40)")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Median latency of the fake backend")
+    parser.add_argument("--gallery-sizes", help="Comma-separated file counts (default: 1000,10000,100000)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    selected = set(args.only.split(",")) if args.only else set(SUITES)
+    unknown = selected - set(SUITES)
+    if unknown:
+        print(f"Unknown suites: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    worker_counts = harness.parse_sizes(args.workers, [1, 2, 4, 8])
+    job_count = args.jobs or (40 if args.quick else 200)
+    gallery_sizes = harness.parse_sizes(args.gallery_sizes, [1000, 10000] if args.quick else [1000, 10000, 100000])
+
+    results = {}
+    with harness.isolated_environment() as work_dir:
+        if "jobs" in selected:
+            print(f"Job throughput ({job_count} jobs, workers {worker_counts})...", file=sys.stderr)
+            results["jobs"] = suites.bench_job_throughput(worker_counts, job_count, args.latency_ms)
+        if "gallery" in selected:
+            print(f"Gallery scan ({gallery_sizes} files)...", file=sys.stderr)
+            results["gallery_scan"] = suites.bench_gallery_scan(work_dir, gallery_sizes)
+        if "history" in selected:
+            print("History load...", file=sys.stderr)
+            results["history"] = suites.bench_history_details(work_dir, 50 if args.quick else 200)
+        if "database" in selected:
+            print("Database operations...", file=sys.stderr)
+            results["database"] = suites.bench_database(100 if args.quick else 500)
+        if "logger" in selected:
+            print("Logger throughput...", file=sys.stderr)
+            results["logger"] = suites.bench_logger(5000 if args.quick else 50000)
+
+    report = {"environment": harness.environment_info(), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        changes = harness.compare(baseline.get("results", {}), results)
+        print("\n".join(changes) if changes else "No change above 10%.")
+        return 1 if any("REGRESSED" in line for line in changes) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
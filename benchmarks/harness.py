@@ -0,0 +1,124 @@
+import contextlib
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Any, List, Iterator, Optional
+
+from common import database as db, logger_utils, token_ledger
+from geminiapi import key_pool
+from geminiapi.key_pool import KeyPool
+
+
+def summarize(samples: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """样本的 p50 / p99 / 平均值 / 最大值, 默认从秒换算为毫秒"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale
+
+    return {
+        "count": len(ordered),
+        "p50": round(pick(0.5), 3),
+        "p99": round(pick(0.99), 3),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+
+def time_calls(func: Callable[[int], Any], iterations: int) -> Dict[str, float]:
+    """调用 func(i) iterations 次, 返回每次耗时 (毫秒) 的统计"""
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def timed(func: Callable[[], Any]) -> float:
+    """单次调用的耗时 (秒)"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def isolated_environment() -> Iterator[str]:
+    """
+    在临时目录中运行基准测试: 独立的数据库和日志文件, 全新的 Key 池, 控制台只输出警告,
+    不会影响本机的应用数据。返回临时目录路径。
+    """
+    original_db_file, original_pool = db.DB_FILE, key_pool.pool
+    with tempfile.TemporaryDirectory(prefix="gemini-bench-") as tmp_dir:
+        db.DB_FILE = os.path.join(tmp_dir, "bench.sqlite")
+        key_pool.pool = KeyPool()
+        conn = db.get_db_connection()
+        db.init_db(conn)
+        conn.close()
+        logger_utils.set_console_level(logger_utils.WARNING)
+        logger_utils.configure_file_sink(True, path=os.path.join(tmp_dir, "logs", "bench.jsonl"))
+        try:
+            yield tmp_dir
+        finally:
+            token_ledger.flush()
+            logger_utils.configure_file_sink(False)
+            db.DB_FILE, key_pool.pool = original_db_file, original_pool
+
+
+def environment_info() -> Dict[str, Any]:
+    """结果文件中记录的运行环境, 便于比较不同机器或提交之间的结果"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=False).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """将嵌套的结果展开为 "a.b.c" -> 数值"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+# 越大越好的指标 (吞吐量), 其余指标 (耗时) 越小越好
+_HIGHER_IS_BETTER = ("per_sec", "per_second")
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1) -> List[str]:
+    """逐项比较两次结果, 返回变化超过 threshold 的指标说明"""
+    old, new = flatten(baseline), flatten(current)
+    lines = []
+    for name in sorted(old.keys() & new.keys()):
+        if name.endswith(".count") or old[name] == 0:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        if abs(change) < threshold:
+            continue
+        better = change > 0 if name.endswith(_HIGHER_IS_BETTER) else change < 0
+        lines.append(f"{'improved' if better else 'REGRESSED':>9}  {name}: {old[name]:g} -> {new[name]:g} "
+                     f"({change:+.0%})")
+    return lines
+
+
+def parse_sizes(text: Optional[str], default: List[int]) -> List[int]:
+    if not text:
+        return default
+    return [int(part) for part in text.split(",") if part.strip()]
@@ -0,0 +1,139 @@
+"""
+各项基准测试。每个函数返回可直接写入 JSON 的结果字典; 耗时单位为毫秒, 吞吐量以 *_per_sec 结尾。
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Any, List
+
+from PIL import Image
+
+from benchmarks.harness import summarize, time_calls, timed
+from common import database as db, logger_utils
+from common.config import VALID_IMAGE_EXTENSIONS
+from common.image_util import list_images, list_images_by_mtime, get_image_details
+from common.job_manager import JobManager, Job
+from devtools.fake_gemini_server import FakeGeminiServer, FakeConfig
+from geminiapi import api_client
+
+BENCH_MODEL = "gemini-3-pro-image-preview"
+
+
+# --- JobManager + api_client, 使用本地模拟服务 ---
+async def _run_jobs(workers: int, job_count: int) -> Dict[str, Any]:
+    manager = JobManager(max_workers=workers, history_limit=job_count)
+    jobs = [Job(id=f"bench_{workers}_{i}", name=f"bench {i}", task_func=api_client.call_google_genai,
+                kwargs={"prompt": f"benchmark image {i}", "image_paths": [], "api_key": "bench-key",
+                        "model_id": BENCH_MODEL, "aspect_ratio": "1:1", "resolution": "1K"})
+            for i in range(job_count)]
+    start = time.perf_counter()
+    await manager.add_jobs(jobs, f"bench_{workers}", "benchmark")
+    await manager.join()
+    wall = time.perf_counter() - start
+    await manager.stop_workers()
+    return {
+        "jobs_per_sec": round(job_count / wall, 3),
+        "wall_seconds": round(wall, 3),
+        "job_latency_ms": summarize([job.finished_at - job.started_at for job in jobs]),
+        "end_to_end_ms": summarize([job.finished_at - job.created_at for job in jobs]),
+    }
+
+
+def bench_job_throughput(worker_counts: List[int], job_count: int, latency_ms: float) -> Dict[str, Any]:
+    """不同并发数下, 经 JobManager 和 api_client 完成任务的吞吐量和耗时"""
+    config = FakeConfig(latency_ms=latency_ms, latency_sigma=0.3, seed=42)
+    results: Dict[str, Any] = {"backend_latency_ms": latency_ms, "jobs": job_count}
+    with FakeGeminiServer(config) as server:
+        api_client.set_base_url(server.url)
+        try:
+            for workers in worker_counts:
+                results[f"workers_{workers}"] = asyncio.run(_run_jobs(workers, job_count))
+        finally:
+            api_client.set_base_url(None)
+        results["server"] = server.snapshot_stats()
+    return results
+
+
+# --- 图库扫描和历史记录 ---
+def _populate(directory: str, file_count: int):
+    """生成 file_count 个空文件, 其中约 10% 不是图片, 另有一个子目录"""
+    os.makedirs(os.path.join(directory, "sub"), exist_ok=True)
+    for i in range(file_count):
+        ext = ".txt" if i % 10 == 9 else (".png", ".jpg", ".webp")[i % 3]
+        with open(os.path.join(directory, f"img_{i:06d}{ext}"), "wb"):
+            pass
+
+
+def _listdir_baseline(directory: str) -> List[str]:
+    """重构前的写法 (os.listdir + 每个文件一次 isfile), 作为参照"""
+    paths = []
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path) and os.path.splitext(filename)[1].lower() in VALID_IMAGE_EXTENSIONS:
+            paths.append(path)
+    return paths
+
+
+def bench_gallery_scan(work_dir: str, sizes: List[int], repeats: int = 3) -> Dict[str, Any]:
+    """素材图库 (list_images) 和历史记录 (list_images_by_mtime) 的目录扫描耗时"""
+    results = {}
+    for size in sizes:
+        directory = os.path.join(work_dir, f"gallery_{size}")
+        _populate(directory, size)
+        results[f"files_{size}"] = {
+            "list_images_ms": summarize([timed(lambda d=directory: list_images(d)) for _ in range(repeats)]),
+            "list_images_recursive_ms": summarize(
+                [timed(lambda d=directory: list_images(d, True)) for _ in range(repeats)]),
+            "history_scan_ms": summarize(
+                [timed(lambda d=directory: list_images_by_mtime(d)) for _ in range(repeats)]),
+            "listdir_baseline_ms": summarize(
+                [timed(lambda d=directory: _listdir_baseline(d)) for _ in range(repeats)]),
+        }
+    return results
+
+
+def bench_history_details(work_dir: str, image_count: int) -> Dict[str, Any]:
+    """历史记录页为每张图片读取尺寸和比例 (get_image_details) 的耗时"""
+    directory = os.path.join(work_dir, "history")
+    os.makedirs(directory, exist_ok=True)
+    for i in range(image_count):
+        Image.new("RGB", (1024 + i % 3 * 512, 1024), (i % 255, 100, 50)).save(os.path.join(directory, f"h_{i}.png"))
+    paths = list_images_by_mtime(directory)
+    return {
+        "images": image_count,
+        "load_ms": round(timed(lambda: [get_image_details(p) for p in list_images_by_mtime(directory)]) * 1000, 3),
+        "details_per_image_ms": time_calls(lambda i: get_image_details(paths[i]), len(paths)),
+    }
+
+
+# --- 数据库 ---
+def bench_database(iterations: int) -> Dict[str, Any]:
+    """common.database 常用操作的单次耗时"""
+    results = {
+        "save_setting_ms": time_calls(lambda i: db.save_setting("bench_setting", i), iterations),
+        "get_setting_ms": time_calls(lambda i: db.get_setting("bench_setting"), iterations),
+        "save_prompt_ms": time_calls(lambda i: db.save_prompt(f"bench prompt {i}", "content " * 20), iterations),
+        "get_all_prompts_ms": time_calls(lambda i: db.get_all_prompts(), max(1, iterations // 10)),
+    }
+    row = {"ts": time.time(), "model": BENCH_MODEL, "kind": "image", "job_id": "bench", "key_fingerprint": "x",
+           "prompt_tokens": 10, "candidates_tokens": 1290, "total_tokens": 1300, "prompt_preview": "bench"}
+    results["insert_token_usage_batch50_ms"] = time_calls(lambda i: db.insert_token_usage([row] * 50), iterations)
+    results["token_usage_by_day_ms"] = time_calls(lambda i: db.get_token_usage_by_day(), max(1, iterations // 10))
+    return results
+
+
+# --- 日志 ---
+def bench_logger(line_count: int) -> Dict[str, Any]:
+    """日志调用的吞吐量 (写入后台文件线程), 以及写线程把队列写完所需的时间"""
+    logger_utils.configure_file_sink(True, path=os.path.join(os.path.dirname(db.DB_FILE), "logs", "logger.jsonl"))
+    start = time.perf_counter()
+    for i in range(line_count):
+        logger_utils.debug(f"benchmark log line {i}", job_id="bench", model=BENCH_MODEL)
+    call_seconds = time.perf_counter() - start
+    drain_seconds = timed(lambda: logger_utils.configure_file_sink(False))
+    return {
+        "lines": line_count,
+        "lines_per_sec": round(line_count / call_seconds, 1),
+        "call_us": round(call_seconds / line_count * 1e6, 3),
+        "drain_ms": round(drain_seconds * 1000, 3),
+    }
@@ -0,0 +1,237 @@
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from common import logger_utils
+from common.config import STORAGE_DIR
+from common.image_util import ImageRef
+
+CHAT_DIR = os.path.join(STORAGE_DIR, "chats")
+
+ROLE_USER = "user"
+ROLE_MODEL = "model"
+
+
+@dataclass
+class ChatTurn:
+    """
+    对话中的一条消息。parts 中每一项为 {"text": ...} 或 {"image": 路径, "digest": ...},
+    模型回复的部分可以带 "signature" (base64 编码的 thought signature), 重建上下文时原样发回。
+    """
+    role: str
+    parts: List[Dict[str, Any]]
+    ts: float = field(default_factory=time.time)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(part["text"] for part in self.parts if "text" in part)
+
+    @property
+    def image_count(self) -> int:
+        return sum(1 for part in self.parts if "image" in part)
+
+
+def make_part(value: Any, signature: Optional[bytes] = None) -> Dict[str, Any]:
+    """将文本或 ImageRef 转换为可写入 JSON 的消息片段"""
+    if isinstance(value, ImageRef):
+        part = {"image": value.path, "digest": value.digest}
+    elif isinstance(value, str):
+        part = {"text": value}
+    else:
+        raise TypeError(f"Unsupported chat part: {type(value).__name__}")
+    if signature:
+        part["signature"] = base64.b64encode(signature).decode("ascii")
+    return part
+
+
+@dataclass
+class ChatTranscript:
+    id: str
+    title: str = ""
+    model: str = ""
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    turns: List[ChatTurn] = field(default_factory=list)
+
+    @classmethod
+    def new(cls, title: str = "", model: str = "") -> "ChatTranscript":
+        return cls(id=f"chat_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}", title=title, model=model)
+
+    def add_turn(self, role: str, parts: List[Dict[str, Any]]) -> ChatTurn:
+        turn = ChatTurn(role, parts)
+        self.turns.append(turn)
+        self.updated_at = turn.ts
+        if not self.title and role == ROLE_USER and turn.text:
+            self.title = turn.text[:40]
+        return turn
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChatTranscript":
+        turns = [ChatTurn(**turn) for turn in data.get("turns", [])]
+        return cls(id=data["id"], title=data.get("title", ""), model=data.get("model", ""),
+                   created_at=data.get("created_at", 0.0), updated_at=data.get("updated_at", 0.0), turns=turns)
+
+
+class ChatStore:
+    """
+    对话记录的持久化: 每个会话一个 JSON 文件, 图片只保存路径和内容哈希。
+    写入先写临时文件再改名, 程序中途退出也不会留下损坏的记录。
+    """
+
+    def __init__(self, directory: str = CHAT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def save(self, transcript: ChatTranscript):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(transcript.id)
+        with self._lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(transcript.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def load(self, session_id: str) -> Optional[ChatTranscript]:
+        try:
+            with open(self._path(session_id), encoding="utf-8") as f:
+                return ChatTranscript.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger_utils.warning(f"Cannot read chat transcript {session_id}: {e}")
+            return None
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def list_sessions(self) -> List[ChatTranscript]:
+        """所有会话, 最近更新的在前"""
+        transcripts = []
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        for name in names:
+            transcript = self.load(name[:-len(".json")])
+            if transcript is not None:
+                transcripts.append(transcript)
+        transcripts.sort(key=lambda t: t.updated_at, reverse=True)
+        return transcripts
+
+    def latest(self) -> Optional[ChatTranscript]:
+        sessions = self.list_sessions()
+        return sessions[0] if sessions else None
+
+
+# --- 上下文策略 ---
+# 发送给模型的历史: [(role, [文本 / ImageRef, ...], [signature 或 None, ...]), ...]
+HistoryTurn = Tuple[str, List[Any], List[Optional[bytes]]]
+
+
+@dataclass
+class ChatContext:
+    history: List[HistoryTurn]
+    summary: str = ""          # 被裁掉的较早消息的摘要, 作为 system instruction 发送
+    dropped_turns: int = 0
+    dropped_images: int = 0
+
+
+@dataclass
+class ContextPolicy:
+    """
+    控制每轮请求携带多少历史:
+    - max_turns: 只保留最近 N 轮 (一问一答为一轮)
+    - image_turns: 只有最近 N 轮保留图片, 更早的图片换成文字占位
+    - summarize: 被裁掉的消息是否以文字摘要的形式保留 (截取各条消息的开头, 不额外调用模型)
+    max_turns / image_turns 为 0 时表示不限制。
+    """
+    max_turns: int = 10
+    image_turns: int = 2
+    summarize: bool = True
+    summary_chars: int = 2000
+    message_chars: int = 200
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "ContextPolicy":
+        def to_int(value, default):
+            try:
+                return max(0, int(value))
+            except (TypeError, ValueError):
+                return default
+        return cls(max_turns=to_int(settings.get("chat_context_turns"), cls.max_turns),
+                   image_turns=to_int(settings.get("chat_image_turns"), cls.image_turns),
+                   summarize=bool(settings.get("chat_summarize", "1")))
+
+    @staticmethod
+    def _round_starts(turns: List[ChatTurn]) -> List[int]:
+        """每一轮 (以用户消息开始) 的起始下标"""
+        return [i for i, turn in enumerate(turns) if turn.role == ROLE_USER]
+
+    def _summarize(self, turns: List[ChatTurn]) -> str:
+        lines = []
+        for turn in turns:
+            text = turn.text.strip().replace("\n", " ")
+            if len(text) > self.message_chars:
+                text = text[:self.message_chars] + "…"
+            if turn.image_count:
+                text = f"{text} [{turn.image_count} image(s)]".strip()
+            if text:
+                lines.append(f"{'User' if turn.role == ROLE_USER else 'Assistant'}: {text}")
+        summary = "\n".join(lines)
+        if len(summary) > self.summary_chars:
+            # 保留最接近当前的部分
+            summary = "…" + summary[-self.summary_chars:]
+        return summary
+
+    def build(self, turns: List[ChatTurn]) -> ChatContext:
+        starts = self._round_starts(turns)
+        first = 0
+        if self.max_turns and len(starts) > self.max_turns:
+            first = starts[-self.max_turns]
+        image_from = 0
+        if self.image_turns and len(starts) > self.image_turns:
+            image_from = starts[-self.image_turns]
+
+        dropped = turns[:first]
+        context = ChatContext(history=[], dropped_turns=len(dropped))
+        if dropped and self.summarize:
+            context.summary = (
+                "Summary of the earlier part of this conversation (older messages are not included):\n"
+                + self._summarize(dropped))
+
+        for index in range(first, len(turns)):
+            turn = turns[index]
+            parts: List[Any] = []
+            signatures: List[Optional[bytes]] = []
+            for part in turn.parts:
+                signature = base64.b64decode(part["signature"]) if part.get("signature") else None
+                if "image" in part:
+                    if index < image_from:
+                        context.dropped_images += 1
+                        parts.append(f"[image omitted: {os.path.basename(part['image'])}]")
+                        signatures.append(None)
+                        continue
+                    parts.append(ImageRef(part["image"], part.get("digest", "")))
+                else:
+                    parts.append(part.get("text", ""))
+                signatures.append(signature)
+            context.history.append((turn.role, parts, signatures))
+        return context
+
+
+# Global instance
+store = ChatStore()
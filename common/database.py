@@ -1,5 +1,7 @@
+import json
 import os
 import sqlite3
+import time
 
 from common import logger_utils
 from common.config import DB_FILE, STORAGE_DIR
@@ -12,22 +14,27 @@ def get_db_connection():
 def init_db(conn):
     """Initializes the database table structure."""
     logger_utils.log("Initializing new database schema.")
+    migrate_db(conn)
     c = conn.cursor()
-    # 1. Settings table
-    c.execute('''CREATE TABLE IF NOT EXISTS settings
-                 (key TEXT PRIMARY KEY, value TEXT)''')
-    # 2. Prompt table
-    c.execute('''CREATE TABLE IF NOT EXISTS prompts
-                 (title TEXT PRIMARY KEY, content TEXT, order_id INTEGER)''')
     # Add default settings if needed
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("language", "en"))
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("save_path", "outputs"))
     c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("file_prefix", "gemini_gen"))
     conn.commit()
 
-def migrate_db(conn):
-    """Migrates the database schema to the latest version."""
-    c = conn.cursor()
+
+# --- Schema Migrations ---
+# Each migration upgrades the schema by exactly one version. The current version
+# is kept in SQLite's `PRAGMA user_version`, so a step runs at most once per file.
+# Migrations must be idempotent: databases created before versioning was introduced
+# start at version 0 even though some of their tables already exist.
+
+def _migration_001_base_schema(c):
+    """Settings and prompts tables, including the legacy `order_id` upgrade."""
+    c.execute('''CREATE TABLE IF NOT EXISTS settings
+                 (key TEXT PRIMARY KEY, value TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS prompts
+                 (title TEXT PRIMARY KEY, content TEXT, order_id INTEGER)''')
     c.execute("PRAGMA table_info(prompts)")
     columns = [row[1] for row in c.fetchall()]
     if "order_id" not in columns:
@@ -35,10 +42,81 @@ def migrate_db(conn):
         c.execute("ALTER TABLE prompts ADD COLUMN order_id INTEGER")
         c.execute("SELECT title FROM prompts")
         titles = [row[0] for row in c.fetchall()]
-        for i, title in enumerate(titles):
-            c.execute("UPDATE prompts SET order_id = ? WHERE title = ?", (i, title))
+        c.executemany("UPDATE prompts SET order_id = ? WHERE title = ?",
+                      [(i, title) for i, title in enumerate(titles)])
+
+
+def _migration_002_prompt_order_index(c):
+    """Index backing every `ORDER BY order_id` / `MAX(order_id)` prompt query."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_prompts_order_id ON prompts (order_id)")
+
+
+def _migration_003_token_usage(c):
+    """Ledger of token counts reported in each API response's `usage_metadata`."""
+    c.execute('''CREATE TABLE IF NOT EXISTS token_usage
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  ts REAL NOT NULL,
+                  model TEXT,
+                  kind TEXT,
+                  job_id TEXT,
+                  key_fingerprint TEXT,
+                  prompt_tokens INTEGER DEFAULT 0,
+                  candidates_tokens INTEGER DEFAULT 0,
+                  total_tokens INTEGER DEFAULT 0,
+                  prompt_preview TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_ts ON token_usage (ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_token_usage_model_ts ON token_usage (model, ts)")
+
+
+def _migration_004_api_keys(c):
+    """Pool of API keys used in rotation next to the single `api_key` setting."""
+    c.execute('''CREATE TABLE IF NOT EXISTS api_keys
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  label TEXT,
+                  api_key TEXT NOT NULL UNIQUE,
+                  enabled INTEGER NOT NULL DEFAULT 1,
+                  created_at REAL)''')
+
+
+# Ordered list of (version, migration). Append new steps at the end, never reorder.
+MIGRATIONS = [
+    (1, _migration_001_base_schema),
+    (2, _migration_002_prompt_order_index),
+    (3, _migration_003_token_usage),
+    (4, _migration_004_api_keys),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db(conn):
+    """Migrates the database schema to the latest version, one transaction per step."""
+    current_version = get_schema_version(conn)
+    if current_version > SCHEMA_VERSION:
+        logger_utils.log(f"Database schema version {current_version} is newer than this app ({SCHEMA_VERSION}).")
+        return
+
+    for version, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        # Flush any implicit transaction so the step below owns its own BEGIN/COMMIT.
         conn.commit()
-        logger_utils.log("Database migration complete.")
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN")
+            migration(c)
+            # user_version is transactional, so it only advances if the step succeeds
+            c.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger_utils.log(f"Database migration to version {version} failed, rolled back.")
+            raise
+        logger_utils.log(f"Database migrated to schema version {version} ({migration.__name__}).")
+        current_version = version
 
 
 def ensure_db_exists():
@@ -123,6 +201,149 @@ def import_all_data(data: dict):
     finally:
         conn.close()
 
+# --- Streaming (NDJSON) Import/Export ---
+# The NDJSON backup holds one JSON object per line: a header line first, then one
+# {"table": ..., "row": {...}} line per database row. Neither side ever holds a whole
+# table in memory, so the format scales to large libraries.
+EXPORT_FORMAT = "gemini-image-tool-ndjson"
+# Exported tables and their columns, in export order. Add future tables here.
+EXPORT_TABLES = {
+    "settings": ("key", "value"),
+    "prompts": ("title", "content", "order_id"),
+    "api_keys": ("label", "api_key", "enabled", "created_at"),
+}
+EXPORT_ORDER_BY = {"prompts": "order_id", "api_keys": "id"}
+STREAM_CHUNK_SIZE = 500
+
+
+def export_all_data_ndjson(file_path, progress_callback=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streams all exportable tables into an NDJSON file.
+    progress_callback(done_rows, total_rows) is called after every chunk.
+    Returns the number of exported rows.
+    """
+    conn = get_db_connection()
+    tmp_path = f"{file_path}.part"
+    try:
+        c = conn.cursor()
+        counts = {}
+        for table in EXPORT_TABLES:
+            c.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = c.fetchone()[0]
+        total = sum(counts.values())
+        done = 0
+
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+            header = {"format": EXPORT_FORMAT, "schema_version": get_schema_version(conn), "counts": counts}
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+            for table, columns in EXPORT_TABLES.items():
+                query = f"SELECT {', '.join(columns)} FROM {table}"
+                if table in EXPORT_ORDER_BY:
+                    query += f" ORDER BY {EXPORT_ORDER_BY[table]}"
+                c.execute(query)
+                while rows := c.fetchmany(chunk_size):
+                    f.writelines(
+                        json.dumps({"table": table, "row": dict(zip(columns, row))}, ensure_ascii=False) + "\n"
+                        for row in rows
+                    )
+                    done += len(rows)
+                    if progress_callback:
+                        progress_callback(done, total)
+
+        # Only replace the target once the export is complete
+        os.replace(tmp_path, file_path)
+        logger_utils.log(f"Exported {done} rows to {file_path}.")
+        return done
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def import_all_data_ndjson(file_path, progress_callback=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Wipes and imports all exportable tables from an NDJSON file in a single transaction.
+    The file must start with the export header line; otherwise ValueError is raised and nothing is deleted.
+    Rows are inserted with chunked executemany calls while the file is being read.
+    progress_callback(bytes_read, total_bytes) is called after every chunk.
+    Returns a dict of imported row counts per table.
+    """
+    total_bytes = os.path.getsize(file_path)
+    counts = dict.fromkeys(EXPORT_TABLES, 0)
+    pending = {table: [] for table in EXPORT_TABLES}
+    bytes_read = 0
+
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    def flush(table):
+        columns = EXPORT_TABLES[table]
+        placeholders = ", ".join("?" for _ in columns)
+        c.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                      pending[table])
+        counts[table] += len(pending[table])
+        pending[table].clear()
+        if progress_callback:
+            progress_callback(bytes_read, total_bytes)
+
+    try:
+        with open(file_path, "rb") as f:
+            lines = enumerate(f, start=1)
+            # The first non-empty line must be the export header; nothing is deleted before it has been checked
+            for line_no, raw_line in lines:
+                bytes_read += len(raw_line)
+                if raw_line.strip():
+                    header = json.loads(raw_line)
+                    if not isinstance(header, dict) or "table" in header or header.get("format") != EXPORT_FORMAT:
+                        raise ValueError(f"Line {line_no}: not a {EXPORT_FORMAT} file.")
+                    break
+            else:
+                raise ValueError(f"Empty file, not a {EXPORT_FORMAT} file.")
+
+            c.execute("BEGIN TRANSACTION")
+            for table in EXPORT_TABLES:
+                c.execute(f"DELETE FROM {table}")
+
+            for line_no, raw_line in lines:
+                bytes_read += len(raw_line)
+                line = raw_line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                table = record.get("table")
+                if table is None:
+                    if record.get("format") != EXPORT_FORMAT:
+                        raise ValueError(f"Line {line_no}: not a {EXPORT_FORMAT} file.")
+                    continue
+                if table not in EXPORT_TABLES:
+                    # Written by a newer version, nothing to import it into
+                    continue
+
+                row = record.get("row") or {}
+                values = [row.get(column) for column in EXPORT_TABLES[table]]
+                if table == "prompts" and values[2] is None:
+                    # Use the position in the file if the row carries no order_id
+                    values[2] = counts[table] + len(pending[table])
+                pending[table].append(tuple(values))
+                if len(pending[table]) >= chunk_size:
+                    flush(table)
+
+        for table, rows in pending.items():
+            if rows:
+                flush(table)
+
+        conn.commit()
+        logger_utils.log(f"Successfully imported {counts['settings']} settings and {counts['prompts']} prompts.")
+        return counts
+    except Exception as e:
+        conn.rollback()
+        logger_utils.log(f"Data import failed: {e}")
+        raise
+    finally:
+        conn.close()
+
+
 def clear_all_data():
     """Wipes all data from the database and re-initializes it."""
     conn = get_db_connection()
@@ -131,6 +352,8 @@ def clear_all_data():
         c.execute("BEGIN TRANSACTION")
         c.execute("DELETE FROM settings")
         c.execute("DELETE FROM prompts")
+        c.execute("DELETE FROM token_usage")
+        c.execute("DELETE FROM api_keys")
         conn.commit()
         # After clearing, re-initialize with default values
         init_db(conn)
@@ -164,9 +387,56 @@ def get_all_settings():
         "last_dir": get_setting("last_dir", ""),
         "save_path": get_setting("save_path", "outputs"),
         "file_prefix": get_setting("file_prefix", "gemini_gen"),
-        "language": get_setting("language", "en")
+        "language": get_setting("language", "en"),
+        "metrics_port": get_setting("metrics_port", ""),
+        "hedge_requests": get_setting("hedge_requests", ""),
+        "hedge_max_percent": get_setting("hedge_max_percent", "10"),
+        "chat_context_turns": get_setting("chat_context_turns", "10"),
+        "chat_image_turns": get_setting("chat_image_turns", "2"),
+        "chat_summarize": get_setting("chat_summarize", "1")
     }
 
+# --- API key pool ---
+def get_api_keys(enabled_only=False):
+    """Gets the pooled API keys as a list of dicts, oldest first."""
+    conn = get_db_connection()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    query = "SELECT id, label, api_key, enabled, created_at FROM api_keys"
+    if enabled_only:
+        query += " WHERE enabled = 1"
+    c.execute(query + " ORDER BY id")
+    keys = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return keys
+
+def add_api_key(api_key, label=""):
+    api_key = (api_key or "").strip()
+    if not api_key:
+        return False
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("INSERT OR IGNORE INTO api_keys (label, api_key, enabled, created_at) VALUES (?, ?, 1, ?)",
+              (label, api_key, time.time()))
+    added = c.rowcount > 0
+    conn.commit()
+    conn.close()
+    return added
+
+def set_api_key_enabled(key_id, enabled):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("UPDATE api_keys SET enabled = ? WHERE id = ?", (1 if enabled else 0, key_id))
+    conn.commit()
+    conn.close()
+
+def delete_api_key(key_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM api_keys WHERE id = ?", (key_id,))
+    conn.commit()
+    conn.close()
+
 # --- Prompt related ---
 def save_prompt(title, content):
     if not title or not content:
@@ -230,5 +500,68 @@ def get_all_prompts():
     conn.close()
     return prompts
 
+# --- Token usage ledger ---
+TOKEN_USAGE_COLUMNS = ("ts", "model", "kind", "job_id", "key_fingerprint",
+                       "prompt_tokens", "candidates_tokens", "total_tokens", "prompt_preview")
+
+
+def insert_token_usage(rows):
+    """Inserts a batch of ledger rows (dicts keyed by TOKEN_USAGE_COLUMNS) in one transaction."""
+    if not rows:
+        return
+    conn = get_db_connection()
+    try:
+        placeholders = ", ".join("?" for _ in TOKEN_USAGE_COLUMNS)
+        conn.executemany(f"INSERT INTO token_usage ({', '.join(TOKEN_USAGE_COLUMNS)}) VALUES ({placeholders})",
+                         [tuple(row.get(col) for col in TOKEN_USAGE_COLUMNS) for row in rows])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _token_usage_query(select, group_by, order_by, since=None, until=None, model=None, limit=None):
+    where, params = [], []
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("ts < ?")
+        params.append(until)
+    if model:
+        where.append("model = ?")
+        params.append(model)
+    sql = f"SELECT {select}, COUNT(*) AS requests, SUM(prompt_tokens) AS prompt_tokens, " \
+          f"SUM(candidates_tokens) AS candidates_tokens, SUM(total_tokens) AS total_tokens FROM token_usage"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" GROUP BY {group_by} ORDER BY {order_by}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+
+    conn = get_db_connection()
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def get_token_usage_by_day(since=None, until=None, model=None):
+    """Token totals per local calendar day (and model), oldest day first."""
+    return _token_usage_query("date(ts, 'unixepoch', 'localtime') AS day, model",
+                              "day, model", "day, model", since, until, model)
+
+
+def get_token_usage_by_model(since=None, until=None):
+    """Token totals per model, most expensive first."""
+    return _token_usage_query("model", "model", "total_tokens DESC", since, until)
+
+
+def get_top_prompts_by_tokens(limit=20, since=None, model=None):
+    """Prompt prefixes ranked by total tokens spent, to spot expensive prompt patterns."""
+    return _token_usage_query("prompt_preview, model", "prompt_preview, model", "total_tokens DESC",
+                              since, None, model, limit)
+
+
 # --- Initialization ---
 ensure_db_exists()
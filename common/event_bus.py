@@ -0,0 +1,94 @@
+import asyncio
+import inspect
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 标准主题
+TOPIC_JOBS = "jobs"               # 任务状态变化, payload: List[JobEvent], 与 JobManager 的订阅回调参数相同
+TOPIC_LOG = "log"                 # 新日志行, payload: (new_lines, reset), 与 logger_utils 的回调参数相同
+
+# 事件循环启动前最多缓存的事件数
+MAX_PENDING = 1000
+
+EventCallback = Callable[[Any], Any]
+
+
+class EventBus:
+    """
+    基于 asyncio.Queue 的事件总线: 任意线程都可以 publish(), 订阅者的回调统一在 UI 的事件循环中执行。
+    没有事件时调度协程阻塞在 queue.get() 上, 不会定时唤醒; 事件发生后立即分发, 没有轮询延迟。
+    每个 Flet 页面 (会话) 各有一个总线, 页面关闭时取消 run() 即可。
+
+        bus = EventBus()
+        bus.subscribe(TOPIC_JOBS, on_job_events)
+        page.run_task(bus.run)                    # 在页面的事件循环中启动
+        bus.publish(TOPIC_JOBS, events)           # 在任意线程中发布
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[EventCallback]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Deque[Tuple[str, Any]] = deque(maxlen=MAX_PENDING)
+
+    def subscribe(self, topic: str, callback: EventCallback):
+        with self._lock:
+            callbacks = self._subscribers.setdefault(topic, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+    def unsubscribe(self, topic: str, callback: EventCallback):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def publish(self, topic: str, payload: Any = None):
+        """发布事件 (线程安全)。事件循环尚未启动时先缓存, 启动后按顺序分发。"""
+        with self._lock:
+            loop, queue = self._loop, self._queue
+            if loop is None or queue is None or loop.is_closed():
+                self._pending.append((topic, payload))
+                return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            queue.put_nowait((topic, payload))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (topic, payload))
+
+    async def _dispatch(self, topic: str, payload: Any):
+        with self._lock:
+            callbacks = list(self._subscribers.get(topic, []))
+        for callback in callbacks:
+            try:
+                result = callback(payload)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # 不写入日志: 日志行本身也通过总线分发, 出错时会形成循环
+                print(f"Error in '{topic}' event handler: {e}")
+
+    async def run(self):
+        """在当前事件循环中分发事件, 直到被取消"""
+        with self._lock:
+            if self._loop is not None and not self._loop.is_closed():
+                raise RuntimeError("The event bus is already running.")
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue()
+            pending, self._pending = list(self._pending), deque(maxlen=MAX_PENDING)
+        for topic, payload in pending:
+            self._queue.put_nowait((topic, payload))
+        try:
+            while True:
+                topic, payload = await self._queue.get()
+                await self._dispatch(topic, payload)
+        finally:
+            with self._lock:
+                self._loop = None
+                self._queue = None
+
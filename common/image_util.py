@@ -1,7 +1,87 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Any, List
+
 from PIL import Image
 
-from common import logger_utils
-from common.config import AR_SELECTOR_CHOICES
+from common import logger_utils, i18n
+from common.config import AR_SELECTOR_CHOICES, VALID_IMAGE_EXTENSIONS
+
+
+def _is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in VALID_IMAGE_EXTENSIONS
+
+
+def list_images(directory: str, recursive: bool = False) -> List[str]:
+    """
+    Lists the image files in a directory, in directory order; recursive walks the subdirectories top-down,
+    in os.walk order. Like os.listdir, an unreadable directory raises OSError (os.walk skips unreadable
+    subdirectories). The file type comes from the directory entry instead of one stat() per file.
+    """
+    if recursive:
+        return [os.path.join(root, name) for root, _, files in os.walk(directory)
+                for name in files if _is_image_name(name)]
+    with os.scandir(directory) as entries:
+        return [entry.path for entry in entries if _is_image_name(entry.name) and entry.is_file()]
+
+
+def list_images_by_mtime(directory: str) -> List[str]:
+    """Lists the image files directly inside a directory, newest first."""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if _is_image_name(entry.name) and entry.is_file():
+                entries.append((entry.stat().st_mtime, entry.path))
+    entries.sort(reverse=True)
+    return [path for _, path in entries]
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's content, read in chunks."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@dataclass(frozen=True)
+class ImageRef:
+    """
+    A reference to an image file, used in job payloads instead of a decoded PIL image.
+    The file is only opened by open(), when the job runs.
+    """
+    path: str
+    digest: str = ""  # SHA-256 of the content, identifies the image independently of its path
+
+    @classmethod
+    def from_path(cls, path: str) -> "ImageRef":
+        return cls(path, file_digest(path))
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def open(self) -> Image.Image:
+        """Decodes the image and closes the file, which would otherwise stay open (and locked on Windows)."""
+        with Image.open(self.path) as img:
+            img.load()
+        return img
+
+
+def resolve_parts(parts: List[Any]) -> List[Any]:
+    """
+    Opens the ImageRefs of a prompt; other parts (text, already opened images) are passed through.
+    A reference whose file is missing or unreadable is skipped with a warning, like in the chat history.
+    """
+    resolved = []
+    for part in parts:
+        if isinstance(part, ImageRef):
+            try:
+                part = part.open()
+            except OSError as e:
+                logger_utils.warning(i18n.get("api_log_skipImg", path=part.path, err=e))
+                continue
+        resolved.append(part)
+    return resolved
+
 
 def get_image_details(image_path: str) -> str:
     """
@@ -1,10 +1,19 @@
 import asyncio
 import inspect
+import threading
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Callable, Any, Dict, Optional, List
+from typing import Callable, Any, Deque, Dict, Optional, List, Tuple
 import traceback
 import time
 
+from common import logger_utils, tracing, metrics
+from common.image_util import ImageRef
+from geminiapi.circuit_breaker import breakers, CircuitOpenError
+
+def _is_light(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool, ImageRef))
+
 @dataclass
 class Job:
     id: str
@@ -20,25 +29,182 @@ class Job:
     on_success: Optional[Callable] = None
     on_error: Optional[Callable] = None
     on_finally: Optional[Callable] = None
+    # Latency breakdown, see common.tracing
+    spans: List[Dict[str, Any]] = field(default_factory=list)
+    # Jobs submitted together (e.g. a matrix expansion) share a group id, see JobManager.add_jobs
+    group_id: Optional[str] = None
+    # Jobs sharing a lane (e.g. the turns of one chat session) run one at a time in submission order,
+    # while different lanes run concurrently
+    lane: Optional[str] = None
+
+    def release_payload(self):
+        """
+        Called once the job is finished: keeps only light kwargs (text, numbers, image references) for the
+        history and details views, and drops clients, chat sessions, decoded images and callbacks.
+        """
+        light = {}
+        for key, value in self.kwargs.items():
+            if isinstance(value, (list, tuple)):
+                light[key] = [item for item in value if _is_light(item)]
+            elif _is_light(value):
+                light[key] = value
+        self.kwargs = light
+        self.on_start = self.on_success = self.on_error = self.on_finally = None
+
+    def timing_breakdown(self) -> Dict[str, float]:
+        """Seconds spent per phase (queue wait, preprocess, request, backoff, decode, save)."""
+        return tracing.summarize(self.spans)
+
+    def timing_dict(self) -> Dict[str, Any]:
+        """JSON-serializable summary of where the time went in this job."""
+        total = (self.finished_at - self.created_at) if self.finished_at else None
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "model": self.kwargs.get("model_id"),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "total": total,
+            "breakdown": self.timing_breakdown(),
+            "spans": self.spans,
+        }
+
+@dataclass
+class JobGroup:
+    """Aggregate progress of jobs submitted together with JobManager.add_jobs."""
+    id: str
+    name: str
+    total: int
+    succeeded: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> int:
+        return self.succeeded + self.failed + self.cancelled
+
+    @property
+    def progress(self) -> float:
+        return self.finished / self.total if self.total else 1.0
+
+    @property
+    def is_done(self) -> bool:
+        return self.finished >= self.total
+
+@dataclass(frozen=True)
+class JobEvent:
+    """A job status transition, delivered to JobManager subscribers."""
+    job_id: str
+    old_status: Optional[str]  # None when the job has just been enqueued
+    new_status: str
+    group_id: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+# Subscribers receive every event of one notify window in a single call, oldest first
+JobSubscriber = Callable[[List[JobEvent]], Any]
 
 class JobManager:
-    def __init__(self):
+    MAX_GROUPS = 20
+
+    def __init__(self, max_workers: int = 1, history_limit: int = 50, max_circuit_wait: float = 300.0,
+                 notify_window: float = 0.05, default_lane: Optional[str] = None):
         self.queue = asyncio.Queue()
-        self._worker_task = None
-        self.current_job: Optional[Job] = None
-        self.history: List[Job] = [] # Keep track of recent jobs
-        self._subscribers = []
+        self.max_workers = max(1, max_workers)
+        # Lane for jobs submitted without one: set it to keep them serial while other lanes run concurrently
+        self.default_lane = default_lane
+        self.history_limit = history_limit
+        # How long a job waits for its model's open circuit (see geminiapi.circuit_breaker) before failing fast
+        self.max_circuit_wait = max_circuit_wait
+        self._paused_since: Dict[str, float] = {}
+        # Paused jobs waiting off the queue for their circuit, with the timer that requeues them
+        self._parked: Dict[str, Tuple[Job, asyncio.AbstractEventLoop, asyncio.TimerHandle]] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self.current_job: Optional[Job] = None # Most recently started job
+        self.running_jobs: Dict[str, Job] = {}
+        # Recent jobs in submission order (keyed by object id, job ids are not guaranteed unique), and the
+        # finished ones among them in the order they finished, so trimming never scans queued or running jobs
+        self._jobs: Dict[int, Job] = {}
+        self._finished: Deque[Job] = deque()
+        self.groups: Dict[str, JobGroup] = {}
+        self._subscribers: List[JobSubscriber] = []
         self._cancelled_ids = set()
+        # Lane -> id of the job allowed to run next, and the lane's jobs waiting behind it
+        self._lane_owners: Dict[str, str] = {}
+        self._lane_backlog: Dict[str, Deque[Job]] = {}
+        # Status changes are collected and handed to subscribers once per notify_window, from a separate
+        # event loop callback, so that workers never wait for (possibly slow) UI code
+        self.notify_window = notify_window
+        self._pending_events: List[JobEvent] = []
+        self._events_lock = threading.Lock()
+        self._dispatch_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Loop the workers run on; events raised from other threads are dispatched there
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, callback: JobSubscriber):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
 
-    def subscribe(self, callback: Callable):
-        self._subscribers.append(callback)
+    def unsubscribe(self, callback: JobSubscriber):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
 
-    def _notify(self):
-        for cb in self._subscribers:
+    def _notify(self, job: Job, old_status: Optional[str]):
+        """Records a status change; the dispatch is scheduled once per window, however many events arrive."""
+        with self._events_lock:
+            self._pending_events.append(JobEvent(job.id, old_status, job.status, job.group_id))
+            if self._dispatch_loop is not None and not self._dispatch_loop.is_closed():
+                return  # Already scheduled, the event goes out with that batch
             try:
-                cb()
-            except:
-                pass
+                loop = asyncio.get_running_loop()
+                in_loop = True
+            except RuntimeError:
+                # Called from a plain thread (e.g. cancel_job from a UI handler): hop to the workers' loop,
+                # where async subscribers can be scheduled
+                loop = self._loop if self._loop is not None and not self._loop.is_closed() else None
+                in_loop = False
+            self._dispatch_loop = loop
+        if loop is None:
+            # No loop to dispatch on yet: deliver right away
+            self.flush_events()
+        elif in_loop:
+            loop.call_later(self.notify_window, self.flush_events)
+        else:
+            loop.call_soon_threadsafe(loop.call_later, self.notify_window, self.flush_events)
+
+    def flush_events(self):
+        """Delivers all pending events to the subscribers now."""
+        with self._events_lock:
+            events, self._pending_events = self._pending_events, []
+            self._dispatch_loop = None
+        if not events:
+            return
+        for callback in list(self._subscribers):
+            try:
+                result = callback(events)
+                if inspect.isawaitable(result):
+                    self._schedule(result)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger_utils.error(f"Job subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+    def _schedule(self, awaitable):
+        """Runs an async subscriber's result on the current loop, or on the workers' loop from another thread."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is None or self._loop.is_closed():
+                if inspect.iscoroutine(awaitable):
+                    awaitable.close()
+                raise RuntimeError("no event loop to run the async subscriber on") from None
+            asyncio.run_coroutine_threadsafe(self._await(awaitable), self._loop)
+            return
+        asyncio.ensure_future(awaitable)
+
+    @staticmethod
+    async def _await(awaitable):
+        return await awaitable
 
     async def _maybe_await(self, func, *args, **kwargs):
         if func:
@@ -47,70 +213,254 @@ class JobManager:
                 await res
 
     async def start_worker(self):
-        """Starts the background worker if it's not already running."""
-        if self._worker_task is None or self._worker_task.done():
-            self._worker_task = asyncio.create_task(self._worker_loop())
+        """Starts the background workers (up to max_workers) that are not already running."""
+        self._loop = asyncio.get_running_loop()
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.max_workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker_loop()))
+
+    async def join(self):
+        """Waits until every queued job has finished."""
+        await self.queue.join()
+
+    async def stop_workers(self):
+        """Cancels the background workers, e.g. before the event loop is closed."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self.flush_events()
 
     async def _worker_loop(self):
         while True:
             job: Job = await self.queue.get()
             
             if job.id in self._cancelled_ids:
+                old_status = job.status
                 job.status = "cancelled"
                 job.finished_at = time.time()
                 self._cancelled_ids.remove(job.id)
+                self._paused_since.pop(job.id, None)
+                metrics.JOBS_TOTAL.inc(status=job.status)
+                self._update_group(job)
+                self._finished.append(job)
+                job.release_payload()
+                self._release_lane(job)
+                self.queue.task_done()
+                self._notify(job, old_status)
+                continue
+
+            if not self._claim_lane(job):
+                # Parked behind the running job of its lane; requeued by _release_lane
                 self.queue.task_done()
-                self._notify()
+                continue
+
+            circuit_error = self._check_circuit(job)
+            if circuit_error is None and job.id in self._paused_since:
+                # Set aside until the circuit may let it through, so that jobs for other models run meanwhile
+                self._park(job)
                 continue
 
             self.current_job = job
+            self.running_jobs[job.id] = job
+            old_status = job.status
             job.status = "running"
             job.started_at = time.time()
-            self._notify()
+            job.spans.append({"name": tracing.SPAN_QUEUE_WAIT, "start": job.created_at,
+                              "duration": job.started_at - job.created_at})
+            self._notify(job, old_status)
             
-            try:
-                await self._maybe_await(job.on_start)
-
-                # Execute the task in a thread pool since it's likely blocking (API call)
-                result = await asyncio.to_thread(job.task_func, **job.kwargs)
-
-                job.status = "success"
-                await self._maybe_await(job.on_success, result)
-            except Exception as e:
-                job.status = "error"
-                job.error = str(e)
-                print(f"Error executing job {job.id}: {e}")
-                traceback.print_exc()
-                await self._maybe_await(job.on_error, str(e))
-            finally:
-                job.finished_at = time.time()
-                await self._maybe_await(job.on_finally)
-                self.queue.task_done()
-                self.current_job = None
-                self._notify()
+            # Every log line and span recorded while this job runs (including from the worker thread)
+            # is attributed to it
+            with logger_utils.bind(job_id=job.id), tracing.collect(job.spans):
+                try:
+                    await self._maybe_await(job.on_start)
+                    if circuit_error:
+                        raise circuit_error
+
+                    # Execute the task in a thread pool since it's likely blocking (API call)
+                    result = await asyncio.to_thread(job.task_func, **job.kwargs)
+
+                    job.status = "success"
+                    await self._maybe_await(job.on_success, result)
+                except Exception as e:
+                    job.status = "error"
+                    job.error = str(e)
+                    logger_utils.error(f"Error executing job {job.id}: {e}")
+                    traceback.print_exc()
+                    await self._maybe_await(job.on_error, str(e))
+                finally:
+                    job.finished_at = time.time()
+                    logger_utils.debug(f"Job {job.id} finished with status '{job.status}'.",
+                                       duration_ms=round((job.finished_at - job.started_at) * 1000))
+                    self._record_metrics(job)
+                    self._update_group(job)
+                    self._finished.append(job)
+                    await self._maybe_await(job.on_finally)
+                    job.release_payload()
+                    # Hand the lane over before task_done, so join() never sees an empty queue in between
+                    self._release_lane(job)
+                    self.queue.task_done()
+                    self.running_jobs.pop(job.id, None)
+                    if self.current_job is job:
+                        self.current_job = None
+                    self._notify(job, "running")
+
+    def _claim_lane(self, job: Job) -> bool:
+        """True if the job may run now; otherwise it is parked in its lane's backlog."""
+        if job.lane is None:
+            return True
+        owner = self._lane_owners.get(job.lane)
+        if owner is None or owner == job.id:
+            self._lane_owners[job.lane] = job.id
+            return True
+        self._lane_backlog.setdefault(job.lane, deque()).append(job)
+        return False
+
+    def _release_lane(self, job: Job):
+        """Passes the lane to the next parked job, if any, by putting it back in the queue."""
+        if job.lane is None or self._lane_owners.get(job.lane) != job.id:
+            return
+        backlog = self._lane_backlog.get(job.lane)
+        if backlog:
+            next_job = backlog.popleft()
+            self._lane_owners[job.lane] = next_job.id
+            self.queue.put_nowait(next_job)
+        else:
+            del self._lane_owners[job.lane]
+            self._lane_backlog.pop(job.lane, None)
+
+    def lane_jobs(self, lane: str) -> List[Job]:
+        """Queued and running jobs of a lane, in submission order."""
+        return [job for job in self._jobs.values() if job.lane == lane and job.status in ("queued", "running")]
+
+    def _check_circuit(self, job: Job) -> Optional[CircuitOpenError]:
+        """
+        Pauses jobs whose model has an open circuit: returns None and marks the job as paused while it should
+        wait, or an error to fail the job with once it has waited longer than max_circuit_wait.
+        """
+        model_id = job.kwargs.get("model_id")
+        retry_in = breakers.retry_in(model_id)
+        if retry_in <= 0:
+            self._paused_since.pop(job.id, None)
+            return None
+        paused_since = self._paused_since.setdefault(job.id, time.time())
+        if time.time() - paused_since < self.max_circuit_wait:
+            return None
+        self._paused_since.pop(job.id, None)
+        return CircuitOpenError(model_id, retry_in)
+
+    def _park(self, job: Job):
+        """Requeues a paused job once, when its circuit reopens or its max_circuit_wait runs out."""
+        wait_left = self.max_circuit_wait - (time.time() - self._paused_since[job.id])
+        delay = max(0.0, min(breakers.retry_in(job.kwargs.get("model_id")), wait_left))
+        loop = asyncio.get_running_loop()
+        self._parked[job.id] = (job, loop, loop.call_later(delay, self._unpark, job.id))
+
+    def _unpark(self, job_id: str):
+        parked = self._parked.pop(job_id, None)
+        if parked is None:
+            return  # Already requeued
+        job, _loop, timer = parked
+        timer.cancel()
+        # task_done for the get that parked it only now, so join() keeps waiting for parked jobs
+        self.queue.put_nowait(job)
+        self.queue.task_done()
+
+    def _wake_parked(self, job_id: str):
+        """Requeues a parked job right away (e.g. when cancelled); safe to call from any thread."""
+        parked = self._parked.get(job_id)
+        if parked is not None:
+            parked[1].call_soon_threadsafe(self._unpark, job_id)
+
+    @staticmethod
+    def _record_metrics(job: Job):
+        model = job.kwargs.get("model_id")
+        metrics.JOBS_TOTAL.inc(status=job.status)
+        metrics.JOB_DURATION.observe(job.finished_at - job.started_at, model=model)
+        metrics.JOBS_THROUGHPUT.mark(job.finished_at)
+
+    def _update_group(self, job: Job):
+        group = self.groups.get(job.group_id) if job.group_id else None
+        if group is None:
+            return
+        if job.status == "success":
+            group.succeeded += 1
+        elif job.status == "cancelled":
+            group.cancelled += 1
+        else:
+            group.failed += 1
+
+    @property
+    def history(self) -> List[Job]:
+        """Recent jobs, oldest submission first."""
+        return list(self._jobs.values())
+
+    def _append_history(self, job: Job):
+        self._jobs[id(job)] = job
+        # Keep only the most recent jobs, but never drop one that is still queued or running
+        # (a large group may exceed the limit on its own): the oldest finished job goes first
+        while len(self._jobs) > self.history_limit and self._finished:
+            self._jobs.pop(id(self._finished.popleft()), None)
 
     async def add_job(self, job: Job):
-        self.history.append(job)
-        if len(self.history) > 50: # Keep only last 50 jobs
-            self.history.pop(0)
+        if job.lane is None:
+            job.lane = self.default_lane
+        self._append_history(job)
         await self.queue.put(job)
-        self._notify()
+        self._notify(job, None)
         await self.start_worker()
 
+    async def add_jobs(self, jobs: List[Job], group_id: str, group_name: str) -> JobGroup:
+        """Enqueues several jobs at once as one group; subscribers get all their events in one call."""
+        group = JobGroup(id=group_id, name=group_name, total=len(jobs))
+        self.groups[group_id] = group
+        # Forget the oldest finished groups
+        while len(self.groups) > self.MAX_GROUPS:
+            oldest = next((g for g in self.groups.values() if g.is_done), None)
+            if oldest is None:
+                break
+            del self.groups[oldest.id]
+        for job in jobs:
+            job.group_id = group_id
+            if job.lane is None:
+                job.lane = self.default_lane
+            self._append_history(job)
+            self.queue.put_nowait(job)
+            self._notify(job, None)
+        await self.start_worker()
+        return group
+
+    def get_groups(self) -> List[JobGroup]:
+        return list(self.groups.values())
+
     def cancel_job(self, job_id: str):
         """Marks a job as cancelled. If it's in the queue, it will be skipped."""
-        for job in self.history:
+        for job in self._jobs.values():
             if job.id == job_id and job.status == "queued":
                 self._cancelled_ids.add(job_id)
                 job.status = "cancelled"
-                self._notify()
+                self._notify(job, "queued")
+                self._wake_parked(job_id)
                 return True
         return False
 
+    def cancel_group(self, group_id: str) -> int:
+        """Cancels every job of the group that has not started yet. Returns how many were cancelled."""
+        cancelled = 0
+        for job in self._jobs.values():
+            if job.group_id == group_id and job.status == "queued":
+                self._cancelled_ids.add(job.id)
+                job.status = "cancelled"
+                cancelled += 1
+                self._notify(job, "queued")
+                self._wake_parked(job.id)
+        return cancelled
+
     def get_queue_size(self):
         # Count only queued jobs that aren't marked for cancellation
         count = 0
-        for job in self.history:
+        for job in self._jobs.values():
             if job.status == "queued":
                 count += 1
         return count
@@ -118,5 +468,11 @@ class JobManager:
     def get_all_jobs(self) -> List[Job]:
         return self.history
 
-# Global instance
-job_manager = JobManager()
+    def export_timings(self) -> List[Dict[str, Any]]:
+        """Latency breakdown of all jobs in the history, oldest first."""
+        return [job.timing_dict() for job in self._jobs.values()]
+
+# Global instance. Generation jobs share the default lane and stay serial as before; the extra workers let
+# chat sessions (one lane each) run alongside them and alongside each other
+DEFAULT_LANE = "default"
+job_manager = JobManager(max_workers=4, default_lane=DEFAULT_LANE)
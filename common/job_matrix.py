@@ -0,0 +1,113 @@
+import itertools
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Any
+
+# 单次矩阵展开允许的最大任务数, 防止误操作一次提交过多任务
+MAX_MATRIX_JOBS = 500
+
+# 图片模式: 每个任务都使用全部已选图片 / 每张已选图片单独生成一个任务
+IMAGE_MODE_SHARED = "shared"
+IMAGE_MODE_EACH = "each"
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+@dataclass
+class MatrixSpec:
+    prompt_template: str
+    models: List[str]
+    aspect_ratios: List[str]
+    resolutions: List[str]
+    image_paths: List[str] = field(default_factory=list)
+    image_mode: str = IMAGE_MODE_SHARED
+    # 自定义占位符, 例如 {"style": ["oil painting", "watercolor"]}
+    variables: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def parse_variables(text: str) -> Dict[str, List[str]]:
+    """
+    解析自定义占位符, 每行一个: `name = value1 | value2 | value3`
+    空行和以 # 开头的行会被忽略。
+    """
+    variables: Dict[str, List[str]] = {}
+    for line_no, line in enumerate((text or "").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name, sep, values = line.partition("=")
+        name = name.strip()
+        if not sep or not re.fullmatch(r"\w+", name):
+            raise ValueError(f"Line {line_no}: expected 'name = value1 | value2'")
+        parsed = [value.strip() for value in values.split("|") if value.strip()]
+        if not parsed:
+            raise ValueError(f"Line {line_no}: '{name}' has no values")
+        variables[name] = parsed
+    return variables
+
+
+def substitute(template: str, values: Dict[str, Any]) -> str:
+    """替换 {name} 占位符; 未知的占位符保持原样 (prompt 中可能本来就有花括号)"""
+    return _PLACEHOLDER_RE.sub(lambda m: str(values[m.group(1)]) if m.group(1) in values else m.group(0), template)
+
+
+def count_matrix(spec: MatrixSpec) -> int:
+    image_count = len(spec.image_paths) if spec.image_mode == IMAGE_MODE_EACH and spec.image_paths else 1
+    count = len(spec.models) * len(spec.aspect_ratios) * len(spec.resolutions) * image_count
+    for values in spec.variables.values():
+        count *= len(values)
+    return count
+
+
+def expand_matrix(spec: MatrixSpec, max_jobs: int = MAX_MATRIX_JOBS) -> List[Dict[str, Any]]:
+    """
+    将模板展开为所有参数组合, 返回 call_google_genai 的参数列表 (不含 api_key)。
+    每个组合额外带有 "label" 字段, 用于任务名称。
+
+    模板中可用的占位符: {model} {ar} {resolution} {image} {index} 以及自定义变量。
+    """
+    total = count_matrix(spec)
+    if total == 0:
+        raise ValueError("The matrix is empty: select at least one model, aspect ratio and resolution.")
+    if total > max_jobs:
+        raise ValueError(f"The matrix expands to {total} jobs, more than the limit of {max_jobs}.")
+
+    if spec.image_mode == IMAGE_MODE_EACH and spec.image_paths:
+        image_sets = [[path] for path in spec.image_paths]
+    else:
+        image_sets = [list(spec.image_paths)]
+    var_names = list(spec.variables)
+
+    combos = []
+    for index, (model, ar, res, images, var_values) in enumerate(itertools.product(
+            spec.models, spec.aspect_ratios, spec.resolutions, image_sets,
+            itertools.product(*(spec.variables[name] for name in var_names))), 1):
+        values = dict(zip(var_names, var_values))
+        values.update({
+            "model": model,
+            "ar": ar,
+            "resolution": res,
+            "image": os.path.splitext(os.path.basename(images[0]))[0] if len(images) == 1 else "",
+            "index": index,
+        })
+        label_parts = [ar, res, *var_values]
+        if len(spec.models) > 1:
+            label_parts.insert(0, model)
+        if len(image_sets) > 1:
+            label_parts.append(values["image"])
+        combos.append({
+            "label": " / ".join(str(part) for part in label_parts),
+            "prompt": substitute(spec.prompt_template, values),
+            "image_paths": images,
+            "model_id": model,
+            "aspect_ratio": ar,
+            "resolution": res,
+        })
+    return combos
+
+
+def describe_group(prompt_template: str, count: int) -> str:
+    """任务组的显示名称"""
+    prompt = (prompt_template or "").strip().replace("\n", " ")
+    return f"Matrix ×{count}: {prompt[:20]}..."
@@ -1,61 +1,369 @@
+import atexit
+import contextlib
+import contextvars
 import datetime
-from typing import Callable, List
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, List, Dict, Any, Optional
 
-# 全局日志缓存
-_LOG_BUFFER = []
-# 回调函数列表，用于通知 UI 更新
-_callbacks: List[Callable[[str], None]] = []
+from common.config import STORAGE_DIR
 
+# 内存中保留的最大日志行数
+MAX_LOG_LINES = 500
 
-def subscribe(callback: Callable[[str], None]):
-    """订阅日志更新"""
-    if callback not in _callbacks:
-        _callbacks.append(callback)
+# 日志级别 (与标准库 logging 的数值保持一致)
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
 
+# 日志文件: STORAGE_DIR/logs/app.jsonl, 超过 LOG_FILE_MAX_BYTES 时轮转为 app.jsonl.1 ... .N
+LOG_DIR = os.path.join(STORAGE_DIR, "logs")
+LOG_FILE = os.path.join(LOG_DIR, "app.jsonl")
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
 
-def unsubscribe(callback: Callable[[str], None]):
-    """取消订阅"""
-    if callback in _callbacks:
-        _callbacks.remove(callback)
+
+@dataclass
+class LogRecord:
+    seq: int
+    ts: float
+    level: int
+    message: str
+    # 结构化字段, 例如 job_id / model / duration_ms
+    fields: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def level_name(self) -> str:
+        return LEVEL_NAMES.get(self.level, str(self.level))
+
+    @property
+    def text(self) -> str:
+        """用于控制台和 UI 显示的单行文本"""
+        timestamp = datetime.datetime.fromtimestamp(self.ts).strftime("%H:%M:%S")
+        if self.level == INFO:
+            return f"[{timestamp}] {self.message}"
+        return f"[{timestamp}] [{self.level_name}] {self.message}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ts": datetime.datetime.fromtimestamp(self.ts).isoformat(timespec="milliseconds"),
+            "level": self.level_name,
+            "msg": self.message,
+            **self.fields,
+        }
+
+
+# 全局日志环形缓存 (deque 满后自动丢弃最旧的一行, O(1))
+_LOG_BUFFER: deque = deque(maxlen=MAX_LOG_LINES)
+_last_seq = 0
+_lock = threading.Lock()
+
+# 低于该级别的日志不打印到控制台 (缓存、文件和订阅者不受影响)
+_console_level = DEBUG
+
+# 当前上下文附带的结构化字段 (例如 JobManager 绑定的 job_id)
+_context_fields: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context_fields", default={})
+
+
+@contextlib.contextmanager
+def bind(**fields):
+    """
+    在当前上下文中为所有日志附加结构化字段。
+    asyncio.to_thread 会复制上下文, 因此工作线程里的日志同样带有这些字段。
+    """
+    token = _context_fields.set({**_context_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _context_fields.reset(token)
+
+
+def set_console_level(level: int):
+    """设置控制台输出的最低级别, 例如命令行批处理时只显示警告和错误"""
+    global _console_level  # pylint: disable=global-statement
+    _console_level = level
+
+
+def current_fields() -> Dict[str, Any]:
+    """当前上下文中通过 bind() 绑定的字段"""
+    return dict(_context_fields.get())
 
 
-def log(message):
+class _FileSink:
     """
-    记录日志：同时打印到控制台和添加到缓存
+    后台写线程: 日志调用只负责入队, 磁盘写入和文件轮转都在独立线程中完成,
+    因此 api_client 等热点路径上的日志调用不会阻塞在磁盘 IO 上。
     """
-    # 1. 生成时间戳
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-    formatted_msg = f"[{timestamp}] {message}"
 
-    # 2. 打印到控制台 (保留原有的终端输出)
-    print(formatted_msg)
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="log-file-writer", daemon=True)
+        self._thread.start()
 
-    # 3. 添加到内存缓存
-    _LOG_BUFFER.append(formatted_msg)
+    def emit(self, record: LogRecord):
+        self._queue.put(record)
 
-    # 4. 限制长度 (防止无限增长，保留最近 500 行)
-    if len(_LOG_BUFFER) > 500:
-        _LOG_BUFFER.pop(0)
+    def close(self, timeout: float = 2.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
 
-    # 5. 通知所有订阅者
-    all_logs = get_logs()
-    for callback in _callbacks:
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        running = True
+        while running:
+            # 阻塞等待第一条, 然后尽量批量取出剩余的记录再一次性写入
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                print(f"Error writing log file: {e}")
+
+    def _write_batch(self, batch: List[LogRecord]):
+        f = open(self.path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
         try:
-            callback(all_logs)
-        except Exception as e:
-            print(f"Error in log callback: {e}")
+            size = f.tell()
+            for record in batch:
+                if size >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+                    size = 0
+                line = json.dumps(record.to_dict(), ensure_ascii=False, default=str) + "\n"
+                f.write(line)
+                size += len(line.encode("utf-8"))
+        finally:
+            f.close()
+
+
+_file_sink: Optional[_FileSink] = None
+_file_sink_enabled = True
+_file_sink_lock = threading.Lock()
+
+
+def configure_file_sink(enabled: bool = True, path: str = LOG_FILE,
+                        max_bytes: int = LOG_FILE_MAX_BYTES, backup_count: int = LOG_FILE_BACKUP_COUNT):
+    """(重新) 配置日志文件输出"""
+    global _file_sink, _file_sink_enabled  # pylint: disable=global-statement
+    with _file_sink_lock:
+        if _file_sink is not None:
+            _file_sink.close()
+            _file_sink = None
+        _file_sink_enabled = enabled
+        if enabled:
+            _file_sink = _FileSink(path, max_bytes, backup_count)
+
+
+def _get_file_sink() -> Optional[_FileSink]:
+    if _file_sink is None and _file_sink_enabled:
+        with _file_sink_lock:
+            if _file_sink is None and _file_sink_enabled:
+                # 首次写日志时才启动写线程
+                _start_default_file_sink()
+    return _file_sink
+
+
+def _start_default_file_sink():
+    global _file_sink  # pylint: disable=global-statement
+    _file_sink = _FileSink(LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT)
+
+
+@atexit.register
+def _close_file_sink():
+    if _file_sink is not None:
+        _file_sink.close()
+
+
+# 回调签名: callback(new_lines, reset)
+# new_lines 为自上次回调以来的新日志 (旧 -> 新), reset 为 True 表示日志已被清空
+LogCallback = Callable[[List[str], bool], None]
+
+
+class _Subscription:
+    """单个订阅者: 记录已推送到的序号, 并将 interval 内的多条日志合并为一次回调"""
+
+    def __init__(self, callback: LogCallback, interval: float, min_level: int, last_seq: int):
+        self.callback = callback
+        self.interval = interval
+        self.min_level = min_level
+        self.last_seq = last_seq
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+
+    def notify(self, record: LogRecord):
+        if record.level < self.min_level:
+            return
+        if self.interval <= 0:
+            self.flush()
+            return
+        with self._timer_lock:
+            if self._timer is not None:
+                return  # 已有待执行的推送, 新日志会被一并带上
+            self._timer = threading.Timer(self.interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._timer_lock:
+            self._timer = None
+        with self._flush_lock:
+            records = get_logs_since(self.last_seq)
+            if not records:
+                return
+            self.last_seq = records[-1].seq
+            lines = [record.text for record in records if record.level >= self.min_level]
+            if not lines:
+                return
+            try:
+                self.callback(lines, False)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Error in log callback: {e}")
+
+    def reset(self, last_seq: int):
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with self._flush_lock:
+            self.last_seq = last_seq
+            try:
+                self.callback([], True)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Error in log callback: {e}")
+
+
+# 订阅列表，用于通知 UI 更新
+_subscriptions: List[_Subscription] = []
+
+
+def subscribe(callback: LogCallback, interval: float = 0.2, min_level: int = DEBUG) -> int:
+    """
+    订阅日志更新。订阅者只会收到新增的、级别不低于 min_level 的日志行。
+    interval > 0 时, 同一时间窗口内的多条日志会合并为一次回调 (在后台线程中执行)。
+    返回订阅起点的序号: 需要显示已有日志时, 先订阅再读取序号不大于它的日志, 两者之间的日志既不会遗漏也不会重复。
+    """
+    for sub in _subscriptions:
+        if sub.callback == callback:
+            return sub.last_seq
+    sub = _Subscription(callback, interval, min_level, get_last_seq())
+    _subscriptions.append(sub)
+    return sub.last_seq
+
+
+def unsubscribe(callback: LogCallback):
+    """取消订阅"""
+    for sub in list(_subscriptions):
+        if sub.callback == callback:
+            _subscriptions.remove(sub)
+
+
+def log(message, level: int = INFO, **fields):
+    """
+    记录日志：同时打印到控制台、添加到缓存，并交给后台线程写入日志文件。
+    fields 为结构化字段 (例如 job_id / model / duration_ms)，会与 bind() 绑定的字段合并。
+    """
+    global _last_seq  # pylint: disable=global-statement
+
+    context_fields = _context_fields.get()
+    if context_fields:
+        fields = {**context_fields, **fields}
+
+    with _lock:
+        _last_seq += 1
+        record = LogRecord(_last_seq, time.time(), level, str(message), fields)
+        # 超过 MAX_LOG_LINES 时自动丢弃最旧的行
+        _LOG_BUFFER.append(record)
+
+    # 打印到控制台 (保留原有的终端输出)
+    if level >= _console_level:
+        print(record.text)
+
+    sink = _get_file_sink()
+    if sink is not None:
+        sink.emit(record)
+
+    # 通知所有订阅者 (只推送增量)
+    for sub in list(_subscriptions):
+        sub.notify(record)
+
+
+def debug(message, **fields):
+    log(message, DEBUG, **fields)
+
+
+def info(message, **fields):
+    log(message, INFO, **fields)
+
+
+def warning(message, **fields):
+    log(message, WARNING, **fields)
+
+
+def error(message, **fields):
+    log(message, ERROR, **fields)
+
+
+def get_last_seq() -> int:
+    """获取最新一条日志的序号"""
+    return _last_seq
+
+
+def get_logs_since(seq: int, min_level: int = DEBUG) -> List[LogRecord]:
+    """获取序号大于 seq 的所有日志 (旧 -> 新)"""
+    with _lock:
+        if not _LOG_BUFFER or _LOG_BUFFER[-1].seq <= seq:
+            return []
+        # 缓存中的序号是连续的, 可以直接算出起始下标
+        start = max(0, seq - _LOG_BUFFER[0].seq + 1)
+        records = list(itertools.islice(_LOG_BUFFER, start, None))
+    if min_level > DEBUG:
+        records = [record for record in records if record.level >= min_level]
+    return records
 
 
-def get_logs():
+def get_logs(min_level: int = DEBUG):
     """获取所有日志文本，用于 UI 显示"""
     # 倒序排列，最新的在最上面
-    return "\n".join(reversed(_LOG_BUFFER))
+    with _lock:
+        return "\n".join(record.text for record in reversed(_LOG_BUFFER) if record.level >= min_level)
 
 
 def clear_logs():
-    """清空日志"""
-    _LOG_BUFFER.clear()
+    """清空日志 (只清空内存缓存, 日志文件保持不变)"""
+    with _lock:
+        _LOG_BUFFER.clear()
     # 通知订阅者日志已清空
-    for callback in _callbacks:
-        callback("")
+    for sub in list(_subscriptions):
+        sub.reset(_last_seq)
     return ""
@@ -0,0 +1,254 @@
+import bisect
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Optional, Any
+
+from common import logger_utils
+
+# 一组标签被规范化为排序后的 (key, value) 元组, 作为各指标内部字典的键
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+# 每组标签保留的最近样本数, 用于计算分位数
+PERCENTILE_SAMPLE_SIZE = 1000
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def total(self, **labels) -> float:
+        """所有包含给定标签的序列之和"""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(v for key, v in self._values.items() if wanted <= set(key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {v:g}")
+        return lines
+
+
+class _HistogramSeries:
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.samples: deque = deque(maxlen=PERCENTILE_SAMPLE_SIZE)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(self.buckets)
+            series.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.count += 1
+            series.sum += value
+            series.samples.append(value)
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            return [dict(key) for key in self._series]
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series.count if series else 0
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        """基于最近 PERCENTILE_SAMPLE_SIZE 个样本的分位数 (q 取 0~1), 无样本时返回 None"""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if not series or not series.samples:
+                return None
+            ordered = sorted(series.samples)
+        index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': f'{bound:g}'})} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series.count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series.sum:g}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series.count}")
+        return lines
+
+
+class Meter:
+    """滑动窗口内的事件速率, 例如每分钟完成的任务数"""
+
+    def __init__(self, name: str, help_text: str, window: float = 60.0):
+        self.name = name
+        self.help = help_text
+        self.window = window
+        self._events: deque = deque()
+        self._lock = threading.Lock()
+
+    def mark(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def _trim(self, now: float):
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+    def rate_per_minute(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        with self._lock:
+            self._trim(now)
+            return len(self._events) * 60.0 / self.window
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.rate_per_minute():g}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))
+
+    def meter(self, name: str, help_text: str, window: float = 60.0) -> Meter:
+        return self._register(Meter(name, help_text, window))
+
+    def render_text(self) -> str:
+        """Prometheus 文本格式"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- 任务 (JobManager) ---
+JOBS_TOTAL = registry.counter("gemini_jobs_total", "Finished jobs by status.")
+JOB_DURATION = registry.histogram("gemini_job_duration_seconds", "Job run time from start to finish.")
+JOBS_THROUGHPUT = registry.meter("gemini_jobs_per_minute", "Jobs finished during the last minute.")
+
+# --- API 请求 (api_client) ---
+REQUEST_LATENCY = registry.histogram("gemini_request_duration_seconds", "Latency of single Gemini API calls.")
+RETRIES_TOTAL = registry.counter("gemini_retries_total", "Retried Gemini API calls.")
+API_ERRORS_TOTAL = registry.counter("gemini_api_errors_total", "Failed Gemini API calls by status class.")
+BYTES_UPLOADED = registry.counter("gemini_uploaded_bytes_total", "Approximate request payload bytes.")
+BYTES_DOWNLOADED = registry.counter("gemini_downloaded_bytes_total", "Inline image bytes received.")
+TOKENS_TOTAL = registry.counter("gemini_tokens_total", "Tokens reported by usage_metadata.")
+HEDGES_TOTAL = registry.counter("gemini_hedged_requests_total", "Hedged requests sent, and how many of them won.")
+CIRCUIT_OPENED_TOTAL = registry.counter("gemini_circuit_opened_total", "Times a model's circuit breaker opened.")
+
+
+def status_class(status_code: Optional[int]) -> str:
+    """将 HTTP 状态码归类为 429 / 5xx / 4xx / other"""
+    if status_code == 429:
+        return "429"
+    if status_code and 500 <= status_code < 600:
+        return "5xx"
+    if status_code and 400 <= status_code < 500:
+        return "4xx"
+    return "other"
+
+
+# --- 可选的本地 HTTP 文本端点 ---
+_http_server: Optional[ThreadingHTTPServer] = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # 不把每次抓取都打印到控制台
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """
+    在后台线程中启动 /metrics 端点 (默认只监听本机)。已在同一地址运行时返回该实例;
+    端口或地址改变时先关闭旧端点再在新地址启动 (port 为 0 表示任意端口, 不视为改变)。
+    """
+    global _http_server  # pylint: disable=global-statement
+    if _http_server is not None:
+        running_host, running_port = _http_server.server_address[:2]
+        if running_host == host and port in (0, running_port):
+            return _http_server
+        stop_http_server()
+    try:
+        _http_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger_utils.error(f"Failed to start metrics endpoint on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=_http_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger_utils.log(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return _http_server
+
+
+def stop_http_server():
+    global _http_server  # pylint: disable=global-statement
+    if _http_server is not None:
+        _http_server.shutdown()
+        _http_server.server_close()
+        _http_server = None
@@ -0,0 +1,119 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from common import logger_utils
+from common.config import TEMP_DIR
+from common.image_util import ImageRef, file_digest
+
+THUMBNAIL_DIR = os.path.join(TEMP_DIR, "thumbnails")
+THUMBNAIL_SIZE = (200, 200)
+WEBP_QUALITY = 80
+# 缓存目录中最多保留的缩略图数, 超出时删除最久未写入的文件
+MAX_CACHE_FILES = 1000
+_PRUNE_EVERY = 50
+
+
+class ThumbnailCache:
+    """
+    任务详情预览用的缩略图缓存: 以图片内容的 SHA-256 为键, 在后台线程池中生成小尺寸 WebP 文件。
+    任务入队时调用 prefetch(), 打开详情时 get() 只检查文件是否存在, 不在 UI 线程中解码图片。
+
+        thumbnail_cache.cache.prefetch(prompt_parts)   # 入队时
+        path = thumbnail_cache.cache.get(ref)          # 打开详情时, 尚未生成则为 None
+    """
+
+    def __init__(self, directory: str = THUMBNAIL_DIR, size: Tuple[int, int] = THUMBNAIL_SIZE,
+                 max_workers: int = 2, max_files: int = MAX_CACHE_FILES):
+        self.directory = directory
+        self.size = size
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._rendered = 0
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.webp")
+
+    def get(self, ref: ImageRef) -> Optional[str]:
+        """已生成的缩略图路径, 尚未生成时返回 None"""
+        if not ref.digest:
+            return None
+        path = self.path_for(ref.digest)
+        return path if os.path.exists(path) else None
+
+    def submit(self, ref: ImageRef) -> Future:
+        """在线程池中生成缩略图; 同一内容只生成一次。Future 的结果为缩略图路径 (失败时为 None)"""
+        path = self.get(ref)
+        if path:
+            done: Future = Future()
+            done.set_result(path)
+            return done
+        key = ref.digest or ref.path
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, ref)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    def prefetch(self, parts: Iterable[Any]):
+        """为提示词中的所有图片引用提前生成缩略图"""
+        for part in parts or []:
+            if isinstance(part, ImageRef):
+                self.submit(part)
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _render(self, ref: ImageRef) -> Optional[str]:
+        try:
+            digest = ref.digest or file_digest(ref.path)
+            path = self.path_for(digest)
+            if os.path.exists(path):
+                return path
+            os.makedirs(self.directory, exist_ok=True)
+            with Image.open(ref.path) as img:
+                img.thumbnail(self.size)
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA")
+                # 先写临时文件再改名, 其他线程不会读到写了一半的文件
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                img.save(tmp_path, format="WEBP", quality=WEBP_QUALITY)
+            os.replace(tmp_path, path)
+        except (IOError, OSError, ValueError) as e:
+            logger_utils.warning(f"Cannot create thumbnail for {ref.path}: {e}")
+            return None
+        with self._lock:
+            self._rendered += 1
+            prune = self._rendered % _PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return path
+
+    def prune(self):
+        """删除超出 max_files 的最旧缩略图"""
+        try:
+            with os.scandir(self.directory) as it:
+                entries = [(entry.stat().st_mtime, entry.path) for entry in it if entry.name.endswith(".webp")]
+        except OSError:
+            return
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global instance
+cache = ThumbnailCache()
@@ -0,0 +1,123 @@
+import atexit
+import hashlib
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from common import database as db, logger_utils
+
+# 累积到 BATCH_SIZE 条或距上次写入超过 FLUSH_INTERVAL 秒时写入一次数据库
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 2.0
+# 记录的 prompt 前缀长度, 用于按 prompt 模式聚合
+PROMPT_PREVIEW_CHARS = 80
+
+
+def fingerprint_key(api_key: Optional[str]) -> Optional[str]:
+    """API Key 指纹 (sha256 前 12 位), 数据库中不保存明文 Key"""
+    if not api_key:
+        return None
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class _LedgerWriter:
+    """后台写线程: record() 只负责入队, 批量写入在独立线程中完成"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="token-ledger-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def _run(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = 0.0
+        while True:
+            # 没有待写入的数据时一直阻塞, 否则最多等到本批的截止时间
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(batch)
+                batch = []
+                continue
+
+            if isinstance(item, dict):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    batch = []
+            else:
+                # flush() 请求 (Event) 或退出标记: 立即写入
+                if batch:
+                    self._write(batch)
+                    batch = []
+                if item is _STOP:
+                    return
+                item.set()
+
+    @staticmethod
+    def _write(batch: List[Dict[str, Any]]):
+        try:
+            db.insert_token_usage(batch)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger_utils.error(f"Failed to write {len(batch)} token usage rows: {e}")
+
+
+_STOP = object()
+_writer: Optional[_LedgerWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _LedgerWriter:
+    global _writer  # pylint: disable=global-statement
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _LedgerWriter()
+    return _writer
+
+
+def record(model: Optional[str], usage: Any, kind: str = "image", api_key: Optional[str] = None,
+           prompt: Optional[str] = None, job_id: Optional[str] = None):
+    """
+    记录一次响应的 usage_metadata。job_id 缺省时取 JobManager 通过 logger_utils.bind() 绑定的任务 ID。
+    """
+    if usage is None:
+        return
+    if job_id is None:
+        job_id = logger_utils.current_fields().get("job_id")
+    _get_writer().put({
+        "ts": time.time(),
+        "model": model,
+        "kind": kind,
+        "job_id": job_id,
+        "key_fingerprint": fingerprint_key(api_key),
+        "prompt_tokens": getattr(usage, "prompt_token_count", None) or 0,
+        "candidates_tokens": getattr(usage, "candidates_token_count", None) or 0,
+        "total_tokens": getattr(usage, "total_token_count", None) or 0,
+        "prompt_preview": prompt[:PROMPT_PREVIEW_CHARS] if prompt else None,
+    })
+
+
+def flush(timeout: float = 5.0) -> bool:
+    """等待已记录的数据写入数据库 (用于退出前和测试)"""
+    if _writer is None:
+        return True
+    done = threading.Event()
+    _writer.put(done)
+    return done.wait(timeout)
+
+
+@atexit.register
+def _close_writer():
+    if _writer is not None:
+        _writer.put(_STOP)
+        _writer._thread.join(2.0)  # pylint: disable=protected-access
@@ -0,0 +1,64 @@
+import contextlib
+import contextvars
+import time
+from typing import List, Dict, Any, Optional
+
+# 标准阶段名称, 用于任务耗时分解
+SPAN_QUEUE_WAIT = "queue_wait"
+SPAN_PREPROCESS = "preprocess"
+SPAN_REQUEST = "request"
+SPAN_BACKOFF = "backoff"
+SPAN_DECODE = "decode"
+SPAN_SAVE = "save"
+
+# 当前任务的 span 列表。由 JobManager 在执行任务时设置;
+# asyncio.to_thread 会复制上下文, 所以工作线程中记录的 span 也会写入同一个列表。
+_current_spans: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "current_job_spans", default=None)
+
+
+@contextlib.contextmanager
+def collect(spans: List[Dict[str, Any]]):
+    """将当前上下文中记录的 span 收集到给定列表中"""
+    token = _current_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_spans.reset(token)
+
+
+def record_span(name: str, duration: float, start: Optional[float] = None, **attrs):
+    """记录一个已完成的阶段。当前不在任务上下文中时直接忽略。"""
+    spans = _current_spans.get()
+    if spans is None:
+        return
+    if start is None:
+        start = time.time() - duration
+    spans.append({"name": name, "start": start, "duration": duration, **attrs})
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    记录一个阶段的耗时:
+
+        with tracing.span(tracing.SPAN_REQUEST, attempt=1):
+            ...
+    """
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        attrs.setdefault("ok", False)
+        raise
+    finally:
+        record_span(name, time.perf_counter() - t0, start, **attrs)
+
+
+def summarize(spans: List[Dict[str, Any]]) -> Dict[str, float]:
+    """按阶段名称汇总耗时 (秒), 保持阶段首次出现的顺序"""
+    totals: Dict[str, float] = {}
+    for item in spans:
+        totals[item["name"]] = totals.get(item["name"], 0.0) + item["duration"]
+    return totals
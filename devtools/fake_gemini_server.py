@@ -0,0 +1,273 @@
+"""
+本地模拟 Gemini API 服务, 用于离线开发、压测和端到端测试:
+
+    python -m devtools.fake_gemini_server --port 8765 --latency-ms 800 --rate-429 0.05 --rate-blocked 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8765 python app.py
+
+实现了 SDK 使用的 POST /v1beta/models/{model}:generateContent (图片生成和聊天都走这个接口),
+按配置返回图片、429 / 500 错误或被内容策略拦截的响应。另外提供:
+    GET  /_fake/stats    请求统计 (JSON)
+    POST /_fake/config   运行时修改配置 (JSON, 字段同 FakeConfig)
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, asdict, fields
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from typing import Optional, Dict, Any
+
+from PIL import Image
+
+_GENERATE_RE = re.compile(r"^/v1\w*/models/([^/:]+):generateContent$")
+
+
+@dataclass
+class FakeConfig:
+    # 响应耗时: 中位数 latency_ms, 按对数正态分布抖动 (latency_sigma 为 0 时固定)
+    latency_ms: float = 500.0
+    latency_sigma: float = 0.5
+    # 各类异常响应的概率 (0~1)
+    rate_429: float = 0.0
+    rate_500: float = 0.0
+    rate_blocked: float = 0.0
+    # 429 响应中建议的重试等待 (秒)
+    retry_after: float = 1.0
+    # 返回图片的边长 (像素) 和格式
+    image_size: int = 256
+    image_format: str = "PNG"
+    seed: Optional[int] = None
+
+
+class FakeGeminiServer:
+    """
+    可在测试中直接使用:
+
+        with FakeGeminiServer(FakeConfig(latency_ms=50)) as server:
+            api_client.set_base_url(server.url)
+    """
+
+    def __init__(self, config: Optional[FakeConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeConfig()
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._image_cache: Dict[tuple, str] = {}
+        self.stats: Dict[str, Any] = {"requests": 0, "ok": 0, "429": 0, "500": 0, "blocked": 0,
+                                      "in_flight": 0, "max_in_flight": 0, "bytes_received": 0}
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def update_config(self, **changes):
+        names = {f.name for f in fields(FakeConfig)}
+        with self._lock:
+            for key, value in changes.items():
+                if key not in names:
+                    raise ValueError(f"Unknown config field: {key}")
+                setattr(self.config, key, value)
+            if "seed" in changes:
+                self._random = random.Random(self.config.seed)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+    # --- 响应生成 ---
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+            if key == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def _draw(self):
+        """抽取本次请求的耗时 (秒) 和结果类型"""
+        with self._lock:
+            cfg = self.config
+            latency = cfg.latency_ms / 1000
+            if cfg.latency_sigma > 0:
+                latency *= math.exp(self._random.gauss(0, cfg.latency_sigma))
+            roll = self._random.random()
+        for outcome, rate in (("429", cfg.rate_429), ("500", cfg.rate_500), ("blocked", cfg.rate_blocked)):
+            if roll < rate:
+                return latency, outcome
+            roll -= rate
+        return latency, "ok"
+
+    def _image_data(self) -> str:
+        """同样尺寸和格式的图片只编码一次, 避免服务端成为压测瓶颈"""
+        key = (self.config.image_size, self.config.image_format.upper())
+        with self._lock:
+            data = self._image_cache.get(key)
+        if data is None:
+            size, fmt = key
+            img = Image.new("RGB", (size, size), (255, 200, 40))
+            buffer = BytesIO()
+            img.save(buffer, format=fmt)
+            data = base64.b64encode(buffer.getvalue()).decode("ascii")
+            with self._lock:
+                self._image_cache[key] = data
+        return data
+
+    @staticmethod
+    def _usage(prompt_tokens: int, output_tokens: int) -> Dict[str, int]:
+        return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens}
+
+    def _respond(self, outcome: str, body: Dict[str, Any]):
+        """返回 (状态码, 额外响应头, JSON 响应体)"""
+        prompt_tokens = sum(len(str(part.get("text", "")).split()) + (258 if "inlineData" in part else 0)
+                            for content in body.get("contents", []) for part in content.get("parts", []))
+        if outcome == "429":
+            retry_after = self.config.retry_after
+            return 429, {"Retry-After": f"{retry_after:g}"}, {"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Resource has been exhausted (fake).",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after:g}s"}],
+            }}
+        if outcome == "500":
+            return 500, {}, {"error": {"code": 500, "status": "INTERNAL", "message": "Internal error (fake)."}}
+        if outcome == "blocked":
+            return 200, {}, {"candidates": [{"finishReason": "PROHIBITED_CONTENT", "index": 0}],
+                             "usageMetadata": self._usage(prompt_tokens, 0)}
+        mime_type = "image/" + self.config.image_format.lower()
+        return 200, {}, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"inlineData": {"mimeType": mime_type,
+                                                                       "data": self._image_data()}}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": self._usage(prompt_tokens, 1290),
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self) -> Dict[str, Any]:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                server._count("bytes_received", len(raw))  # pylint: disable=protected-access
+                return json.loads(raw or b"{}")
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] == "/_fake/stats":
+                    self._send_json(200, server.snapshot_stats())
+                else:
+                    self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                path = self.path.split("?")[0]
+                try:
+                    body = self._read_json()
+                except ValueError:
+                    self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON",
+                                                    "status": "INVALID_ARGUMENT"}})
+                    return
+                if path == "/_fake/config":
+                    try:
+                        server.update_config(**body)
+                    except ValueError as e:
+                        self._send_json(400, {"error": {"code": 400, "message": str(e),
+                                                        "status": "INVALID_ARGUMENT"}})
+                        return
+                    self._send_json(200, asdict(server.config))
+                    return
+                if not _GENERATE_RE.match(path):
+                    self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {path}",
+                                                    "status": "NOT_FOUND"}})
+                    return
+
+                # pylint: disable=protected-access
+                server._count("requests")
+                server._count("in_flight")
+                try:
+                    latency, outcome = server._draw()
+                    time.sleep(latency)
+                    status, headers, payload = server._respond(outcome, body)
+                    server._count(outcome)
+                finally:
+                    server._count("in_flight", -1)
+                self._send_json(status, payload, headers)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                # 压测时不把每个请求都打印到控制台
+                pass
+
+        return Handler
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = FakeConfig()
+    parser = argparse.ArgumentParser(prog="python -m devtools.fake_gemini_server",
+                                     description="Local stand-in for the Gemini generateContent API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="Median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma,
+                        help="Log-normal spread of the latency, 0 for a fixed latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--rate-blocked", type=float, default=0.0,
+                        help="Share of requests answered with a PROHIBITED_CONTENT block")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after,
+                        help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--image-size", type=int, default=defaults.image_size, help="Edge length of returned images")
+    parser.add_argument("--image-format", default=defaults.image_format, choices=["PNG", "JPEG", "WEBP"])
+    parser.add_argument("--seed", type=int, help="Seed for reproducible latency and error sequences")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = FakeConfig(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, rate_429=args.rate_429,
+                        rate_500=args.rate_500, rate_blocked=args.rate_blocked, retry_after=args.retry_after,
+                        image_size=args.image_size, image_format=args.image_format, seed=args.seed)
+    server = FakeGeminiServer(config, args.host, args.port).start()
+    print(f"Fake Gemini API listening on {server.url}")
+    print(f"Point the app at it with: GEMINI_BASE_URL={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,8 @@ import flet as ft
 # Add project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from common import i18n, database as db
+from common import i18n, metrics, event_bus, database as db
+from common.job_manager import job_manager
 from fletapp.component.flet_single_edit_tab import single_edit_tab
 from fletapp.component.flet_settings_page import settings_page
 from fletapp.component.flet_history_page import history_page
@@ -17,6 +18,20 @@ from fletapp.component.flet_queue_page import queue_page
 def main(page: ft.Page):
     i18n.load_language()
 
+    metrics_port = db.get_setting("metrics_port", "")
+    if metrics_port:
+        metrics.start_http_server(int(metrics_port))
+
+    # Background work (job status changes, log lines) reaches this page's controls through its own event bus,
+    # dispatched on the page's event loop; nothing polls
+    bus = event_bus.EventBus()
+    bus_task = page.run_task(bus.run)
+
+    def forward_job_events(events):
+        bus.publish(event_bus.TOPIC_JOBS, events)
+
+    job_manager.subscribe(forward_job_events)
+
     page.title = i18n.get("app_title")
     page.vertical_alignment = ft.MainAxisAlignment.START
 
@@ -44,7 +59,7 @@ def main(page: ft.Page):
     )
 
     # --- Component Creation ---
-    single_edit_component = single_edit_tab(page)
+    single_edit_component = single_edit_tab(page, bus)
     chat_component = chat_page(page)
     prompt_manager_component = prompt_manager_tab(page)
 
@@ -84,7 +99,7 @@ def main(page: ft.Page):
                         chat_component["view"],
                         prompt_manager_component["view"],
                         history_page(page),
-                        queue_page(page),
+                        queue_page(page, bus),
                         settings_page(page)
                     ]
                 )
@@ -100,6 +115,13 @@ def main(page: ft.Page):
     chat_component["init"]()
     prompt_manager_component["init"]()
 
+    def on_close(e):
+        job_manager.unsubscribe(forward_job_events)
+        single_edit_component["close"]()
+        bus_task.cancel()
+
+    page.on_close = on_close
+
 
 if __name__ == "__main__":
     os.environ["PYTHONUTF8"] = "1"
@@ -1,25 +1,39 @@
 import os
 import asyncio
 import time
-from typing import List, Any, Dict
+import uuid
+from typing import List, Any, Dict, Optional
 
 import flet as ft
-from PIL import Image
 from flet import Page, BoxFit, MarkdownExtensionSet, MarkdownCodeTheme
 
-from common import database as db, i18n, logger_utils
+from common import database as db, i18n, logger_utils, tracing, thumbnail_cache, chat_store
+from common.chat_store import ChatTranscript, ROLE_USER, ROLE_MODEL
 from common.config import MODEL_SELECTOR_CHOICES, AR_SELECTOR_CHOICES, RES_SELECTOR_CHOICES, OUTPUT_DIR
+from common.image_util import ImageRef
 from common.job_manager import job_manager, Job
 from common.text_encoder import text_encoder
 from fletapp.component.common_component import show_snackbar
 from fletapp.component.flet_image_preview_dialog import preview_dialog, PreviewDialogData
-from geminiapi import api_client
+from geminiapi import api_client, key_pool
 
+# Chat history windowing: only the newest messages are kept as controls, older ones are reloaded on scroll
+MAX_RENDERED_TURNS = 40
+LOAD_EARLIER_PAGE = 20
+# Newest messages that show full-size images; images of older messages collapse to cached thumbnails
+FULL_IMAGE_TURNS = 6
+COLLAPSED_IMAGE_WIDTH = 200
 
 def chat_page(page: Page) -> Dict[str, Any]:
     # --- State Management ---
-    chat_session_state: Dict[str, Any] = {"session_obj": None}
-    genai_client = None  # Persistent client instance
+    # The transcript on disk is the source of truth; each turn rebuilds the model context from it
+    chat_state: Dict[str, Any] = {"transcript": None}
+    window = {"first": 0}  # Transcript index of the oldest rendered message
+    # Sessions opened on this page (shared with their in-flight jobs) and their number of pending turns.
+    # Each session is a lane of the job manager: its turns run in order, other sessions run concurrently.
+    open_sessions: Dict[str, ChatTranscript] = {}
+    saved_sessions: Dict[str, ChatTranscript] = {}  # Read from the store once, in initialize()
+    pending_turns: Dict[str, int] = {}
     uploaded_image_paths: List[str] = []
 
     # --- Controls ---
@@ -33,10 +47,46 @@ def chat_page(page: Page) -> Dict[str, Any]:
             on_deleted_callback_fnc=None)
         page.show_dialog(image_preview_dialog)
 
+    class ChatImage(ft.GestureDetector):
+        """An image in a chat bubble. Collapsed images show the cached thumbnail until clicked."""
+
+        def __init__(self, path: str, digest: str = "", width: int = 400):
+            # Decode at display size instead of the original resolution
+            self.image = ft.Image(src=path, width=width, cache_width=width, fit=BoxFit.CONTAIN,
+                                  border_radius=ft.border_radius.all(10))
+            super().__init__(content=self.image, on_tap=self.expand_image,
+                             on_double_tap=lambda e: open_chat_image_preview(path))
+            self.ref = ImageRef(path, digest)
+            self.full_width = width
+            self.collapsed = False
+
+        def collapse(self):
+            if self.collapsed:
+                return
+            thumbnail = thumbnail_cache.cache.get(self.ref)
+            if thumbnail is None:
+                thumbnail_cache.cache.submit(self.ref)
+            self.image.src = thumbnail or self.ref.path
+            self.image.width = self.image.cache_width = min(self.full_width, COLLAPSED_IMAGE_WIDTH)
+            self.image.tooltip = i18n.get("chat_image_expand_tooltip", "Click to show full size")
+            self.collapsed = True
+
+        def expand_image(self, e=None):
+            if not self.collapsed:
+                return
+            self.image.src = self.ref.path
+            self.image.width = self.image.cache_width = self.full_width
+            self.image.tooltip = None
+            self.collapsed = False
+            self.update()
+
     class Message(ft.Row):
-        def __init__(self, role: str, parts: List[Any]):
+        def __init__(self, role: str, parts: List[Any], turn_index: Optional[int] = None):
             super().__init__()
             self.vertical_alignment = ft.CrossAxisAlignment.START
+            # Index in the transcript; None for status messages (thinking, errors)
+            self.turn_index = turn_index
+            self.images = [part for part in parts if isinstance(part, ChatImage)]
 
             content_controls = []
             for part in parts:
@@ -44,15 +94,8 @@ def chat_page(page: Page) -> Dict[str, Any]:
                     content_controls.append(
                         ft.Markdown(part, selectable=True, extension_set=MarkdownExtensionSet.GITHUB_WEB,
                                     code_theme=MarkdownCodeTheme.GOOGLE_CODE))
-                elif isinstance(part, ft.Image):
-                    part.border_radius = ft.border_radius.all(10)
-                    part.width = 400
-                    content_controls.append(
-                        ft.GestureDetector(
-                            content=part,
-                            on_double_tap=lambda e, p=part.src: open_chat_image_preview(p)
-                        )
-                    )
+                elif isinstance(part, ChatImage):
+                    content_controls.append(part)
 
             bubble_content = ft.Column(content_controls, tight=True, spacing=5)
 
@@ -79,7 +122,12 @@ def chat_page(page: Page) -> Dict[str, Any]:
                 icon = ft.Icon(ft.Icons.ASSISTANT, size=30)
                 self.controls = [icon, bubble]
 
-    chat_history = ft.ListView(expand=True, spacing=20, auto_scroll=True)
+    # Only the visible messages are built on the client, so off-screen images are loaded when scrolled into view
+    chat_history = ft.ListView(expand=True, spacing=20, auto_scroll=True, build_controls_on_demand=True,
+                               scroll_interval=100)
+    load_earlier_button = ft.TextButton(i18n.get("chat_btn_load_earlier", "Show earlier messages"),
+                                        icon=ft.Icons.EXPAND_LESS, visible=False)
+    chat_history.controls.append(ft.Row([load_earlier_button], alignment=ft.MainAxisAlignment.CENTER))
     thumbnail_row = ft.Row(wrap=True, spacing=10)
     user_input = ft.TextField(label=i18n.get("chat_input_label"), hint_text=i18n.get("chat_input_placeholder"),
                               expand=True, multiline=True, shift_enter=True)
@@ -98,6 +146,9 @@ def chat_page(page: Page) -> Dict[str, Any]:
     res_selector = ft.Dropdown(label=i18n.get("home_control_resolution_label"),
                                options=[ft.dropdown.Option(res) for res in RES_SELECTOR_CHOICES],
                                value=RES_SELECTOR_CHOICES[0], expand=1)
+    session_selector = ft.Dropdown(label=i18n.get("chat_session_label", "Session"), options=[], expand=3)
+    session_name_input = ft.TextField(label=i18n.get("chat_session_name_label", "Session name"),
+                                      hint_text=i18n.get("chat_session_name_placeholder"), expand=2)
     prompt_dropdown = ft.Dropdown(label=i18n.get("home_control_prompt_label_history"),
                                   hint_text=i18n.get("home_control_prompt_placeholder"), options=[], expand=True)
     prompt_title_input = ft.TextField(label=i18n.get("home_control_prompt_save_label"),
@@ -179,36 +230,178 @@ def chat_page(page: Page) -> Dict[str, Any]:
                                   on_click=upload_image_handler,
                                   tooltip=i18n.get("chat_btn_pick_images_tooltip", "select Images"))
 
+    # --- Sessions ---
+
+    def session_label(transcript: ChatTranscript) -> str:
+        label = transcript.title or i18n.get("chat_session_untitled", "New chat")
+        return f"⏳ {label}" if pending_turns.get(transcript.id) else label
+
+    def refresh_session_options():
+        current = chat_state["transcript"]
+        sessions = dict(saved_sessions)
+        # In-memory transcripts are newer than their files; empty ones are listed only while current
+        sessions.update({sid: t for sid, t in open_sessions.items() if t.turns or t is current})
+        ordered = sorted(sessions.values(), key=lambda t: t.updated_at, reverse=True)
+        session_selector.options = [ft.dropdown.Option(key=t.id, text=session_label(t)) for t in ordered]
+        session_selector.value = current.id if current else None
+
+    def update_input_state():
+        """Only the current session's pending turn blocks the input; other sessions keep running."""
+        current = chat_state["transcript"]
+        busy = bool(current and pending_turns.get(current.id))
+        user_input.disabled = busy
+        send_button.disabled = busy
+        progress_ring.visible = busy
+
+    def show_session(transcript: ChatTranscript):
+        open_sessions[transcript.id] = transcript
+        chat_state["transcript"] = transcript
+        if transcript.model in MODEL_SELECTOR_CHOICES:
+            model_selector.value = transcript.model
+        session_name_input.value = transcript.title
+        render_transcript(transcript)
+        if pending_turns.get(transcript.id):
+            chat_history.controls.append(Message(role="assistant", parts=["🤔 Thinking..."]))
+        update_input_state()
+        refresh_session_options()
+
+    def new_session() -> ChatTranscript:
+        transcript = ChatTranscript.new(model=model_selector.value)
+        show_session(transcript)
+        return transcript
+
+    def switch_session_handler(e):
+        session_id = session_selector.value
+        current = chat_state["transcript"]
+        if not session_id or (current and current.id == session_id):
+            return
+        transcript = open_sessions.get(session_id) or chat_store.store.load(session_id)
+        saved_sessions.pop(session_id, None)
+        if transcript is None:
+            show_snackbar(page, i18n.get("chat_session_load_failed", "Could not load this session."), is_error=True)
+            refresh_session_options()
+        else:
+            show_session(transcript)
+        page.update()
+
+    def rename_session_handler(e):
+        name = (session_name_input.value or "").strip()
+        transcript = chat_state["transcript"]
+        if not name or (transcript and transcript.title == name):
+            return
+        if transcript is None:
+            transcript = new_session()
+        transcript.title = name
+        if transcript.turns:
+            page.run_task(save_transcript, transcript)
+        refresh_session_options()
+        page.update()
+
+    session_selector.on_select = switch_session_handler
+    session_name_input.on_submit = rename_session_handler
+    session_name_input.on_blur = rename_session_handler
+
     def clear_chat_handler(e):
-        nonlocal genai_client
-        chat_history.controls.clear()
-        chat_session_state["session_obj"] = None
-        genai_client = None
+        # Starts a new session; the previous ones stay on disk and keep running in the background
+        new_session()
         uploaded_image_paths.clear()
         update_thumbnail_display()
-        logger_utils.log("Chat cleared.")
+        logger_utils.log("New chat session started.")
         page.update()
 
     clear_button = ft.Button(content=i18n.get("chat_btn_clear"), on_click=clear_chat_handler, icon=ft.Icons.CLEAR_ALL)
 
-    async def handle_api_success(result):
+    # --- History windowing ---
+
+    def message_for_turn(index: int, turn: chat_store.ChatTurn) -> Message:
+        parts: List[Any] = []
+        for part in turn.parts:
+            if "image" in part:
+                parts.append(ChatImage(part["image"], part.get("digest", ""),
+                                       width=150 if turn.role == ROLE_USER else 400))
+            elif part.get("text"):
+                # Consecutive text parts share one Markdown block
+                if parts and isinstance(parts[-1], str):
+                    parts[-1] += "\n\n" + part["text"]
+                else:
+                    parts.append(part["text"])
+        return Message(role="user" if turn.role == ROLE_USER else "assistant", parts=parts, turn_index=index)
+
+    def reset_history():
+        window["first"] = 0
+        load_earlier_button.visible = False
+        del chat_history.controls[1:]
+
+    def apply_window():
+        """Collapses images of older messages and unloads messages beyond MAX_RENDERED_TURNS"""
+        messages = [c for c in chat_history.controls if isinstance(c, Message) and c.turn_index is not None]
+        for message in messages[:-FULL_IMAGE_TURNS]:
+            for image in message.images:
+                image.collapse()
+        excess = len(messages) - MAX_RENDERED_TURNS
+        if excess > 0:
+            oldest_kept = messages[excess]
+            del chat_history.controls[1:chat_history.controls.index(oldest_kept)]
+            window["first"] = oldest_kept.turn_index
+        load_earlier_button.visible = window["first"] > 0
+
+    def show_turn(index: int, turn: chat_store.ChatTurn):
+        chat_history.auto_scroll = True
+        chat_history.controls.append(message_for_turn(index, turn))
+        apply_window()
+
+    def load_earlier(e=None):
+        transcript = chat_state["transcript"]
+        first = window["first"]
+        if transcript is None or first <= 0:
+            return
+        start = max(0, first - LOAD_EARLIER_PAGE)
+        messages = [message_for_turn(i, transcript.turns[i]) for i in range(start, first)]
+        for message in messages:
+            for image in message.images:
+                image.collapse()
+        # Keep the scroll position instead of jumping to the newest message
+        chat_history.auto_scroll = False
+        chat_history.controls[1:1] = messages
+        window["first"] = start
+        load_earlier_button.visible = start > 0
+        chat_history.update()
+
+    def on_history_scroll(e: ft.OnScrollEvent):
+        if e.event_type == ft.ScrollType.END and e.pixels <= e.min_scroll_extent and window["first"] > 0:
+            load_earlier()
+
+    load_earlier_button.on_click = load_earlier
+    chat_history.on_scroll = on_history_scroll
+
+    def render_transcript(transcript: ChatTranscript):
+        reset_history()
+        window["first"] = max(0, len(transcript.turns) - MAX_RENDERED_TURNS)
+        for index in range(window["first"], len(transcript.turns)):
+            chat_history.controls.append(message_for_turn(index, transcript.turns[index]))
+        apply_window()
+
+    async def save_transcript(transcript: ChatTranscript):
+        try:
+            await asyncio.to_thread(chat_store.store.save, transcript)
+        except OSError as e:
+            logger_utils.warning(f"Could not save chat transcript: {e}")
+
+    async def handle_api_success(result, transcript: ChatTranscript):
         if result:
             updated_chat_obj, response_parts = result
-            chat_session_state["session_obj"] = updated_chat_obj
-
-            # Remove "Thinking" message
-            if chat_history.controls and isinstance(chat_history.controls[-1], Message):
-                last_bubble = chat_history.controls[-1].controls[1]
-                if isinstance(last_bubble, ft.Container) and last_bubble.content.controls[0].value == "🤔 Thinking...":
-                    chat_history.controls.pop()
-
-            text_parts = [part for part in response_parts if isinstance(part, str)]
+            try:
+                signatures = api_client.last_response_signatures(updated_chat_obj)
+            except Exception:  # pylint: disable=broad-exception-caught
+                signatures = []
+            signatures += [None] * (len(response_parts) - len(signatures))
+            model_parts = [chat_store.make_part(part, signature)
+                           for part, signature in zip(response_parts, signatures) if isinstance(part, str)]
+            image_signatures = [signature for part, signature in zip(response_parts, signatures)
+                                if not isinstance(part, str)]
+            notices: List[str] = []
             image_parts = [part for part in response_parts if not isinstance(part, str)]
 
-            if text_parts:
-                chat_history.controls.append(Message(role="assistant", parts=["\n\n".join(text_parts)]))
-                page.update()
-
             save_dir = db.get_setting("save_path", OUTPUT_DIR)
             if image_parts:
                 if not os.path.isdir(save_dir):
@@ -221,89 +414,120 @@ def chat_page(page: Page) -> Dict[str, Any]:
                 for i, img_part in enumerate(image_parts):
                     if save_dir:
                         try:
-                            filepath = os.path.join(save_dir, f"chat_{int(time.time() * 1000)}_{i}.png")
+                            # Sessions reply concurrently, so the session id keeps the names apart
+                            filepath = os.path.join(save_dir,
+                                                    f"chat_{int(time.time() * 1000)}_{transcript.id[-6:]}_{i}.png")
                             # Save image in thread
-                            await asyncio.to_thread(img_part.save, filepath)
-                            flet_image = ft.Image(src=filepath)
-                            chat_history.controls.append(Message(role="assistant", parts=[flet_image]))
-                        except Exception as e:
-                            chat_history.controls.append(
-                                Message(role="assistant", parts=[f"[Error saving image: {e}]"]))
+                            with tracing.span(tracing.SPAN_SAVE):
+                                await asyncio.to_thread(img_part.save, filepath)
+                            ref = await asyncio.to_thread(ImageRef.from_path, filepath)
+                            model_parts.append(chat_store.make_part(ref, image_signatures[i]))
+                        except Exception as e:  # pylint: disable=broad-exception-caught
+                            notices.append(f"[Error saving image: {e}]")
                     else:
-                        chat_history.controls.append(Message(role="assistant", parts=[
-                            "[Image could not be displayed because save path is not set.]"]))
-                page.update()
+                        notices.append("[Image could not be displayed because save path is not set.]")
+
+            is_current = chat_state["transcript"] is transcript
+            if is_current:
+                remove_thinking_message()
+            if model_parts:
+                turn = transcript.add_turn(ROLE_MODEL, model_parts)
+                # The user may have switched to another session while the reply was pending
+                if is_current:
+                    show_turn(len(transcript.turns) - 1, turn)
+                await save_transcript(transcript)
+            if is_current:
+                for notice in notices:
+                    chat_history.controls.append(Message(role="assistant", parts=[notice]))
+            page.update()
 
-    async def handle_api_error(error_msg):
-        logger_utils.log(f"Chat API call failed: {error_msg}")
+    def remove_thinking_message():
         if chat_history.controls and isinstance(chat_history.controls[-1], Message):
             last_bubble = chat_history.controls[-1].controls[1]
             if isinstance(last_bubble, ft.Container) and last_bubble.content.controls[0].value == "🤔 Thinking...":
                 chat_history.controls.pop()
-        chat_history.controls.append(Message(role="assistant", parts=[f"😥 Oops, something went wrong:\n\n{error_msg}"]))
+
+    async def handle_api_error(error_msg, transcript: ChatTranscript):
+        logger_utils.log(f"Chat API call failed: {error_msg}")
+        if chat_state["transcript"] is transcript:
+            remove_thinking_message()
+            chat_history.controls.append(
+                Message(role="assistant", parts=[f"😥 Oops, something went wrong:\n\n{error_msg}"]))
+        else:
+            show_snackbar(page, f"{session_label(transcript)}: {error_msg}", is_error=True)
         page.update()
 
-    async def handle_api_finally():
-        user_input.disabled = False
-        send_button.disabled = False
-        progress_ring.visible = False
+    async def handle_api_finally(transcript: ChatTranscript):
+        pending_turns[transcript.id] = max(0, pending_turns.get(transcript.id, 0) - 1)
+        update_input_state()
+        refresh_session_options()
         page.update()
 
     async def send_message_handler():
-        nonlocal genai_client
-
         prompt_text = text_encoder(user_input.value)
         if not prompt_text and not uploaded_image_paths: return
 
-        api_key = db.get_all_settings().get("api_key")
+        # Least-loaded key of the pool; the context is rebuilt from the transcript, so any key can serve a turn
+        settings = db.get_all_settings()
+        api_key = key_pool.pool.pick(settings.get("api_key"))
         if not api_key:
             chat_history.controls.append(Message(role="assistant", parts=[i18n.get("api_error_apiKey")]))
             page.update()
             return
 
-        if genai_client is None:
-            genai_client = api_client.genai.Client(api_key=api_key)
-
-        user_input.disabled = True
-        send_button.disabled = True
-        progress_ring.visible = True
+        transcript = chat_state["transcript"] or new_session()
+        pending_turns[transcript.id] = pending_turns.get(transcript.id, 0) + 1
+        update_input_state()
 
         prompt_parts: List[Any] = []
-        user_message_parts: List[Any] = []
 
         for path in uploaded_image_paths:
-            # Open images in thread pool
-            img = await asyncio.to_thread(Image.open, path)
-            prompt_parts.append(img)
-            user_message_parts.append(ft.Image(src=path, width=150, border_radius=ft.border_radius.all(5)))
+            # The job only keeps a reference (hashed in the thread pool); the file is decoded when it runs
+            prompt_parts.append(await asyncio.to_thread(ImageRef.from_path, path))
+        # Previews for the queue's job details dialog are rendered in the background right away
+        thumbnail_cache.cache.prefetch(prompt_parts)
 
         if prompt_text:
             prompt_parts.append(prompt_text)
-            user_message_parts.append(prompt_text)
 
-        chat_history.controls.append(Message(role="user", parts=user_message_parts))
-        chat_history.controls.append(Message(role="assistant", parts=["🤔 Thinking..."]))
+        # Context from the earlier turns, trimmed according to the settings
+        context = chat_store.ContextPolicy.from_settings(settings).build(transcript.turns)
+        if context.dropped_turns or context.dropped_images:
+            logger_utils.debug(f"Chat context: {context.dropped_turns} older message(s) summarized, "
+                               f"{context.dropped_images} older image(s) omitted.")
+        transcript.model = model_selector.value
+        turn = transcript.add_turn(ROLE_USER, [chat_store.make_part(part) for part in prompt_parts])
+
+        if chat_state["transcript"] is transcript:
+            show_turn(len(transcript.turns) - 1, turn)
+            chat_history.controls.append(Message(role="assistant", parts=["🤔 Thinking..."]))
+            session_name_input.value = transcript.title
         user_input.value = ""
         uploaded_image_paths.clear()
         update_thumbnail_display()
+        refresh_session_options()
         page.update()
+        await save_transcript(transcript)
 
         # Create and add job to queue
         job = Job(
-            id=f"chat_{int(time.time() * 1000)}",
+            id=f"chat_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}",
             name=f"Chat: {prompt_text[:20]}..." if prompt_text else "Chat (Image only)",
             task_func=api_client.call_google_chat,
             kwargs={
-                "genai_client": genai_client,
-                "chat_session": chat_session_state.get("session_obj"),
+                "genai_client": api_client.get_client(api_key),
+                "chat_session": None,
                 "prompt_parts": prompt_parts,
+                "history": context.history,
+                "system_instruction": context.summary,
                 "model_id": model_selector.value,
                 "aspect_ratio": ar_selector.value,
                 "resolution": res_selector.value,
             },
-            on_success=handle_api_success,
-            on_error=handle_api_error,
-            on_finally=handle_api_finally
+            on_success=lambda result: handle_api_success(result, transcript),
+            on_error=lambda error_msg: handle_api_error(error_msg, transcript),
+            on_finally=lambda: handle_api_finally(transcript),
+            lane=transcript.id
         )
         await job_manager.add_job(job)
 
@@ -313,9 +537,18 @@ def chat_page(page: Page) -> Dict[str, Any]:
     def initialize():
         page.pubsub.subscribe(on_prompts_update)
         refresh_prompts_dropdown()
+        # Resume the most recent session
+        saved_sessions.update((t.id, t) for t in chat_store.store.list_sessions())
+        transcript = max(saved_sessions.values(), key=lambda t: t.updated_at, default=None)
+        if transcript is not None:
+            show_session(transcript)
+        else:
+            refresh_session_options()
+        page.update()
 
     view = ft.Container(
         content=ft.Column([
+            ft.Row([session_selector, session_name_input, clear_button]),
             chat_history,
             ft.Divider(),
             ft.Row([model_selector, ar_selector, res_selector, ft.Container(expand=True)]),
@@ -336,7 +569,6 @@ def chat_page(page: Page) -> Dict[str, Any]:
             ]),
             thumbnail_row,
             ft.Row([user_input, upload_button, ft.Stack([send_button, ft.Container(progress_ring, margin=ft.margin.only(left=12, top=12))])], vertical_alignment=ft.CrossAxisAlignment.START),
-            ft.Row([clear_button])
         ]),
         padding=ft.padding.all(10),
         expand=True,
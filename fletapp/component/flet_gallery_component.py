@@ -8,7 +8,7 @@ from flet import Page
 
 from common import database as db, i18n
 # Import common modules
-from common.config import VALID_IMAGE_EXTENSIONS
+from common.image_util import list_images
 from fletapp.component.flet_image_preview_dialog import PreviewDialogData, preview_dialog
 
 
@@ -71,22 +71,7 @@ def local_gallery_component(page: Page, expand: Union[None, bool, int],
             if page: page.update()
             return
 
-        image_paths = []
-        if include_subdirectories:
-            for root, _, files in os.walk(directory_path):
-                for filename in files:
-                    file_path = os.path.join(root, filename)
-                    if os.path.isfile(file_path):
-                        _, ext = os.path.splitext(filename)
-                        if ext.lower() in VALID_IMAGE_EXTENSIONS:
-                            image_paths.append(file_path)
-        else:
-            for filename in os.listdir(directory_path):
-                file_path = os.path.join(directory_path, filename)
-                if os.path.isfile(file_path):
-                    _, ext = os.path.splitext(filename)
-                    if ext.lower() in VALID_IMAGE_EXTENSIONS:
-                        image_paths.append(file_path)
+        image_paths = list_images(directory_path, include_subdirectories)
 
         for path in image_paths:
             def _on_tap(e, p=path):
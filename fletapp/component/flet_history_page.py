@@ -7,8 +7,8 @@ from flet import Container, BoxFit
 from flet import Page
 
 from common import database as db, i18n, logger_utils
-from common.config import VALID_IMAGE_EXTENSIONS, OUTPUT_DIR
-from common.image_util import get_image_details
+from common.config import OUTPUT_DIR
+from common.image_util import get_image_details, list_images_by_mtime
 from fletapp.component.flet_image_preview_dialog import PreviewDialogData, preview_dialog
 
 
@@ -55,10 +55,7 @@ def history_page(page: Page) -> Container:
             return
 
         try:
-            files = [os.path.join(save_dir, f) for f in os.listdir(save_dir)
-                     if os.path.splitext(f)[1].lower() in VALID_IMAGE_EXTENSIONS]
-            files.sort(key=os.path.getmtime, reverse=True)
-            image_files = files
+            image_files = list_images_by_mtime(save_dir)
 
             if not image_files:
                 history_grid.controls.append(
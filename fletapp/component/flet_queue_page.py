@@ -1,11 +1,22 @@
+import asyncio
+import json
+import threading
 import flet as ft
 import time
-import base64
-from io import BytesIO
-from common.job_manager import job_manager, Job
-from common import i18n
+from typing import List
+from common.job_manager import job_manager, Job, JobGroup, JobEvent
+from common import i18n, metrics, thumbnail_cache, event_bus
+from common.image_util import ImageRef
+from geminiapi.circuit_breaker import breakers, CLOSED
+from fletapp.component.common_component import show_snackbar
 
-def queue_page(page: ft.Page):
+# Minimum time between two renders of the page, however many job notifications arrive meanwhile
+FRAME_BUDGET = 0.1
+# Above this many jobs the table becomes a virtualized list
+VIRTUALIZE_AFTER = 100
+ROW_HEIGHT = 48
+
+def queue_page(page: ft.Page, bus: event_bus.EventBus):
     
     def format_time(timestamp):
         if not timestamp:
@@ -35,6 +46,38 @@ def queue_page(page: ft.Page):
             return ft.Icon(ft.Icons.CANCEL, color=ft.Colors.ORANGE_500, size=18)
         return ft.Icon(ft.Icons.QUESTION_MARK, size=18)
 
+    def format_seconds(seconds):
+        if seconds < 1:
+            return f"{seconds * 1000:.0f} ms"
+        return f"{seconds:.2f} s"
+
+    def build_timing_rows(job: Job):
+        breakdown = job.timing_breakdown()
+        total = sum(breakdown.values())
+        rows = []
+        for name, seconds in breakdown.items():
+            rows.append(ft.Row([
+                ft.Text(i18n.get(f"queue_span_{name}", name), size=13, width=150),
+                ft.ProgressBar(value=seconds / total if total else 0, bar_height=8, expand=True),
+                ft.Text(format_seconds(seconds), size=13, width=80, text_align=ft.TextAlign.RIGHT),
+            ], spacing=10))
+        return rows
+
+    def write_timings_file(path, jobs: List[Job]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([job.timing_dict() for job in jobs], f, ensure_ascii=False, indent=2)
+
+    async def export_timings(jobs: List[Job], file_name: str):
+        file_picker = ft.FilePicker()
+        save_path = await file_picker.save_file(file_name=file_name, allowed_extensions=["json"])
+        if not save_path:
+            return
+        try:
+            await asyncio.to_thread(write_timings_file, save_path, jobs)
+            show_snackbar(page, i18n.get("queue_timings_exported", "Timings exported to {path}", path=save_path))
+        except (IOError, OSError) as e:
+            show_snackbar(page, str(e), is_error=True)
+
     def show_job_details(job: Job):
         # Extract prompt from kwargs
         prompt = job.kwargs.get("prompt") or job.kwargs.get("prompt_parts")
@@ -45,6 +88,8 @@ def queue_page(page: ft.Page):
             for part in prompt:
                 if isinstance(part, str):
                     formatted_prompt.append(part)
+                elif isinstance(part, ImageRef):
+                    formatted_prompt.append(f"[Image: {part.name}]")
                 else:
                     formatted_prompt.append(f"[Image/Object: {type(part).__name__}]")
             prompt_text = "\n".join(formatted_prompt)
@@ -61,23 +106,18 @@ def queue_page(page: ft.Page):
                 ft.Image(src=path, width=80, height=80, fit=ft.BoxFit.COVER, border_radius=5)
             )
             
-        # 2. Check for PIL Images in prompt_parts (Chat)
+        # 2. Check for image references in prompt_parts (Chat); their WebP thumbnails are rendered in the
+        # background when the job is enqueued, so nothing is decoded here
         prompt_parts = job.kwargs.get("prompt_parts", [])
         if isinstance(prompt_parts, list):
             for part in prompt_parts:
-                if not isinstance(part, str):
-                    try:
-                        # Convert PIL Image to base64 for preview
-                        buffered = BytesIO()
-                        preview_img = part.copy()
-                        preview_img.thumbnail((200, 200))
-                        preview_img.save(buffered, format="PNG")
-                        img_str = base64.b64encode(buffered.getvalue()).decode()
-                        images_row.controls.append(
-                            ft.Image(src_base64=img_str, width=80, height=80, fit=ft.BoxFit.COVER, border_radius=5)
-                        )
-                    except:
-                        pass
+                if isinstance(part, ImageRef):
+                    images_row.controls.append(
+                        ft.Image(src=thumbnail_cache.cache.get(part) or part.path, width=80, height=80,
+                                 fit=ft.BoxFit.COVER, border_radius=5)
+                    )
+
+        timing_rows = build_timing_rows(job)
 
         def close_dlg(e):
             page.pop_dialog()
@@ -131,6 +171,11 @@ def queue_page(page: ft.Page):
                             ft.Text(f"{i18n.get('queue_col_started')}: {format_time(job.started_at)}", size=13),
                         ], expand=True),
                     ], spacing=20),
+
+                    ft.Column([
+                        ft.Text(i18n.get("queue_dialog_timing_title", "Latency Breakdown"), weight=ft.FontWeight.BOLD, size=14),
+                        *timing_rows,
+                    ], spacing=4, visible=bool(timing_rows)),
                     
                     ft.Column([
                         ft.Divider(height=20),
@@ -149,6 +194,9 @@ def queue_page(page: ft.Page):
                 height=500,
             ),
             actions=[
+                ft.TextButton(i18n.get("queue_btn_export_timings", "Export Timings (JSON)"), icon=ft.Icons.DATA_OBJECT,
+                              on_click=lambda _: asyncio.create_task(export_timings([job], f"{job.id}_timings.json")),
+                              visible=bool(timing_rows)),
                 ft.ElevatedButton(i18n.get("dialog_btn_close"), on_click=close_dlg, style=ft.ButtonStyle(color=ft.Colors.WHITE, bgcolor=ft.Colors.BLUE_400))
             ],
             actions_alignment=ft.MainAxisAlignment.END,
@@ -157,13 +205,91 @@ def queue_page(page: ft.Page):
         
         page.show_dialog(dialog)
 
-    def create_job_row(job: Job):
+    def format_bytes(num):
+        for unit in ("B", "KB", "MB"):
+            if num < 1024:
+                return f"{num:.0f} {unit}" if unit == "B" else f"{num:.1f} {unit}"
+            num /= 1024
+        return f"{num:.1f} GB"
+
+    def metric_tile(label, value):
+        return ft.Column([
+            ft.Text(label, size=12, color=ft.Colors.GREY_600),
+            ft.Text(value, size=16, weight=ft.FontWeight.BOLD),
+        ], spacing=2)
+
+    def build_metrics_controls():
+        tiles = ft.Row([
+            metric_tile(i18n.get("queue_metrics_jobs_per_min", "Jobs / min"),
+                        f"{metrics.JOBS_THROUGHPUT.rate_per_minute():.1f}"),
+            metric_tile(i18n.get("queue_status_success"), f"{metrics.JOBS_TOTAL.value(status='success'):.0f}"),
+            metric_tile(i18n.get("queue_status_error"), f"{metrics.JOBS_TOTAL.value(status='error'):.0f}"),
+            metric_tile(i18n.get("queue_metrics_retries", "Retries"), f"{metrics.RETRIES_TOTAL.total():.0f}"),
+            metric_tile("429", f"{metrics.API_ERRORS_TOTAL.total(status='429'):.0f}"),
+            metric_tile("5xx", f"{metrics.API_ERRORS_TOTAL.total(status='5xx'):.0f}"),
+            metric_tile(i18n.get("queue_metrics_upload", "Uploaded"), format_bytes(metrics.BYTES_UPLOADED.total())),
+            metric_tile(i18n.get("queue_metrics_download", "Downloaded"), format_bytes(metrics.BYTES_DOWNLOADED.total())),
+            metric_tile(i18n.get("queue_metrics_tokens", "Tokens"), f"{metrics.TOKENS_TOTAL.total(type='total'):.0f}"),
+        ], spacing=30, wrap=True)
+
+        latency_rows = []
+        for labels in metrics.REQUEST_LATENCY.label_sets():
+            p50 = metrics.REQUEST_LATENCY.percentile(0.5, **labels)
+            p95 = metrics.REQUEST_LATENCY.percentile(0.95, **labels)
+            latency_rows.append(ft.Text(
+                i18n.get("queue_metrics_latency_row", "{model} ({kind}): p50 {p50} · p95 {p95} · n={count}",
+                         model=labels.get("model", "?"), kind=labels.get("kind", "?"),
+                         p50=format_seconds(p50), p95=format_seconds(p95),
+                         count=metrics.REQUEST_LATENCY.count(**labels)),
+                size=13))
+        circuit_rows = [
+            ft.Text(i18n.get("queue_metrics_circuit_open", "⛔ {model}: circuit {state}, retry in {seconds}",
+                             model=item["model"], state=item["state"], seconds=format_seconds(item["retry_in"])),
+                    size=13, color=ft.Colors.ORANGE)
+            for item in breakers.snapshot() if item["state"] != CLOSED
+        ]
+        return [tiles, *latency_rows, *circuit_rows]
+
+    metrics_column = ft.Column(spacing=8)
+
+    def create_group_row(group: JobGroup):
+        return ft.Row([
+            ft.Icon(ft.Icons.GRID_VIEW, size=18, color=ft.Colors.BLUE_400),
+            ft.Text(i18n.get("home_matrix_progress", "{name}: {done}/{total} done, {failed} failed",
+                             name=group.name, done=group.finished, total=group.total, failed=group.failed),
+                    size=13, width=360, overflow=ft.TextOverflow.ELLIPSIS),
+            ft.ProgressBar(value=group.progress, bar_height=8, expand=True),
+            ft.IconButton(icon=ft.Icons.CANCEL_OUTLINED, icon_color=ft.Colors.RED_400, icon_size=18,
+                          tooltip=i18n.get("home_matrix_cancel_tooltip"), visible=not group.is_done,
+                          on_click=lambda _: job_manager.cancel_group(group.id)),
+        ], spacing=10)
+
+    # Most recent groups first
+    groups_column = ft.Column(spacing=4)
+
+    # --- Job list: one row view per job, only changed cells are touched on refresh ---
+    columns = [
+        (i18n.get("queue_col_name"), None),
+        (i18n.get("queue_col_status"), 150),
+        (i18n.get("queue_col_created"), 100),
+        (i18n.get("queue_col_started"), 150),
+        (i18n.get("queue_col_actions"), 100),
+    ]
+
+    def started_text(job: Job):
         duration = ""
         if job.started_at and job.finished_at:
             duration = f" ({int(job.finished_at - job.started_at)}s)"
         elif job.started_at:
             duration = f" ({int(time.time() - job.started_at)}s...)"
+        return f"{format_time(job.started_at)}{duration}"
 
+    def row_signature(job: Job):
+        # Everything a row displays that can change after creation
+        elapsed = int(time.time() - job.started_at) if job.started_at and not job.finished_at else None
+        return job.status, job.started_at, job.finished_at, elapsed
+
+    def create_job_row(job: Job, virtualized: bool):
         cancel_btn = ft.IconButton(
             icon=ft.Icons.CANCEL_OUTLINED,
             icon_color=ft.Colors.RED_400,
@@ -180,29 +306,52 @@ def queue_page(page: ft.Page):
         )
 
         # Merge Icon and Status text into one cell
-        status_cell_content = ft.Row([
-            get_status_icon(job.status),
-            ft.Text(get_status_text(job.status), color=ft.Colors.BLUE_600 if job.status == "running" else None)
-        ], spacing=8, alignment=ft.MainAxisAlignment.START)
-
-        return ft.DataRow(
-            cells=[
-                ft.DataCell(ft.Text(job.name, overflow=ft.TextOverflow.ELLIPSIS, weight=ft.FontWeight.W_500)),
-                ft.DataCell(status_cell_content),
-                ft.DataCell(ft.Text(format_time(job.created_at))),
-                ft.DataCell(ft.Text(f"{format_time(job.started_at)}{duration}")),
-                ft.DataCell(ft.Row([view_btn, cancel_btn], spacing=0)),
-            ]
-        )
+        status_text = ft.Text(get_status_text(job.status), color=ft.Colors.BLUE_600 if job.status == "running" else None)
+        status_cell_content = ft.Row([get_status_icon(job.status), status_text],
+                                     spacing=8, alignment=ft.MainAxisAlignment.START)
+        started = ft.Text(started_text(job))
+
+        cells = [
+            ft.Text(job.name, overflow=ft.TextOverflow.ELLIPSIS, weight=ft.FontWeight.W_500),
+            status_cell_content,
+            ft.Text(format_time(job.created_at)),
+            started,
+            ft.Row([view_btn, cancel_btn], spacing=0),
+        ]
+        if virtualized:
+            control = ft.Container(
+                content=ft.Row([ft.Container(cell, width=width, expand=width is None)
+                                for cell, (_, width) in zip(cells, columns)], spacing=20),
+                height=ROW_HEIGHT,
+                padding=ft.Padding.symmetric(horizontal=10),
+                border=ft.Border.only(bottom=ft.BorderSide(1, ft.Colors.OUTLINE_VARIANT)),
+            )
+        else:
+            control = ft.DataRow(cells=[ft.DataCell(cell) for cell in cells])
+        return {
+            "job": job,
+            "control": control,
+            "signature": row_signature(job),
+            "status_row": status_cell_content,
+            "status_text": status_text,
+            "started": started,
+            "cancel_btn": cancel_btn,
+        }
+
+    def update_job_row(row, job: Job):
+        signature = row_signature(job)
+        if signature == row["signature"]:
+            return
+        if signature[0] != row["signature"][0]:
+            row["status_row"].controls[0] = get_status_icon(job.status)
+            row["status_text"].value = get_status_text(job.status)
+            row["status_text"].color = ft.Colors.BLUE_600 if job.status == "running" else None
+            row["cancel_btn"].visible = job.status == "queued"
+        row["started"].value = started_text(job)
+        row["signature"] = signature
 
     job_table = ft.DataTable(
-        columns=[
-            ft.DataColumn(ft.Text(i18n.get("queue_col_name"), weight=ft.FontWeight.BOLD)),
-            ft.DataColumn(ft.Text(i18n.get("queue_col_status"), weight=ft.FontWeight.BOLD)),
-            ft.DataColumn(ft.Text(i18n.get("queue_col_created"), weight=ft.FontWeight.BOLD)),
-            ft.DataColumn(ft.Text(i18n.get("queue_col_started"), weight=ft.FontWeight.BOLD)),
-            ft.DataColumn(ft.Text(i18n.get("queue_col_actions"), weight=ft.FontWeight.BOLD)),
-        ],
+        columns=[ft.DataColumn(ft.Text(label, weight=ft.FontWeight.BOLD)) for label, _ in columns],
         rows=[],
         heading_row_color=ft.Colors.SURFACE_CONTAINER_HIGHEST,
         divider_thickness=1,
@@ -210,20 +359,95 @@ def queue_page(page: ft.Page):
         expand=True,
     )
 
-    def refresh_ui():
+    # Long lists switch to a ListView with a fixed row height, which only builds the visible rows
+    job_list = ft.ListView(item_extent=ROW_HEIGHT, expand=True)
+    job_list_view = ft.Column([
+        ft.Container(
+            content=ft.Row([ft.Container(ft.Text(label, weight=ft.FontWeight.BOLD), width=width, expand=width is None)
+                            for label, width in columns], spacing=20),
+            bgcolor=ft.Colors.SURFACE_CONTAINER_HIGHEST,
+            padding=ft.Padding.symmetric(horizontal=10, vertical=12),
+        ),
+        job_list,
+    ], spacing=0, expand=True)
+    jobs_container = ft.Container(content=job_table, padding=10)
+
+    list_state = {"rows": {}, "order": [], "virtualized": False}
+
+    def render_jobs():
         jobs = job_manager.get_all_jobs()
-        # Show newest first
-        job_table.rows = [create_job_row(j) for j in reversed(jobs)]
+        virtualized = len(jobs) > VIRTUALIZE_AFTER
+        rows = list_state["rows"]
+        if virtualized != list_state["virtualized"]:
+            # Row controls are built for one layout, so rebuild them all once on a switch
+            rows.clear()
+            list_state["order"] = []
+            list_state["virtualized"] = virtualized
+            jobs_container.content = job_list_view if virtualized else job_table
+
+        # Rows are keyed by the job object, like JobManager's history: job ids are not guaranteed unique.
+        # A row keeps its job alive (see create_job_row), so a key cannot be reused while its row exists
+        live_keys = set()
+        for job in jobs:
+            live_keys.add(id(job))
+            row = rows.get(id(job))
+            if row is None:
+                rows[id(job)] = create_job_row(job, virtualized)
+            else:
+                update_job_row(row, job)
+        for key in [key for key in rows if key not in live_keys]:
+            del rows[key]
+
+        # Show newest first; only touch the row list when jobs were added, dropped or reordered
+        order = [id(job) for job in reversed(jobs)]
+        if order != list_state["order"]:
+            list_state["order"] = order
+            controls = [rows[key]["control"] for key in order]
+            if virtualized:
+                job_list.controls = controls
+            else:
+                job_table.rows = controls
+
+    def render(update_page=True):
+        render_jobs()
         queue_count_text.value = i18n.get("queue_jobs_count", count=job_manager.get_queue_size())
+        metrics_column.controls = build_metrics_controls()
+        groups_column.controls = [create_group_row(g) for g in reversed(job_manager.get_groups()[-5:])]
+        if update_page:
+            try:
+                page.update()
+            except Exception:  # pylint: disable=broad-exception-caught
+                pass  # The page may already be closed
+
+    # Notifications come in bursts (several per job, hundreds for a matrix); render at most once per frame budget
+    render_state = {"scheduled": False, "last": 0.0}
+    render_lock = threading.Lock()
+
+    async def render_later():
+        delay = render_state["last"] + FRAME_BUDGET - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        with render_lock:
+            render_state["scheduled"] = False
+        render_state["last"] = time.monotonic()
+        render()
+
+    def refresh_ui(_events: List[JobEvent]):
+        with render_lock:
+            if render_state["scheduled"]:
+                return
+            render_state["scheduled"] = True
         try:
-            page.update()
-        except:
-            pass
+            page.run_task(render_later)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # No event loop yet (or the page is gone); the next notification tries again
+            with render_lock:
+                render_state["scheduled"] = False
 
     queue_count_text = ft.Text(i18n.get("queue_jobs_count", count=job_manager.get_queue_size()), size=20, weight=ft.FontWeight.BOLD)
     
-    # Subscribe to job manager updates
-    job_manager.subscribe(refresh_ui)
+    # Job manager updates arrive through the page's event bus
+    bus.subscribe(event_bus.TOPIC_JOBS, refresh_ui)
 
     # Main layout
     view = ft.Container(
@@ -231,15 +455,27 @@ def queue_page(page: ft.Page):
             ft.Row([
                 ft.Icon(ft.Icons.QUEUE_PLAY_NEXT, size=30, color=ft.Colors.BLUE_400),
                 queue_count_text,
-                ft.IconButton(ft.Icons.REFRESH, on_click=lambda _: refresh_ui(), tooltip=i18n.get("home_history_btn_refresh_tooltip"))
+                ft.IconButton(ft.Icons.REFRESH, on_click=lambda _: render(), tooltip=i18n.get("home_history_btn_refresh_tooltip")),
+                ft.IconButton(ft.Icons.DATA_OBJECT,
+                              on_click=lambda _: asyncio.create_task(
+                                  export_timings(job_manager.get_all_jobs(), f"job_timings_{int(time.time())}.json")),
+                              tooltip=i18n.get("queue_btn_export_timings", "Export Timings (JSON)"))
             ], alignment=ft.MainAxisAlignment.START),
             ft.Divider(height=20, thickness=1),
+            ft.Card(
+                content=ft.Container(
+                    content=ft.Column([
+                        ft.Text(i18n.get("queue_metrics_title", "Metrics"), weight=ft.FontWeight.BOLD, size=14),
+                        metrics_column,
+                    ], spacing=8),
+                    padding=15,
+                ),
+                elevation=1,
+            ),
+            groups_column,
             ft.Column([
                 ft.Card(
-                    content=ft.Container(
-                        content=job_table,
-                        padding=10,
-                    ),
+                    content=jobs_container,
                     elevation=2,
                     expand=True,
                 )
@@ -250,6 +486,6 @@ def queue_page(page: ft.Page):
     )
 
     # Initial load
-    refresh_ui()
+    render(update_page=False)
 
     return view
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import platform
@@ -11,7 +12,9 @@ import flet as ft
 from flet import Container
 from flet import Page
 
-from common import database as db, i18n, logger_utils
+from common import database as db, i18n, logger_utils, metrics
+from common.token_ledger import fingerprint_key
+from geminiapi import key_pool, hedging
 from common.config import UPLOAD_DIR, OUTPUT_DIR, TEMP_DIR
 from fletapp.component.common_component import show_snackbar
 
@@ -42,14 +45,100 @@ def settings_page(page: Page) -> Container:
     )
     save_path_input = ft.TextField(label=i18n.get("settings_label_savePath"))
     file_prefix_input = ft.TextField(label=i18n.get("settings_label_prefix"))
+    metrics_port_input = ft.TextField(label=i18n.get("settings_label_metrics_port", "Metrics Endpoint Port"),
+                                      hint_text=i18n.get("settings_hint_metrics_port", "Empty = disabled"),
+                                      input_filter=ft.NumbersOnlyInputFilter(), width=250)
+    hedge_checkbox = ft.Checkbox(label=i18n.get("settings_label_hedge", "Hedge slow requests"))
+    hedge_percent_input = ft.TextField(label=i18n.get("settings_label_hedge_percent", "Max hedged requests (%)"),
+                                       input_filter=ft.NumbersOnlyInputFilter(), width=250)
+    chat_turns_input = ft.TextField(label=i18n.get("settings_label_chat_turns", "Chat context (turns)"),
+                                    input_filter=ft.NumbersOnlyInputFilter(), width=250)
+    chat_image_turns_input = ft.TextField(label=i18n.get("settings_label_chat_image_turns", "Keep images for (turns)"),
+                                          input_filter=ft.NumbersOnlyInputFilter(), width=250)
+    chat_summarize_checkbox = ft.Checkbox(label=i18n.get("settings_label_chat_summarize", "Summarize older turns"))
+
+    # --- API Key Pool ---
+    pool_key_label_input = ft.TextField(label=i18n.get("settings_key_pool_label", "Label"), width=180, dense=True)
+    pool_key_input = ft.TextField(label=i18n.get("settings_label_apiKey"), password=True, can_reveal_password=True,
+                                  expand=True, dense=True)
+    pool_keys_column = ft.Column(spacing=0)
+
+    def key_status_text(status):
+        if status is None:
+            return ""
+        if status["disabled"]:
+            return i18n.get("settings_key_pool_rejected", "rejected ({code})", code=status["disabled"])
+        if status["cooldown"] > 0:
+            return i18n.get("settings_key_pool_cooling", "cooling down {seconds}s", seconds=int(status["cooldown"]))
+        return i18n.get("settings_key_pool_stats", "{requests} requests, {errors} errors",
+                        requests=status["requests"], errors=status["errors"])
+
+    def refresh_key_pool(reload_pool=True):
+        if reload_pool:
+            key_pool.pool.reload()
+        statuses = {item["fingerprint"]: item for item in key_pool.pool.snapshot()}
+        pool_keys_column.controls = [
+            ft.Row([
+                ft.Switch(value=bool(row["enabled"]),
+                          on_change=lambda e, key_id=row["id"]: toggle_pool_key(key_id, e.control.value)),
+                ft.Text(row["label"] or "-", width=150, weight=ft.FontWeight.W_500),
+                ft.Text(f"…{row['api_key'][-4:]}", width=70, font_family="monospace"),
+                ft.Text(key_status_text(statuses.get(fingerprint_key(row["api_key"]))), size=12, expand=True,
+                        color=ft.Colors.GREY_600),
+                ft.IconButton(icon=ft.Icons.DELETE_OUTLINE, icon_color=ft.Colors.RED_400,
+                              on_click=lambda e, key_id=row["id"]: remove_pool_key(key_id)),
+            ])
+            for row in db.get_api_keys()
+        ]
+        page.update()
+
+    def add_pool_key(e):
+        if not pool_key_input.value:
+            return
+        if not db.add_api_key(pool_key_input.value, pool_key_label_input.value or ""):
+            show_snackbar(page, i18n.get("settings_key_pool_duplicate", "This key is already in the pool."),
+                          is_error=True)
+            return
+        pool_key_input.value = ""
+        pool_key_label_input.value = ""
+        refresh_key_pool()
+
+    def toggle_pool_key(key_id, enabled):
+        db.set_api_key_enabled(key_id, enabled)
+        refresh_key_pool()
+
+    def remove_pool_key(key_id):
+        db.delete_api_key(key_id)
+        refresh_key_pool()
 
     # --- Save Settings Logic ---
     def save_settings_handler(e):
+        # Validate before saving anything, so an invalid port is never stored
+        metrics_port = (metrics_port_input.value or "").strip()
+        if metrics_port and not (metrics_port.isdigit() and 1 <= int(metrics_port) <= 65535):
+            show_snackbar(page, i18n.get("settings_invalid_metrics_port", "Metrics port must be 1-65535."),
+                          is_error=True)
+            return
         try:
             db.save_setting("api_key", api_key_input.value or "")
             db.save_setting("save_path", save_path_input.value or "outputs")
             db.save_setting("file_prefix", file_prefix_input.value or "gemini_gen")
             db.save_setting("language", lang_dropdown.value or "en")
+            db.save_setting("metrics_port", metrics_port)
+            db.save_setting("hedge_requests", "1" if hedge_checkbox.value else "")
+            db.save_setting("hedge_max_percent", hedge_percent_input.value or "10")
+            db.save_setting("chat_context_turns", chat_turns_input.value or "0")
+            db.save_setting("chat_image_turns", chat_image_turns_input.value or "0")
+            db.save_setting("chat_summarize", "1" if chat_summarize_checkbox.value else "")
+            key_pool.pool.reload()
+            hedging.policy.reload()
+            # Restarts the endpoint if the port changed
+            if metrics_port and metrics.start_http_server(int(metrics_port)) is None:
+                show_snackbar(page, i18n.get("settings_metrics_start_failed", "Settings saved, but the metrics endpoint "
+                                             "could not be started on port {port}.", port=metrics_port), is_error=True)
+                return
+            if not metrics_port:
+                metrics.stop_http_server()
             show_snackbar(page, i18n.get("settings_saved_content", "Settings have been saved successfully."))
         except Exception as ex:
             show_snackbar(page, f"{i18n.get('settings_saved_error_content', 'Failed to save settings:')} {ex}",
@@ -139,34 +228,69 @@ def settings_page(page: Page) -> Container:
         actions=[ft.TextButton(i18n.get("dialog_btn_ok", "OK"), on_click=close_import_dialog)],
     )
 
+    # --- Data Import/Export (runs off the UI thread) ---
+    data_progress_bar = ft.ProgressBar(value=0, visible=False)
+    data_progress_text = ft.Text(size=12, visible=False)
+
+    def show_data_progress(message):
+        data_progress_text.value = message
+        data_progress_bar.value = 0
+        data_progress_text.visible = data_progress_bar.visible = True
+        page.update()
+
+    def hide_data_progress():
+        data_progress_text.visible = data_progress_bar.visible = False
+        page.update()
+
+    def report_data_progress(done, total):
+        # Called from the worker thread once per chunk
+        data_progress_bar.value = done / total if total else None
+        data_progress_bar.update()
+
     async def export_btn_handler():
         if state.export_picker is None:
             state.export_picker = ft.FilePicker()
         try:
-            all_data = db.export_all_data()
-            json_bytes = json.dumps(all_data, ensure_ascii=False).encode('utf-8')
-            save_file_path = await state.export_picker.save_file(file_name=f"g_ai_edit_backup_{int(time.time())}.json",
-                                                                 allowed_extensions=["json"],
-                                                                 src_bytes=json_bytes
-                                                                 )
+            save_file_path = await state.export_picker.save_file(
+                file_name=f"g_ai_edit_backup_{int(time.time())}.ndjson",
+                allowed_extensions=["ndjson"])
+            if not save_file_path:
+                return
+            show_data_progress(i18n.get("settings_export_progress", "Exporting data..."))
+            await asyncio.to_thread(db.export_all_data_ndjson, save_file_path, report_data_progress)
             show_snackbar(page,
                           i18n.get("settings_export_success", "Data successfully exported to {path}",
                                    path=save_file_path))
         except Exception as ex:
             show_snackbar(page, i18n.get("settings_export_error", "Error exporting data: {error}", error=ex),
                           is_error=True)
+        finally:
+            hide_data_progress()
+
+    def import_legacy_json(file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            data_to_import = json.load(f)
+        db.import_all_data(data_to_import)
 
     async def import_btn_handler():
         if state.import_picker is None:
             state.import_picker = ft.FilePicker()
-        files = await state.import_picker.pick_files(allow_multiple=False, allowed_extensions=["json"])
+        files = await state.import_picker.pick_files(allow_multiple=False, allowed_extensions=["ndjson", "json"])
+        if not files:
+            return
+        file_path = files[0].path
         try:
-            with open(files[0].path, "r", encoding="utf-8") as f:
-                data_to_import = json.load(f)
-            db.import_all_data(data_to_import)
+            show_data_progress(i18n.get("settings_import_progress", "Importing data..."))
+            if file_path.lower().endswith(".ndjson"):
+                await asyncio.to_thread(db.import_all_data_ndjson, file_path, report_data_progress)
+            else:
+                # Backups from older versions are a single JSON document
+                await asyncio.to_thread(import_legacy_json, file_path)
+            hide_data_progress()
             page.show_dialog(import_dialog)
 
         except Exception as ex:
+            hide_data_progress()
             show_snackbar(page, i18n.get("settings_import_error", "Error importing data: {error}", error=ex),
                           is_error=True)
 
@@ -209,7 +333,13 @@ def settings_page(page: Page) -> Container:
         save_path_input.value = settings.get("save_path", "outputs")
         file_prefix_input.value = settings.get("file_prefix", "gemini_gen")
         lang_dropdown.value = settings.get("language", "en")
-        page.update()
+        metrics_port_input.value = settings.get("metrics_port", "")
+        hedge_checkbox.value = bool(settings.get("hedge_requests"))
+        hedge_percent_input.value = settings.get("hedge_max_percent", "10")
+        chat_turns_input.value = settings.get("chat_context_turns", "10")
+        chat_image_turns_input.value = settings.get("chat_image_turns", "2")
+        chat_summarize_checkbox.value = bool(settings.get("chat_summarize"))
+        refresh_key_pool(reload_pool=False)
 
     threading.Timer(0.1, load_initial_settings).start()
 
@@ -219,13 +349,38 @@ def settings_page(page: Page) -> Container:
                 ft.Text(i18n.get("settings_title"), size=24, weight=ft.FontWeight.BOLD),
                 lang_dropdown,
                 ft.Row(controls=[api_key_input, ft.Container(expand=True)]),
+                ft.Text(i18n.get("settings_key_pool_title", "Additional API Keys"), size=16,
+                        weight=ft.FontWeight.BOLD),
+                ft.Text(i18n.get("settings_key_pool_help",
+                                 "Requests are spread over all enabled keys: the least busy key is used first, "
+                                 "a key is paused after a quota error (429) and skipped after 401/403."),
+                        size=12, color=ft.Colors.GREY_600),
+                pool_keys_column,
+                ft.Row([pool_key_label_input, pool_key_input,
+                        ft.IconButton(icon=ft.Icons.ADD, on_click=add_pool_key,
+                                      tooltip=i18n.get("settings_key_pool_add", "Add key"))]),
                 file_prefix_input,
                 ft.Row([save_path_input, pick_output_directory_btn]),
+                metrics_port_input,
+                ft.Row([hedge_checkbox, hedge_percent_input]),
+                ft.Text(i18n.get("settings_hedge_help",
+                                 "When a request takes longer than the model's usual p90 latency, the same request "
+                                 "is sent again with another key and the first result wins. Hedged requests use "
+                                 "quota too, so they are capped at the given share of all requests."),
+                        size=12, color=ft.Colors.GREY_600),
+                ft.Row([chat_turns_input, chat_image_turns_input, chat_summarize_checkbox]),
+                ft.Text(i18n.get("settings_chat_context_help",
+                                 "Each chat request only carries the most recent turns; older images are replaced "
+                                 "by a short placeholder and older turns by a text summary. Lower values cut input "
+                                 "tokens and latency on long sessions. 0 = no limit."),
+                        size=12, color=ft.Colors.GREY_600),
                 save_button,
                 ft.Divider(),
                 ft.Text(i18n.get("settings_data_management_title", "Data Management"), size=18,
                         weight=ft.FontWeight.BOLD),
                 ft.Row([import_button, export_button], alignment=ft.MainAxisAlignment.START),
+                data_progress_text,
+                data_progress_bar,
                 ft.Divider(),
                 ft.Text(i18n.get("settings_app_management_title", "Application Management"), size=18,
                         weight=ft.FontWeight.BOLD),
@@ -2,21 +2,24 @@ import asyncio
 import os
 import shutil
 import time
+import uuid
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 import flet as ft
 # Custom imports
-from common import database as db, logger_utils, i18n
+from common import database as db, logger_utils, i18n, tracing, event_bus
 from common.config import MODEL_SELECTOR_CHOICES, AR_SELECTOR_CHOICES, RES_SELECTOR_CHOICES, OUTPUT_DIR, VALID_IMAGE_EXTENSIONS
 from common.image_util import get_image_details
-from common.job_manager import job_manager, Job
+from common.job_manager import job_manager, Job, JobEvent
+from common.job_matrix import (MatrixSpec, count_matrix, describe_group, expand_matrix, parse_variables,
+                               IMAGE_MODE_EACH, IMAGE_MODE_SHARED)
 from common.text_encoder import text_encoder
 from flet import MainAxisAlignment
 from flet import Page, BoxFit, Alignment, FilePickerFileType
 from fletapp.component.common_component import show_snackbar
 from fletapp.component.flet_gallery_component import local_gallery_component
-from geminiapi import api_client
+from geminiapi import api_client, key_pool
 
 # Ensure OUTPUT_DIR exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -32,7 +35,16 @@ class State:
 state = State()
 
 
-def single_edit_tab(page: Page) -> Dict[str, Any]:
+def generate_image(**kwargs):
+    """Job task around call_google_genai, which logs failures and returns None: raise instead, so the job
+    (and its matrix group) is counted as failed."""
+    image = api_client.call_google_genai(**kwargs)
+    if image is None:
+        raise RuntimeError("No image returned, see log for details.")
+    return image
+
+
+def single_edit_tab(page: Page, bus: event_bus.EventBus) -> Dict[str, Any]:
     if state.selected_images_paths is None:
         state.selected_images_paths = []
 
@@ -60,8 +72,9 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
                                        padding=0, controls=[], expand=True)
     prompt_input = ft.TextField(label=i18n.get("home_control_prompt_input_placeholder"), multiline=True, min_lines=3,
                                 max_lines=5, hint_text=i18n.get("home_control_prompt_input_placeholder"), expand=4)
-    log_output_text = ft.Text(i18n.get("log_initial_message", "Log messages will appear here..."), selectable=True,
-                              expand=True)
+    log_placeholder = ft.Text(i18n.get("log_initial_message", "Log messages will appear here..."), selectable=True)
+    # Newest line on top; lines are prepended as they arrive instead of re-rendering the whole log
+    log_output_list = ft.ListView(controls=[log_placeholder], spacing=2, expand=True)
     api_response_image = ft.Image(src="https://via.placeholder.com/300x200?text=API+Response", fit=BoxFit.CONTAIN,
                                   expand=True)
 
@@ -82,6 +95,23 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
         style=ft.ButtonStyle(color=ft.Colors.WHITE, bgcolor=ft.Colors.BLUE_GREY_700)
     )
 
+    matrix_button = ft.OutlinedButton(
+        content=ft.Text(i18n.get("home_control_btn_matrix", "Matrix...")),
+        icon=ft.Icons.GRID_VIEW,
+        on_click=lambda e: open_matrix_dialog(),
+        tooltip=i18n.get("home_matrix_tooltip", "Expand the prompt over several models, ratios, resolutions or images"),
+    )
+    matrix_progress_text = ft.Text(size=12)
+    matrix_progress_bar = ft.ProgressBar(value=0, bar_height=6)
+    matrix_cancel_button = ft.IconButton(icon=ft.Icons.CANCEL_OUTLINED, icon_color=ft.Colors.RED_400, icon_size=18,
+                                         tooltip=i18n.get("home_matrix_cancel_tooltip", "Cancel remaining jobs"),
+                                         on_click=lambda e: job_manager.cancel_group(matrix_state["group_id"]))
+    matrix_progress_row = ft.Row([
+        ft.Column([matrix_progress_text, matrix_progress_bar], spacing=4, expand=True),
+        matrix_cancel_button,
+    ], visible=False)
+    matrix_state = {"group_id": None}
+
     ratio_dropdown = ft.Dropdown(label=i18n.get("home_control_ratio_label"),
                                  options=[ft.dropdown.Option(key=value, text=text) for text, value in
                                           i18n.get_translated_choices(AR_SELECTOR_CHOICES)],
@@ -189,9 +219,42 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
             )
         selected_images_grid.update()
 
-    def on_log_update(new_logs: str):
-        log_output_text.value = new_logs
-        page.update()
+    def on_log_update(new_lines: List[str], reset: bool = False):
+        controls = log_output_list.controls
+        if reset or log_placeholder in controls:
+            controls.clear()
+        for line in new_lines:
+            controls.insert(0, ft.Text(line, selectable=True, size=12))
+        del controls[logger_utils.MAX_LOG_LINES:]
+        log_output_list.update()
+
+    def on_log_event(payload):
+        new_lines, reset = payload
+        on_log_update(new_lines, reset)
+
+    def publish_log_lines(new_lines: List[str], reset: bool):
+        # Called from the logger's timer thread; the bus hands the lines to the page's event loop
+        bus.publish(event_bus.TOPIC_LOG, (new_lines, reset))
+
+    def attach_log_view(min_level: int):
+        """(Re)subscribes the log view at the given level and renders the matching backlog."""
+        logger_utils.unsubscribe(publish_log_lines)
+        # Subscribe first and read the backlog only up to where the subscription starts: a line logged in
+        # between is then delivered exactly once
+        start_seq = logger_utils.subscribe(publish_log_lines, min_level=min_level)
+        backlog = [record.text for record in logger_utils.get_logs_since(0, min_level=min_level)
+                   if record.seq <= start_seq]
+        # Through the bus too, so the reset reaches the view ahead of the subscription's first (coalesced) push
+        publish_log_lines(backlog, True)
+
+    log_level_dropdown = ft.Dropdown(
+        label=i18n.get("home_control_log_level_label", "Level"),
+        options=[ft.dropdown.Option(key=str(level), text=name) for level, name in logger_utils.LEVEL_NAMES.items()],
+        value=str(logger_utils.INFO),
+        width=150,
+        dense=True,
+        on_select=lambda e: attach_log_view(int(log_level_dropdown.value)),
+    )
 
     async def handle_api_start(disable_ui: bool):
         api_task_state["status"] = "running"
@@ -205,24 +268,26 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
     async def handle_api_success(generated_image):
         if generated_image:
             prefix = db.get_setting("file_prefix", "gemini_gen")
-            filename = f"{prefix}_{int(time.time())}.png"
+            # Matrix cells can finish within the same millisecond; the random suffix keeps their files apart
+            filename = f"{prefix}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}.png"
             temp_path = os.path.abspath(os.path.join(OUTPUT_DIR, filename))
 
-            # Save image in thread to avoid blocking
-            await asyncio.to_thread(generated_image.save, temp_path, format="PNG")
-
-            api_task_state.update({"result_image_path": temp_path, "status": "success"})
-            api_response_image.src = temp_path
-            logger_utils.log(i18n.get("logic_log_saveOk", path=temp_path))
-
-            permanent_dir = db.get_setting("save_path")
-            if permanent_dir:
-                try:
-                    os.makedirs(permanent_dir, exist_ok=True)
-                    await asyncio.to_thread(shutil.copy, temp_path,
-                                            os.path.abspath(os.path.join(permanent_dir, filename)))
-                except (IOError, OSError) as e:
-                    logger_utils.log(f"Failed to copy to permanent storage: {e}")
+            with tracing.span(tracing.SPAN_SAVE):
+                # Save image in thread to avoid blocking
+                await asyncio.to_thread(generated_image.save, temp_path, format="PNG")
+
+                api_task_state.update({"result_image_path": temp_path, "status": "success"})
+                api_response_image.src = temp_path
+                logger_utils.log(i18n.get("logic_log_saveOk", path=temp_path))
+
+                permanent_dir = db.get_setting("save_path")
+                if permanent_dir:
+                    try:
+                        os.makedirs(permanent_dir, exist_ok=True)
+                        await asyncio.to_thread(shutil.copy, temp_path,
+                                                os.path.abspath(os.path.join(permanent_dir, filename)))
+                    except (IOError, OSError) as e:
+                        logger_utils.log(f"Failed to copy to permanent storage: {e}")
             page.update()
         else:
             api_task_state.update({"status": "error", "error_msg": "No image returned"})
@@ -240,7 +305,7 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
 
     async def send_prompt_handler(e, disable_ui: bool = True):
         api_key = db.get_all_settings().get("api_key")
-        if not api_key:
+        if not key_pool.pool.pick(api_key):
             show_snackbar(page, i18n.get("api_error_apiKey"), is_error=True)
             return
         if not prompt_input.value and not state.selected_images_paths:
@@ -248,9 +313,9 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
             return
 
         job = Job(
-            id=f"single_edit_{int(time.time() * 1000)}",
+            id=f"single_edit_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}",
             name=f"Single Edit: {prompt_input.value[:20]}...",
-            task_func=api_client.call_google_genai,
+            task_func=generate_image,
             kwargs={
                 "prompt": text_encoder(prompt_input.value),
                 "image_paths": state.selected_images_paths.copy(), # Copy to avoid mutation
@@ -267,6 +332,143 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
         await job_manager.add_job(job)
         show_snackbar(page, i18n.get("logic_info_taskSubmitted"))
 
+    # --- Matrix generation: one template expanded into a group of jobs ---
+    def refresh_matrix_progress(events: Optional[List[JobEvent]] = None):
+        group = job_manager.groups.get(matrix_state["group_id"]) if matrix_state["group_id"] else None
+        if group is None:
+            return
+        if events is not None and all(event.group_id != group.id for event in events):
+            return
+        matrix_progress_row.visible = True
+        matrix_progress_bar.value = group.progress
+        matrix_progress_text.value = i18n.get("home_matrix_progress", "{name}: {done}/{total} done, {failed} failed",
+                                              name=group.name, done=group.finished, total=group.total,
+                                              failed=group.failed)
+        matrix_cancel_button.visible = not group.is_done
+        try:
+            matrix_progress_row.update()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # The tab may not be mounted yet
+            pass
+
+    def open_matrix_dialog():
+        if not prompt_input.value and not state.selected_images_paths:
+            show_snackbar(page, i18n.get("logic_warn_promptEmpty"), is_error=True)
+            return
+
+        model_checks = [ft.Checkbox(label=model, data=model, value=model == model_selector_dropdown.value)
+                        for model in MODEL_SELECTOR_CHOICES]
+        ratio_checks = [ft.Checkbox(label=text, data=value, value=value == ratio_dropdown.value)
+                        for text, value in i18n.get_translated_choices(AR_SELECTOR_CHOICES)]
+        resolution_checks = [ft.Checkbox(label=res, data=res, value=res == resolution_dropdown.value)
+                             for res in RES_SELECTOR_CHOICES]
+        image_mode_group = ft.RadioGroup(
+            value=IMAGE_MODE_SHARED,
+            content=ft.Row([
+                ft.Radio(value=IMAGE_MODE_SHARED, label=i18n.get("home_matrix_images_shared", "All images in every job")),
+                ft.Radio(value=IMAGE_MODE_EACH, label=i18n.get("home_matrix_images_each", "One job per image")),
+            ]),
+        )
+        variables_input = ft.TextField(
+            label=i18n.get("home_matrix_variables_label", "Placeholders (one per line)"),
+            hint_text="style = oil painting | watercolor | pixel art",
+            multiline=True, min_lines=2, max_lines=4, text_size=13,
+        )
+        count_text = ft.Text(weight=ft.FontWeight.BOLD)
+
+        def build_spec() -> MatrixSpec:
+            return MatrixSpec(
+                prompt_template=prompt_input.value or "",
+                models=[c.data for c in model_checks if c.value],
+                aspect_ratios=[c.data for c in ratio_checks if c.value],
+                resolutions=[c.data for c in resolution_checks if c.value],
+                image_paths=state.selected_images_paths.copy(),
+                image_mode=image_mode_group.value,
+                variables=parse_variables(variables_input.value),
+            )
+
+        def update_count(e=None):
+            try:
+                count_text.value = i18n.get("home_matrix_count", "{count} jobs", count=count_matrix(build_spec()))
+                count_text.color = None
+            except ValueError as ex:
+                count_text.value = str(ex)
+                count_text.color = ft.Colors.RED_600
+            if e is not None:
+                count_text.update()
+
+        for control in [*model_checks, *ratio_checks, *resolution_checks, image_mode_group, variables_input]:
+            control.on_change = update_count
+        update_count()
+
+        async def submit_matrix(e):
+            try:
+                spec = build_spec()
+                combos = expand_matrix(spec)
+            except ValueError as ex:
+                show_snackbar(page, str(ex), is_error=True)
+                return
+            api_key = db.get_all_settings().get("api_key")
+            if not key_pool.pool.pick(api_key):
+                show_snackbar(page, i18n.get("api_error_apiKey"), is_error=True)
+                return
+
+            group_id = f"matrix_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+            jobs = [
+                Job(
+                    id=f"{group_id}_{i}",
+                    name=f"Matrix: {combo['label']}",
+                    task_func=generate_image,
+                    kwargs={
+                        "prompt": text_encoder(combo["prompt"]),
+                        "image_paths": combo["image_paths"],
+                        "api_key": api_key,
+                        "model_id": combo["model_id"],
+                        "aspect_ratio": combo["aspect_ratio"],
+                        "resolution": combo["resolution"],
+                    },
+                    on_success=handle_api_success,
+                    on_error=handle_api_error,
+                )
+                for i, combo in enumerate(combos)
+            ]
+            page.pop_dialog()
+            matrix_state["group_id"] = group_id
+            await job_manager.add_jobs(jobs, group_id, describe_group(spec.prompt_template, len(jobs)))
+            refresh_matrix_progress()
+            show_snackbar(page, i18n.get("home_matrix_submitted", "{count} jobs added to the queue", count=len(jobs)))
+
+        def section(title, controls):
+            return ft.Column([
+                ft.Text(title, weight=ft.FontWeight.BOLD, size=14),
+                ft.Row(controls, wrap=True, spacing=5, run_spacing=0),
+            ], spacing=4)
+
+        dialog = ft.AlertDialog(
+            title=ft.Text(i18n.get("home_matrix_title", "Matrix Generation")),
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Text(i18n.get("home_matrix_help",
+                                     "Placeholders in the prompt: {model} {ar} {resolution} {image} {index} "
+                                     "and your own names below."), size=12, color=ft.Colors.GREY_600),
+                    section(i18n.get("home_control_model_label"), model_checks),
+                    section(i18n.get("home_control_ratio_label"), ratio_checks),
+                    section(i18n.get("home_control_resolution_label"), resolution_checks),
+                    section(i18n.get("home_matrix_images_label", "Selected images ({count})",
+                                     count=len(state.selected_images_paths)), [image_mode_group]),
+                    variables_input,
+                    count_text,
+                ], tight=True, scroll=ft.ScrollMode.AUTO, spacing=12),
+                width=600,
+            ),
+            actions=[
+                ft.TextButton(i18n.get("dialog_btn_cancel", "Cancel"), on_click=lambda e: page.pop_dialog()),
+                ft.ElevatedButton(i18n.get("home_matrix_btn_submit", "Add to Queue"), icon=ft.Icons.QUEUE,
+                                  on_click=submit_matrix),
+            ],
+        )
+        page.show_dialog(dialog)
+
     async def download_image_handler(e):
         if api_task_state["status"] == "success" and api_task_state["result_image_path"]:
             if state.file_picker is None:
@@ -287,14 +489,16 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
     # --- Initialization function to be called after mount ---
     def initialize():
         page.pubsub.subscribe(on_prompts_update)
-        logger_utils.subscribe(on_log_update)
+        bus.subscribe(event_bus.TOPIC_LOG, on_log_event)
+        attach_log_view(int(log_level_dropdown.value))
         refresh_prompts_dropdown()
+        bus.subscribe(event_bus.TOPIC_JOBS, refresh_matrix_progress)
         if state.file_picker is None:
             state.file_picker = ft.FilePicker()
 
     # Clean up on close
     def on_close():
-        logger_utils.unsubscribe(on_log_update)
+        logger_utils.unsubscribe(publish_log_lines)
 
     # --- Layout ---
     view = ft.Container(
@@ -328,16 +532,16 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
                         ]
                     ),
                     progress_bar,
-                    ft.Row([send_button, queue_button], spacing=10),
+                    ft.Row([send_button, queue_button, matrix_button], spacing=10),
+                    matrix_progress_row,
                     ft.Divider(),
-                    ft.Text(i18n.get("home_control_log_label"), size=14, weight=ft.FontWeight.BOLD),
+                    ft.Row([
+                        ft.Text(i18n.get("home_control_log_label"), size=14, weight=ft.FontWeight.BOLD),
+                        ft.Container(expand=True),
+                        log_level_dropdown,
+                    ]),
                     ft.Container(
-                        content=ft.Column(
-                            [log_output_text],
-                            scroll=ft.ScrollMode.AUTO,
-                            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                            expand=1
-                        ),
+                        content=log_output_list,
                         border=ft.border.all(1, ft.Colors.GREY_400),
                         border_radius=5,
                         padding=10,
@@ -362,4 +566,4 @@ def single_edit_tab(page: Page) -> Dict[str, Any]:
         expand=True,
     )
 
-    return {"view": view, "init": initialize}
+    return {"view": view, "init": initialize, "close": on_close}
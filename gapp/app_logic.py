@@ -1,54 +1,89 @@
-from typing import List, Any
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Dict, Optional
 import os
 import time
 import sys
 import threading
 import gradio as gr
 import shutil
-from google import genai
 from PIL import Image
 
 # 引入模块
-from geminiapi import api_client
+from geminiapi import api_client, key_pool
 from common import logger_utils, database as db, i18n
+from gapp import ui_stream
 # import platform # 移除未使用的导入
 # import subprocess # 移除未使用的导入
 
 from common.config import OUTPUT_DIR
 
-# --- 主生成任务状态 ---
-TASK_STATE = {
-    "status": "idle", "result_image": None, "result_path": None, 
-    "error_msg": None, "ui_updated": True
-}
-
-# --- 聊天任务状态 ---
-CHAT_TASK_STATE = {
-    "status": "idle", "response_parts": None, "updated_session": None,
-    "error_msg": None, "ui_updated": True
-}
-
-def reset_task_state():
-    TASK_STATE.update({
-        "status": "idle", "result_image": None, "result_path": None, 
-        "error_msg": None, "ui_updated": True
-    })
-
-def reset_chat_task_state():
-    CHAT_TASK_STATE.update({
-        "status": "idle", "response_parts": None, "updated_session": None,
-        "error_msg": None, "ui_updated": True
-    })
+# --- 会话任务状态 ---
+# 每个浏览器会话 (request.session_hash) 各有一份生成任务和聊天任务状态, 互不影响。
+# revision 在每次任务结束 (成功或失败) 时加一, 该会话的连接据此判断是否有新结果需要推送
+def _new_task_state() -> dict:
+    return {"status": "idle", "result_image": None, "result_path": None, "error_msg": None, "revision": 0}
+
+def _new_chat_task_state() -> dict:
+    return {"status": "idle", "response_parts": None, "updated_session": None, "error_msg": None, "revision": 0}
+
+# 最多保留的会话数; 页面关闭时 release_session 会立即移除对应会话
+MAX_SESSIONS = 256
+DEFAULT_SESSION = "default"
+
+_sessions: "OrderedDict[str, Dict[str, dict]]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+# 所有会话共用的任务线程池: 不同用户的任务可以同时运行, 总并发不超过 MAX_CONCURRENT_TASKS
+MAX_CONCURRENT_TASKS = 8
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS, thread_name_prefix="gapp-task")
+
+def session_id_of(request: Optional[gr.Request]) -> str:
+    return getattr(request, "session_hash", None) or DEFAULT_SESSION
+
+def session_tasks(session_id: str) -> Dict[str, dict]:
+    """获取 (必要时创建) 会话的任务状态: {"generation": {...}, "chat": {...}}"""
+    with _sessions_lock:
+        tasks = _sessions.get(session_id)
+        if tasks is None:
+            tasks = {"generation": _new_task_state(), "chat": _new_chat_task_state()}
+            _sessions[session_id] = tasks
+            while len(_sessions) > MAX_SESSIONS:
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(session_id)
+        return tasks
+
+def release_session(request: gr.Request):
+    """页面关闭时 (app.unload) 释放该会话的任务状态和结果图片"""
+    with _sessions_lock:
+        _sessions.pop(session_id_of(request), None)
+
+def reset_task_state(state: dict):
+    state.update({"status": "idle", "result_image": None, "result_path": None, "error_msg": None})
+
+def reset_chat_task_state(state: dict):
+    state.update({"status": "idle", "response_parts": None, "updated_session": None, "error_msg": None})
+
+def _finish(state: dict, **fields):
+    """记录任务结果并唤醒所有连接的流式事件"""
+    state.update(fields)
+    state["revision"] += 1
+    ui_stream.notifier.notify()
 
 # --- 主生成任务 ---
-def _background_worker(prompt, img_paths, key, model, ar, res):
+def _background_worker(session_id, state, prompt, img_paths, key, model, ar, res):
+    with logger_utils.bind(session=session_id):
+        _run_generation(state, prompt, img_paths, key, model, ar, res)
+
+def _run_generation(state, prompt, img_paths, key, model, ar, res):
     try:
-        TASK_STATE.update({"status": "running", "ui_updated": False})
         logger_utils.log(i18n.get("logic_log_newTask"))
         generated_image = api_client.call_google_genai(prompt, img_paths, key, model, ar, res)
         
         prefix = db.get_setting("file_prefix", "gemini_gen")
-        timestamp = int(time.time())
+        # 毫秒时间戳: 多个会话可能在同一秒内完成任务
+        timestamp = int(time.time() * 1000)
         filename = f"{prefix}_{timestamp}.png"
         temp_path = os.path.abspath(os.path.join(OUTPUT_DIR, filename))
         generated_image.save(temp_path, format="PNG")
@@ -64,44 +99,42 @@ def _background_worker(prompt, img_paths, key, model, ar, res):
             except (IOError, OSError) as e:
                 logger_utils.log(f"Failed to copy to permanent storage: {e}")
 
-        TASK_STATE.update({"result_image": generated_image, "result_path": temp_path, "status": "success"})
+        _finish(state, result_image=generated_image, result_path=temp_path, status="success")
     except Exception as e: # pylint: disable=broad-exception-caught
         error_msg = str(e)
         logger_utils.log(i18n.get("logic_log_saveFail", err=error_msg))
-        TASK_STATE.update({"error_msg": error_msg, "status": "error"})
+        _finish(state, error_msg=error_msg, status="error")
 
-def start_generation_task(prompt: str, img_paths: List[str], key: str, model: str, ar: str, res: str):
-    if TASK_STATE["status"] == "running":
+def start_generation_task(prompt: str, img_paths: List[str], key: str, model: str, ar: str, res: str,
+                          request: gr.Request):
+    session_id = session_id_of(request)
+    state = session_tasks(session_id)["generation"]
+    if state["status"] == "running":
         gr.Warning(i18n.get("logic_warn_taskRunning"))
         return
-    reset_task_state()
-    t = threading.Thread(target=_background_worker, args=(prompt, img_paths, key, model, ar, res))
-    t.start()
+    reset_task_state(state)
+    state["status"] = "running"
+    _executor.submit(_background_worker, session_id, state, prompt, img_paths, key, model, ar, res)
     gr.Info(i18n.get("logic_info_taskSubmitted"))
 
-def poll_task_status_callback():
-    if TASK_STATE["status"] == "running" or TASK_STATE["ui_updated"]:
-        return gr.skip(), gr.skip()
-
-    if TASK_STATE["status"] == "success":
-        TASK_STATE["ui_updated"] = True
+def _generation_outputs(state: dict):
+    """单图生成任务结束后, 结果图片和下载按钮的新值"""
+    if state["status"] == "success":
         new_btn = gr.DownloadButton(
-            label=i18n.get("logic_btn_downloadReady", filename=os.path.basename(TASK_STATE['result_path'])),
-            value=TASK_STATE["result_path"], interactive=True, visible=True
+            label=i18n.get("logic_btn_downloadReady", filename=os.path.basename(state['result_path'])),
+            value=state["result_path"], interactive=True, visible=True
         )
-        return TASK_STATE["result_image"], new_btn
-    elif TASK_STATE["status"] == "error":
-        TASK_STATE["ui_updated"] = True
-        gr.Warning(i18n.get("logic_warn_taskFailed", error_msg=TASK_STATE['error_msg']))
-        return None, gr.DownloadButton(label=i18n.get("home_preview_btn_download_placeholder"), interactive=False)
-    
-    return gr.skip(), gr.skip()
+        return state["result_image"], new_btn
+    gr.Warning(i18n.get("logic_warn_taskFailed", error_msg=state['error_msg']))
+    return None, gr.DownloadButton(label=i18n.get("home_preview_btn_download_placeholder"), interactive=False)
 
 # --- 聊天任务 ---
-def _chat_background_worker(genai_client, session_state, chat_input, model, ar, res):
+def _chat_background_worker(session_id, state, genai_client, session_state, chat_input, model, ar, res):
+    with logger_utils.bind(session=session_id):
+        _run_chat(state, genai_client, session_state, chat_input, model, ar, res)
+
+def _run_chat(state, genai_client, session_state, chat_input, model, ar, res):
     try:
-        CHAT_TASK_STATE.update({"status": "running", "ui_updated": False})
-        
         # 解包会话状态
         session_obj = session_state["session_obj"] if session_state else None
         session_id = session_state["id"] if session_state else f"chat_{int(time.time())}"
@@ -120,37 +153,80 @@ def _chat_background_worker(genai_client, session_state, chat_input, model, ar,
         # 重新打包会话状态字典
         new_session_state = {"id": session_id, "session_obj": updated_chat_obj}
 
-        CHAT_TASK_STATE.update({
-            "status": "success",
-            "response_parts": response_parts,
-            "updated_session": new_session_state
-        })
+        _finish(state, status="success", response_parts=response_parts,
+                updated_session=new_session_state)
     except Exception as e: # pylint: disable=broad-exception-caught
         error_msg = str(e)
         logger_utils.log(f"❌ Chat failed: {error_msg}")
-        CHAT_TASK_STATE.update({"status": "error", "error_msg": error_msg})
+        _finish(state, status="error", error_msg=error_msg)
 
-def start_chat_task(chat_input, genai_client, session_state, model, ar, res):
-    if CHAT_TASK_STATE["status"] == "running":
+def start_chat_task(chat_input, genai_client, session_state, model, ar, res, request: gr.Request):
+    session_id = session_id_of(request)
+    state = session_tasks(session_id)["chat"]
+    if state["status"] == "running":
         gr.Warning(i18n.get("logic_warn_taskRunning"))
         return
-    reset_chat_task_state()
-    t = threading.Thread(target=_chat_background_worker, args=(genai_client, session_state, chat_input, model, ar, res))
-    t.start()
-
-def poll_chat_task_status_callback():
-    if CHAT_TASK_STATE["status"] == "running" or CHAT_TASK_STATE["ui_updated"]:
-        return gr.skip(), gr.skip(), gr.skip(), gr.skip()
-
-    CHAT_TASK_STATE["ui_updated"] = True
-    if CHAT_TASK_STATE["status"] == "success":
-        return CHAT_TASK_STATE["response_parts"], CHAT_TASK_STATE["updated_session"], gr.update(interactive=True), gr.update(interactive=True)
-    elif CHAT_TASK_STATE["status"] == "error":
-        gr.Warning(i18n.get("logic_warn_taskFailed", error_msg=CHAT_TASK_STATE['error_msg']))
-        # 返回 None 以触发 handle_bot_response 中的错误处理
-        return None, None, gr.update(interactive=True), gr.update(interactive=True)
-    
-    return gr.skip(), gr.skip(), gr.skip(), gr.skip()
+    reset_chat_task_state(state)
+    state["status"] = "running"
+    _executor.submit(_chat_background_worker, session_id, state, genai_client, session_state, chat_input, model, ar, res)
+
+def _chat_outputs(state: dict):
+    """聊天任务结束后, 回复内容、会话状态以及重新启用的输入框和清空按钮"""
+    if state["status"] == "success":
+        return state["response_parts"], state["updated_session"], gr.update(interactive=True), gr.update(interactive=True)
+    gr.Warning(i18n.get("logic_warn_taskFailed", error_msg=state['error_msg']))
+    # 返回 None 以触发 handle_bot_response 中的错误处理
+    return None, None, gr.update(interactive=True), gr.update(interactive=True)
+
+def _visible_to(record: logger_utils.LogRecord, session_id: str) -> bool:
+    """未绑定会话的日志所有会话可见, 任务日志只有所属会话可见"""
+    return record.fields.get("session", session_id) == session_id
+
+def _session_log_lines(records: List[logger_utils.LogRecord], session_id: str) -> List[str]:
+    """records 中本会话可见的日志行, 最新的在前"""
+    return [record.text for record in reversed(records) if _visible_to(record, session_id)]
+
+async def stream_ui_updates(request: gr.Request):
+    """
+    每个浏览器连接一个的流式事件 (由 app.load 启动, 连接断开时被 Gradio 取消)。
+    只有本会话的任务结束或有新日志时才推送, 且只推送发生变化的组件, 其余输出为 gr.skip()。
+    输出顺序: 结果图片, 下载按钮, 聊天回复, 聊天会话, 聊天输入框, 清空按钮, 日志。
+    """
+    ui_stream.watch_logs()
+    session_id = session_id_of(request)
+    tasks = session_tasks(session_id)
+    gen_seen, chat_seen = tasks["generation"]["revision"], tasks["chat"]["revision"]
+    # 本连接已显示的日志行 (最新的在前), 之后只追加新日志, 不再重新读取整个缓存
+    records = logger_utils.get_logs_since(0)
+    log_seq = records[-1].seq if records else logger_utils.get_last_seq()
+    log_lines = deque(_session_log_lines(records, session_id), maxlen=logger_utils.MAX_LOG_LINES)
+    version = ui_stream.notifier.version
+    yield (gr.skip(),) * 6 + ("\n".join(log_lines),)
+
+    while True:
+        version = await ui_stream.notifier.wait(version)
+        generation, chat = tasks["generation"], tasks["chat"]
+        outputs = [gr.skip()] * 7
+        changed = False
+        if generation["revision"] != gen_seen and generation["status"] != "running":
+            gen_seen = generation["revision"]
+            outputs[0:2] = _generation_outputs(generation)
+            changed = True
+        if chat["revision"] != chat_seen and chat["status"] != "running":
+            chat_seen = chat["revision"]
+            outputs[2:6] = _chat_outputs(chat)
+            changed = True
+        # 只看本会话可见的新日志: 比较整段文本时, 缓存满后其他会话的日志挤掉旧的公共日志也会触发推送
+        records = logger_utils.get_logs_since(log_seq)
+        if records:
+            log_seq = records[-1].seq
+            new_lines = _session_log_lines(records, session_id)
+            if new_lines:
+                log_lines.extendleft(reversed(new_lines))
+                outputs[6] = "\n".join(log_lines)
+                changed = True
+        if changed:
+            yield tuple(outputs)
 
 # --- 通用函数 ---
 def restart_app():
@@ -160,25 +236,27 @@ def restart_app():
     os.execl(python, python, *sys.argv)
 
 def create_genai_client(api_key):
+    api_key = key_pool.pool.pick(api_key)
     if not api_key:
         return None
     try:
-        return genai.Client(api_key=api_key)
+        return api_client.new_client(api_key)
     except Exception as e: # pylint: disable=broad-exception-caught
         logger_utils.log(f"Failed to create GenAI Client: {e}")
         return None
 
-def init_app_data():
+def init_app_data(request: gr.Request):
     fresh_settings = db.get_all_settings()
     api_key = fresh_settings["api_key"]
     genai_client = create_genai_client(api_key)
     
     logger_utils.log(i18n.get("logic_log_resumingSession"))
     restored_image = None
-    if TASK_STATE["status"] == "success" and TASK_STATE["result_path"]:
+    state = session_tasks(session_id_of(request))["generation"]
+    if state["status"] == "success" and state["result_path"]:
         current_download_btn = gr.DownloadButton(
             label=i18n.get("logic_btn_downloadReady_noFilename"),
-            value=TASK_STATE["result_path"], interactive=True
+            value=state["result_path"], interactive=True
         )
     else:
         current_download_btn = gr.DownloadButton(label=i18n.get("home_preview_btn_download_placeholder"), interactive=False)
@@ -9,7 +9,8 @@ from tkinter import filedialog
 import gradio as gr
 
 from common import logger_utils, database as db, i18n
-from common.config import VALID_IMAGE_EXTENSIONS, UPLOAD_DIR
+from common.config import UPLOAD_DIR
+from common.image_util import list_images
 
 
 def open_folder_dialog() -> Optional[str]:
@@ -44,16 +45,8 @@ def load_images_from_dir(dir_path: str, recursive: bool) -> tuple[List[str], str
         return [], i18n.get("logic_error_dirNotFound", path=dir_path)
     db.save_setting("last_dir", dir_path)
     
-    image_files: List[str] = []
-    if recursive:
-        for root, _, files in os.walk(dir_path):
-            for f in files:
-                if os.path.splitext(f)[1].lower() in VALID_IMAGE_EXTENSIONS:
-                    image_files.append(os.path.join(root, f))
-    else:
-        image_files = [os.path.join(dir_path, f) for f in os.listdir(dir_path)
-                       if os.path.splitext(f)[1].lower() in VALID_IMAGE_EXTENSIONS]
-                       
+    image_files: List[str] = list_images(dir_path, recursive)
+
     msg: str = i18n.get("logic_log_loadDir", path=dir_path, count=len(image_files))
     logger_utils.log(msg)
     return image_files, msg
@@ -5,7 +5,7 @@ import subprocess
 import gradio as gr
 
 from common import logger_utils, database as db, i18n
-from common.config import VALID_IMAGE_EXTENSIONS
+from common.image_util import list_images_by_mtime
 
 
 # --- History Page Logic ---
@@ -14,10 +14,7 @@ def load_output_gallery():
     save_dir = db.get_setting("save_path")
     if not save_dir or not os.path.exists(save_dir):
         return []
-    files = [os.path.join(save_dir, f) for f in os.listdir(save_dir)
-             if os.path.splitext(f)[1].lower() in VALID_IMAGE_EXTENSIONS]
-    files.sort(key=os.path.getmtime, reverse=True)
-    return files
+    return list_images_by_mtime(save_dir)
 
 def open_output_folder():
     path = db.get_setting("save_path", "outputs")
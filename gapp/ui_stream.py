@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from typing import List, Optional, Set, Tuple
+
+from common import logger_utils
+
+
+class ChangeNotifier:
+    """
+    跨线程的变更通知: 后台线程调用 notify(), 每个浏览器连接的流式事件在 wait() 中等待。
+    等待方挂起在各自事件循环的 asyncio.Event 上, 不占用线程, 也不会被定时唤醒,
+    因此打开的标签页再多, 没有变化时也没有任何开销。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def notify(self):
+        """版本号加一并唤醒所有等待方 (线程安全)"""
+        with self._lock:
+            self._version += 1
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭, 对应的连接已经断开
+
+    async def wait(self, seen: int, timeout: Optional[float] = None) -> int:
+        """等待版本号不再等于 seen (或超时), 返回当前版本号"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if self._version != seen:
+                return self._version
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        return self._version
+
+
+# 全局单例: 任务状态变化和新日志都通过它唤醒各连接
+notifier = ChangeNotifier()
+
+
+def _on_log_lines(_new_lines: List[str], _reset: bool):
+    notifier.notify()
+
+
+def watch_logs():
+    """让新日志也唤醒等待方; logger_utils 会把 0.2 秒内的多条日志合并为一次通知。可重复调用。"""
+    logger_utils.subscribe(_on_log_lines, interval=0.2)
@@ -1,4 +1,9 @@
+import contextvars
+import mimetypes
+import os
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait, FIRST_COMPLETED
 from io import BytesIO
 from typing import List, Any, Optional, Dict
 
@@ -8,8 +13,9 @@ from google.genai import types
 from google.genai.chats import Chat
 from google.genai.types import PIL_Image
 
-from common import logger_utils, i18n
+from common import logger_utils, i18n, tracing, metrics, token_ledger, image_util
 from common.config import MODEL_SELECTOR_DEFAULT
+from geminiapi import key_pool, retry_policy, circuit_breaker, hedging
 
 # [新增] 模型配置字典，方便未來擴展
 MODEL_CONFIGS = {
@@ -74,6 +80,183 @@ def _process_response_parts(response_parts: List[Any]) -> Optional['PIL_Image']:
     raise ValueError(i18n.get("api_error_noValidImage"))
 
 
+def _estimate_payload_bytes(parts: List[Any]) -> int:
+    """粗略估算请求体大小: 文本按 UTF-8, 图片优先使用源文件大小"""
+    total = 0
+    for part in parts:
+        if isinstance(part, str):
+            total += len(part.encode("utf-8"))
+        elif isinstance(part, Image.Image):
+            filename = getattr(part, "filename", None)
+            if filename and os.path.exists(filename):
+                total += os.path.getsize(filename)
+            else:
+                total += part.width * part.height * len(part.getbands())
+    return total
+
+
+# 开发和压测时可以将 SDK 指向本地的模拟服务 (devtools/fake_gemini_server.py)
+BASE_URL_ENV = "GEMINI_BASE_URL"
+_base_url: Optional[str] = os.environ.get(BASE_URL_ENV) or None
+
+# 每个 API Key 复用一个 Client (及其连接池), 而不是每次请求都新建
+_clients: Dict[str, genai.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def set_base_url(base_url: Optional[str]):
+    """修改 API 地址 (None 为官方地址), 已缓存的 Client 会被丢弃"""
+    global _base_url  # pylint: disable=global-statement
+    with _clients_lock:
+        _base_url = base_url or None
+        _clients.clear()
+
+
+def new_client(api_key: str) -> genai.Client:
+    """创建一个新的 Client, 使用当前的 API 地址"""
+    if _base_url:
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=_base_url))
+    return genai.Client(api_key=api_key)
+
+
+def get_client(api_key: str) -> genai.Client:
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = new_client(api_key)
+        return client
+
+
+def _client_api_key(genai_client: genai.Client) -> Optional[str]:
+    """取出 Client 使用的 API Key, 仅用于计算账本中的 Key 指纹"""
+    api_client = getattr(genai_client, "_api_client", None)  # pylint: disable=protected-access
+    return getattr(api_client, "api_key", None)
+
+
+def _record_response_metrics(response: Any, model_id: str, kind: str):
+    """记录 token 用量和下载的图片字节数"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        for token_type, attr in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                                 ("total", "total_token_count")):
+            metrics.TOKENS_TOTAL.inc(getattr(usage, attr, None) or 0, model=model_id, type=token_type)
+    downloaded = sum(len(part.inline_data.data) for part in (response.parts or [])
+                     if part.inline_data and part.inline_data.data)
+    metrics.BYTES_DOWNLOADED.inc(downloaded, model=model_id, kind=kind)
+
+
+# 对冲请求使用的线程池 (只用于对冲请求); 输掉的请求无法取消, 会在后台跑完
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gemini-hedge")
+
+
+def _start_thread(func, *args) -> Future:
+    """
+    在单独的线程中执行原请求 (带当前 contextvars)。不经过线程池: 池中排队的时间会被算进 p90 等待,
+    引发不必要的对冲。调用方本身就在等待这个请求, 所以线程数不会超过正在进行的请求数。
+    """
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(func, *args))
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="gemini-request", daemon=True).start()
+    return future
+
+
+def _generate_content(attempt_key: str, api_key: str, model_id: str, contents: List[Any],
+                      config: types.GenerateContentConfig, prompt: Optional[str]) -> tuple[Any, str, bool]:
+    """
+    发送 generate_content 请求, 返回 (响应, 实际使用的 Key, 原请求是否仍在进行)。
+    启用对冲时 (见 geminiapi.hedging), 超过该模型 p90 耗时仍未返回则用 Key 池中的另一个 Key 再发送一次,
+    先成功的响应生效; 另一个请求在后台完成后仍会计入 token 账本。
+    对冲请求胜出时原请求仍在进行: 它的 Key 由完成回调按真实结果归还, 调用方不再归还 (第三项为 True)。
+    """
+    def send(key: str):
+        return get_client(key).models.generate_content(model=model_id, contents=contents, config=config)
+
+    delay = hedging.policy.delay_for(model_id)
+    if delay is None:
+        return send(attempt_key), attempt_key, False
+
+    primary = _start_thread(send, attempt_key)
+    try:
+        return primary.result(timeout=delay), attempt_key, False
+    except FutureTimeout:
+        pass
+    if not hedging.policy.try_hedge():
+        return primary.result(), attempt_key, False
+    hedge_key = key_pool.pool.acquire(api_key, max_wait=0)
+    if hedge_key is None:
+        return primary.result(), attempt_key, False
+
+    logger_utils.info(f"Request is slower than p90 ({delay:.1f}s), sending a hedged request.", model=model_id)
+    metrics.HEDGES_TOTAL.inc(model=model_id, outcome="sent")
+    hedge = _hedge_executor.submit(contextvars.copy_context().run, send, hedge_key)
+    keys = {primary: attempt_key, hedge: hedge_key}
+
+    def release_key(key: str):
+        def callback(future):
+            error = future.exception()
+            key_pool.pool.release(key, retry_policy.status_code_of(error) if error else None,
+                                  retry_policy.retry_after_of(error) if error else None)
+        return callback
+    hedge.add_done_callback(release_key(hedge_key))
+
+    job_id = logger_utils.current_fields().get("job_id")
+
+    def record_loser(future):
+        # 输掉的请求同样消耗了配额, 完成后计入账本
+        if future.exception() is None:
+            token_ledger.record(model_id, getattr(future.result(), "usage_metadata", None), "image",
+                                keys[future], prompt, job_id)
+
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                continue
+            primary_pending = primary in pending
+            if future is hedge:
+                metrics.HEDGES_TOTAL.inc(model=model_id, outcome="won")
+            if primary_pending:
+                # 原请求的 Key 在它真正结束时按其结果 (例如 429) 归还
+                primary.add_done_callback(release_key(attempt_key))
+            for loser in pending:
+                loser.add_done_callback(record_loser)
+            return future.result(), keys[future], primary_pending
+    # 两个请求都失败了, 以原请求的错误为准 (原请求的 Key 由调用方按此错误归还)
+    raise primary.exception()
+
+
+def _circuit_outcome(error_class: str) -> Optional[bool]:
+    """异常对断路器的意义: 5xx / 网络错误算失败, 内容拦截等说明服务端正常, 429 和认证错误与服务端健康无关"""
+    if error_class == retry_policy.RETRYABLE:
+        return False
+    if error_class == retry_policy.TERMINAL:
+        return True
+    return None
+
+
+def _backoff(policy: retry_policy.RetryPolicy, budget: retry_policy.RetryBudget, attempt: int,
+             retry_after: Optional[float], model_id: str) -> bool:
+    """按重试策略等待; 服务器要求的等待过长或任务的重试预算用尽时返回 False"""
+    delay = policy.backoff(attempt, retry_after)
+    if delay is None or not budget.spend(delay):
+        logger_utils.warning(i18n.get("api_log_retryBudgetExhausted", "Retry budget exhausted, giving up."),
+                             model=model_id, attempt=attempt + 1)
+        return False
+    with tracing.span(tracing.SPAN_BACKOFF, attempt=attempt + 1):
+        time.sleep(delay)
+    return True
+
+
 def call_google_genai(
         prompt: Optional[str],
         image_paths: List[str],
@@ -82,181 +265,323 @@ def call_google_genai(
         aspect_ratio: str,
         resolution: str
 ) -> Image.Image | None:
-    if not api_key:
+    if not key_pool.pool.pick(api_key):
         msg = i18n.get("api_error_apiKey")
-        logger_utils.log(msg)
+        logger_utils.error(msg)
         return None
 
     if not model_id:
         model_id = MODEL_SELECTOR_DEFAULT
 
-    client = genai.Client(api_key=api_key)
-    contents: List[Any] = []
-    if prompt:
-        contents.append(prompt)
-        
-    if image_paths:
-        logger_utils.log(i18n.get("api_log_loadingImgs", count=len(image_paths)))
-        for path in image_paths:
-            try:
-                img = Image.open(path)
-                contents.append(img)
-            except (IOError, OSError) as e:
-                logger_utils.log(i18n.get("api_log_skipImg", path=path, err=e))
-
-    ar_log_val = i18n.get(aspect_ratio, aspect_ratio)
-    prompt_len = len(prompt) if prompt else 0
-    logger_utils.log(i18n.get("api_log_requestInfo", prompt_len=prompt_len, img_count=len(image_paths)))
-    logger_utils.log(i18n.get("api_log_requestSent", model=model_id, ar=ar_log_val, res=resolution))
-
-    config = _get_model_config(model_id, aspect_ratio, resolution)
-
-    max_retries = 3
+    with tracing.span(tracing.SPAN_PREPROCESS):
+        contents: List[Any] = []
+        if prompt:
+            contents.append(prompt)
+
+        if image_paths:
+            logger_utils.log(i18n.get("api_log_loadingImgs", count=len(image_paths)))
+            for path in image_paths:
+                try:
+                    img = Image.open(path)
+                    contents.append(img)
+                except (IOError, OSError) as e:
+                    logger_utils.warning(i18n.get("api_log_skipImg", path=path, err=e))
+
+        ar_log_val = i18n.get(aspect_ratio, aspect_ratio)
+        prompt_len = len(prompt) if prompt else 0
+        logger_utils.log(i18n.get("api_log_requestInfo", prompt_len=prompt_len, img_count=len(image_paths)))
+        logger_utils.log(i18n.get("api_log_requestSent", model=model_id, ar=ar_log_val, res=resolution),
+                         model=model_id)
+
+        config = _get_model_config(model_id, aspect_ratio, resolution)
+        payload_bytes = _estimate_payload_bytes(contents)
+
+    policy = retry_policy.DEFAULT_POLICY
+    max_retries = policy.max_attempts
+    budget = retry_policy.budget_for_current_job()
     last_exception: Optional[Exception] = None
 
+    breaker = circuit_breaker.breakers.get(model_id)
+
     for attempt in range(max_retries):
+        if not breaker.allow():
+            last_exception = circuit_breaker.CircuitOpenError(model_id, breaker.retry_in())
+            break
+        # 每次尝试都从 Key 池中选择当前最空闲的 Key
+        attempt_key = key_pool.pool.acquire(api_key)
+        if attempt_key is None:
+            breaker.record(None)
+            last_exception = RuntimeError(i18n.get("api_error_noUsableKey", "All API keys were rejected."))
+            break
+        status_code: Optional[int] = None
+        retry_after: Optional[float] = None
+        circuit_ok: Optional[bool] = None
+        key_handed_off = False
         try:
             if attempt > 0:
-                logger_utils.log(i18n.get("api_log_networkRetry", attempt=attempt + 1, max_retries=max_retries))
-
-            response = client.models.generate_content(
-                model=model_id,
-                contents=contents,
-                config=config
-            )
-
-            if hasattr(response, "usage_metadata") and response.usage_metadata:
-                u = response.usage_metadata
-                logger_utils.log(i18n.get("api_log_tokenUsage", input=getattr(u, "prompt_token_count", 0),
-                                          output=getattr(u, "candidates_token_count", 0),
-                                          total=getattr(u, "total_token_count", 0)))
-
-            """
-            GenerateContentResponse(
-              automatic_function_calling_history=[],
-              candidates=[
-                Candidate(
-                  content=Content(),
-                  finish_reason=<FinishReason.PROHIBITED_CONTENT: 'PROHIBITED_CONTENT'>,
-                  index=0
-                ),
-              ],
-            """
-
-            if not response.parts:
-                if response.candidates and response.candidates[0]:
-                    first_candidate = response.candidates[0]
-                    finish_reason = first_candidate.finish_reason.value
-                    logger_utils.log(i18n.get("api_log_gemini_api_error", reason=finish_reason))
-                    raise ValueError(f"Request was blocked due to: {finish_reason}")
-                if response.prompt_feedback and response.prompt_feedback.block_reason:
-                    reason = response.prompt_feedback.block_reason.name
-                    logger_utils.log(i18n.get("api_log_gemini_api_error", reason=reason))
-                    raise ValueError(f"Request was blocked due to: {reason}")
-                raise ValueError(i18n.get("api_error_noParts"))
-
-            return _process_response_parts(response.parts)
+                logger_utils.warning(i18n.get("api_log_networkRetry", attempt=attempt + 1, max_retries=max_retries),
+                                     model=model_id, attempt=attempt + 1)
+                metrics.RETRIES_TOTAL.inc(model=model_id, kind="image")
+
+            metrics.BYTES_UPLOADED.inc(payload_bytes, model=model_id, kind="image")
+            request_start = time.perf_counter()
+            with tracing.span(tracing.SPAN_REQUEST, attempt=attempt + 1):
+                response, response_key, key_handed_off = _generate_content(attempt_key, api_key, model_id,
+                                                                           contents, config, prompt)
+            circuit_ok = True
+            request_seconds = time.perf_counter() - request_start
+            duration_ms = round(request_seconds * 1000)
+            metrics.REQUEST_LATENCY.observe(request_seconds, model=model_id, kind="image")
+
+            with tracing.span(tracing.SPAN_DECODE):
+                _record_response_metrics(response, model_id, "image")
+                token_ledger.record(model_id, getattr(response, "usage_metadata", None), "image", response_key,
+                                    prompt)
+                if hasattr(response, "usage_metadata") and response.usage_metadata:
+                    u = response.usage_metadata
+                    logger_utils.log(i18n.get("api_log_tokenUsage", input=getattr(u, "prompt_token_count", 0),
+                                              output=getattr(u, "candidates_token_count", 0),
+                                              total=getattr(u, "total_token_count", 0)),
+                                     model=model_id, duration_ms=duration_ms)
+
+                """
+                GenerateContentResponse(
+                  automatic_function_calling_history=[],
+                  candidates=[
+                    Candidate(
+                      content=Content(),
+                      finish_reason=<FinishReason.PROHIBITED_CONTENT: 'PROHIBITED_CONTENT'>,
+                      index=0
+                    ),
+                  ],
+                """
+
+                if not response.parts:
+                    if response.candidates and response.candidates[0]:
+                        first_candidate = response.candidates[0]
+                        finish_reason = first_candidate.finish_reason.value
+                        logger_utils.error(i18n.get("api_log_gemini_api_error", reason=finish_reason),
+                                           model=model_id)
+                        raise ValueError(f"Request was blocked due to: {finish_reason}")
+                    if response.prompt_feedback and response.prompt_feedback.block_reason:
+                        reason = response.prompt_feedback.block_reason.name
+                        logger_utils.error(i18n.get("api_log_gemini_api_error", reason=reason), model=model_id)
+                        raise ValueError(f"Request was blocked due to: {reason}")
+                    raise ValueError(i18n.get("api_error_noParts"))
+
+                return _process_response_parts(response.parts)
 
         except Exception as e:  # pylint: disable=broad-exception-caught
             last_exception = e
-            if "401" in str(e) or "403" in str(e):
+            status_code = retry_policy.status_code_of(e)
+            retry_after = retry_policy.retry_after_of(e)
+            error_class = retry_policy.classify(e)
+            metrics.API_ERRORS_TOTAL.inc(model=model_id, kind="image", status=metrics.status_class(status_code))
+            if circuit_ok is None:
+                circuit_ok = _circuit_outcome(error_class)
+            if error_class == retry_policy.TERMINAL:
+                break
+            if error_class in (retry_policy.AUTH, retry_policy.RATE_LIMITED) \
+                    and key_pool.pool.has_alternative(attempt_key):
+                # 换一个 Key 立即重试, 不需要退避
+                continue
+            if error_class == retry_policy.AUTH or attempt + 1 >= max_retries:
+                break
+            if not _backoff(policy, budget, attempt, retry_after, model_id):
                 break
-            time.sleep(2 * (attempt + 1))
             continue
+        finally:
+            if not key_handed_off:
+                key_pool.pool.release(attempt_key, status_code, retry_after)
+            breaker.record(circuit_ok)
 
     sys_err_msg = i18n.get("api_error_system", err=str(last_exception))
-    logger_utils.log(sys_err_msg)
+    logger_utils.error(sys_err_msg, model=model_id)
     return None
 
 
+def _history_contents(history: List[Any]) -> List[types.Content]:
+    """
+    将 chat_store.ContextPolicy 生成的历史 [(role, parts, signatures), ...] 转换为 SDK 的 Content。
+    图片引用在这里才读取文件; 模型回复中的 thought signature 原样附带。
+    """
+    contents = []
+    for role, parts, signatures in history:
+        content_parts = []
+        for part, signature in zip(parts, signatures):
+            if isinstance(part, image_util.ImageRef):
+                try:
+                    with open(part.path, "rb") as f:
+                        data = f.read()
+                except OSError as e:
+                    logger_utils.warning(i18n.get("api_log_skipImg", path=part.path, err=e))
+                    continue
+                mime_type = mimetypes.guess_type(part.path)[0] or "image/png"
+                content_parts.append(types.Part(inline_data=types.Blob(data=data, mime_type=mime_type),
+                                                thought_signature=signature))
+            else:
+                content_parts.append(types.Part(text=str(part), thought_signature=signature))
+        if content_parts:
+            contents.append(types.Content(role=role, parts=content_parts))
+    return contents
+
+
+def _response_parts(parts: List[types.Part]) -> List[tuple[Any, Optional[bytes]]]:
+    """回复中可显示的部分 (文本或 PIL 图片) 及其 thought signature"""
+    result = []
+    for part in parts or []:
+        if part.text is not None:
+            result.append((part.text, part.thought_signature))
+        elif image := part.as_image():
+            result.append((image, part.thought_signature))
+    return result
+
+
+def last_response_signatures(chat_session: Chat) -> List[Optional[bytes]]:
+    """
+    最近一次回复各部分的 thought signature, 与 call_google_chat 返回的 response_parts 一一对应。
+    保存对话记录时一并保存, 之后重建上下文时发回给模型。
+    """
+    history = chat_session.get_history(curated=True)
+    if not history or history[-1].role != "model":
+        return []
+    return [signature for _, signature in _response_parts(history[-1].parts)]
+
+
 def call_google_chat(
         genai_client: genai.Client,
         chat_session: Optional[Chat],
         prompt_parts: List[Any],
         model_id: str,
         aspect_ratio: str,
-        resolution: str
+        resolution: str,
+        history: Optional[List[Any]] = None,
+        system_instruction: Optional[str] = None
 ) -> Optional[tuple[Chat, List[Any]]]:
+    """
+    发送一条聊天消息。chat_session 为 None 时新建会话: history (见 chat_store.ContextPolicy) 作为已有的对话,
+    system_instruction 例如较早消息的摘要 (随本条消息的 config 一起发送)。
+    """
     if genai_client is None:
         msg = i18n.get("api_error_apiKey")
-        logger_utils.log(msg)
+        logger_utils.error(msg)
         return None
 
     if not model_id:
         model_id = "gemini-1.5-pro-image-preview"
 
-    if chat_session is None:
-        logger_utils.log("✨ Creating new chat session.")
-        chat_session = genai_client.chats.create(
-            model=model_id,
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-            )
+    with tracing.span(tracing.SPAN_PREPROCESS):
+        # 任务中保存的是图片引用 (ImageRef), 执行时才打开文件
+        prompt_parts = image_util.resolve_parts(prompt_parts)
+
+        image_config_dict: Dict[str, Any] = {}
+        is_flash_model = "2.5" in model_id or "flash" in model_id
+
+        if not is_flash_model:
+            if aspect_ratio and aspect_ratio != "ar_none":
+                image_config_dict["aspect_ratio"] = aspect_ratio
+            if resolution:
+                image_config_dict["image_size"] = resolution
+        else:
+            logger_utils.log(i18n.get("api_log_gemini25"))
+
+        # send_message 传入 config 时会完全替代会话创建时的 config, 因此每条消息的 config 必须带上全部设置
+        gen_config = types.GenerateContentConfig(
+            response_modalities=['TEXT', 'IMAGE'],
+            system_instruction=system_instruction or None,
+            image_config=types.ImageConfig(**image_config_dict) if image_config_dict else None
         )
+        if chat_session is None:
+            logger_utils.log("✨ Creating new chat session.", model=model_id)
+            chat_session = genai_client.chats.create(
+                model=model_id,
+                config=gen_config,
+                history=_history_contents(history) if history else None
+            )
 
-    image_config_dict: Dict[str, Any] = {}
-    is_flash_model = "2.5" in model_id or "flash" in model_id
-
-    if not is_flash_model:
-        if aspect_ratio and aspect_ratio != "ar_none":
-            image_config_dict["aspect_ratio"] = aspect_ratio
-        if resolution:
-            image_config_dict["image_size"] = resolution
-    else:
-        logger_utils.log(i18n.get("api_log_gemini25"))
-
-    gen_config = types.GenerateContentConfig(
-        image_config=types.ImageConfig(**image_config_dict) if image_config_dict else None
-    )
-
-    ar_log_val = i18n.get(aspect_ratio, aspect_ratio)
-    logger_utils.log(f"💬 Sending message to chat | Model: {model_id} | AR: {ar_log_val} | Res: {resolution}")
+        ar_log_val = i18n.get(aspect_ratio, aspect_ratio)
+        logger_utils.log(f"💬 Sending message to chat | Model: {model_id} | AR: {ar_log_val} | Res: {resolution}",
+                         model=model_id)
+        payload_bytes = _estimate_payload_bytes(prompt_parts)
 
-    max_retries = 3
+    policy = retry_policy.DEFAULT_POLICY
+    max_retries = policy.max_attempts
+    budget = retry_policy.budget_for_current_job()
     last_exception: Optional[Exception] = None
+    # 聊天会话绑定在创建它的 Client 上, 无法换 Key, 只在 Key 池中记录并发和错误
+    session_key = _client_api_key(genai_client)
+    breaker = circuit_breaker.breakers.get(model_id)
 
     for attempt in range(max_retries):
+        if not breaker.allow():
+            last_exception = circuit_breaker.CircuitOpenError(model_id, breaker.retry_in())
+            break
+        if session_key:
+            key_pool.pool.track(session_key)
+        status_code: Optional[int] = None
+        retry_after: Optional[float] = None
+        circuit_ok: Optional[bool] = None
         try:
             if attempt > 0:
-                logger_utils.log(i18n.get("api_log_networkRetry", attempt=attempt + 1, max_retries=max_retries))
-
-            response = chat_session.send_message(
-                prompt_parts,
-                config=gen_config
-            )
-
-            if hasattr(response, "usage_metadata") and response.usage_metadata:
-                u = response.usage_metadata
-                logger_utils.log(i18n.get("api_log_tokenUsage", input=u.prompt_token_count,
-                                          output=u.candidates_token_count,
-                                          total=u.total_token_count))
-
-            if not response.parts:
-                if response.prompt_feedback and response.prompt_feedback.block_reason:
-                    reason = response.prompt_feedback.block_reason.name
-                    raise ValueError(f"Request was blocked due to: {reason}")
-                raise ValueError(i18n.get("api_error_noParts"))
-
-            response_parts_list: List[Any] = []
-            for part in response.parts:
-                if part.text is not None:
-                    response_parts_list.append(part.text)
-                elif image := part.as_image():
-                    response_parts_list.append(image)
-
-            if not response_parts_list:
-                raise ValueError(i18n.get("api_error_noValidImage"))
-
-            logger_utils.log(f"✅ Received {len(response_parts_list)} parts from chat.")
-            return chat_session, response_parts_list
+                logger_utils.warning(i18n.get("api_log_networkRetry", attempt=attempt + 1, max_retries=max_retries),
+                                     model=model_id, attempt=attempt + 1)
+                metrics.RETRIES_TOTAL.inc(model=model_id, kind="chat")
+
+            metrics.BYTES_UPLOADED.inc(payload_bytes, model=model_id, kind="chat")
+            request_start = time.perf_counter()
+            with tracing.span(tracing.SPAN_REQUEST, attempt=attempt + 1):
+                response = chat_session.send_message(
+                    prompt_parts,
+                    config=gen_config
+                )
+            circuit_ok = True
+            request_seconds = time.perf_counter() - request_start
+            duration_ms = round(request_seconds * 1000)
+            metrics.REQUEST_LATENCY.observe(request_seconds, model=model_id, kind="chat")
+
+            with tracing.span(tracing.SPAN_DECODE):
+                _record_response_metrics(response, model_id, "chat")
+                token_ledger.record(model_id, getattr(response, "usage_metadata", None), "chat", session_key,
+                                    next((p for p in prompt_parts if isinstance(p, str)), None))
+                if hasattr(response, "usage_metadata") and response.usage_metadata:
+                    u = response.usage_metadata
+                    logger_utils.log(i18n.get("api_log_tokenUsage", input=u.prompt_token_count,
+                                              output=u.candidates_token_count,
+                                              total=u.total_token_count),
+                                     model=model_id, duration_ms=duration_ms)
+
+                if not response.parts:
+                    if response.prompt_feedback and response.prompt_feedback.block_reason:
+                        reason = response.prompt_feedback.block_reason.name
+                        raise ValueError(f"Request was blocked due to: {reason}")
+                    raise ValueError(i18n.get("api_error_noParts"))
+
+                response_parts_list: List[Any] = [value for value, _ in _response_parts(response.parts)]
+
+                if not response_parts_list:
+                    raise ValueError(i18n.get("api_error_noValidImage"))
+
+                logger_utils.log(f"✅ Received {len(response_parts_list)} parts from chat.", model=model_id)
+                return chat_session, response_parts_list
 
         except Exception as e:  # pylint: disable=broad-exception-caught
             last_exception = e
-            if "401" in str(e) or "403" in str(e) or "client has been closed" in str(e):
+            status_code = retry_policy.status_code_of(e)
+            retry_after = retry_policy.retry_after_of(e)
+            error_class = retry_policy.classify(e)
+            metrics.API_ERRORS_TOTAL.inc(model=model_id, kind="chat", status=metrics.status_class(status_code))
+            if circuit_ok is None:
+                circuit_ok = _circuit_outcome(error_class)
+            if error_class in (retry_policy.TERMINAL, retry_policy.AUTH) or attempt + 1 >= max_retries:
+                break
+            if not _backoff(policy, budget, attempt, retry_after, model_id):
                 break
-            time.sleep(2 * (attempt + 1))
             continue
+        finally:
+            if session_key:
+                key_pool.pool.release(session_key, status_code, retry_after)
+            breaker.record(circuit_ok)
 
     sys_err_msg = i18n.get("api_error_system", err=str(last_exception))
-    logger_utils.log(sys_err_msg)
+    logger_utils.error(sys_err_msg, model=model_id)
     return None
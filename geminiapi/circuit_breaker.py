@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Any
+
+from common import logger_utils, metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """断路器打开时拒绝的请求"""
+
+    def __init__(self, model_id: str, retry_in: float):
+        super().__init__(f"Circuit for {model_id} is open, retry in {retry_in:.0f}s.")
+        self.model_id = model_id
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    单个模型的断路器:
+    - CLOSED: 正常请求, 记录最近 window_seconds 秒内的结果
+    - 最近的请求数不少于 min_calls 且失败率达到 failure_rate 时转为 OPEN, 拒绝所有请求
+    - OPEN 持续 open_seconds 后转为 HALF_OPEN, 只放行一个试探请求:
+      成功则恢复 CLOSED, 失败则重新 OPEN 且等待时间翻倍 (不超过 max_open_seconds)
+    只有 5xx / 网络错误算作失败; 429、认证错误和内容拦截与服务端是否故障无关, 见 api_client。
+    """
+
+    def __init__(self, name: str, window_seconds: float = 60.0, min_calls: int = 5, failure_rate: float = 0.5,
+                 open_seconds: float = 30.0, max_open_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._state = CLOSED
+        self._open_seconds = open_seconds
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _trim(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def _current_state(self, now: float) -> str:
+        """调用时需持有锁"""
+        if self._state == OPEN and now - self._opened_at >= self._open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+            logger_utils.info(f"Circuit for {self.name} is half-open, sending a trial request.", model=self.name)
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def retry_in(self) -> float:
+        """距离下一次允许请求的秒数, 0 表示现在就可以请求"""
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == OPEN:
+                return max(0.0, self._opened_at + self._open_seconds - now)
+            if state == HALF_OPEN and self._probe_in_flight:
+                # 等待试探请求的结果
+                return 1.0
+            return 0.0
+
+    def allow(self) -> bool:
+        """是否放行一次请求; HALF_OPEN 状态下放行的请求即为试探请求, 必须随后调用 record()"""
+        with self._lock:
+            state = self._current_state(self._clock())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: Optional[bool]):
+        """记录一次请求的结果; None 表示结果与服务端健康无关 (只释放试探名额)"""
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._probe_in_flight = False
+                if success is True:
+                    self._close()
+                elif success is False:
+                    self._open(now, self._open_seconds * 2)
+                return
+            if success is None or state == OPEN:
+                return
+            self._outcomes.append((now, success))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now, self.base_open_seconds)
+
+    def _open(self, now: float, open_seconds: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._open_seconds = min(open_seconds, self.max_open_seconds)
+        self._outcomes.clear()
+        metrics.CIRCUIT_OPENED_TOTAL.inc(model=self.name)
+        logger_utils.warning(f"Circuit for {self.name} opened after repeated failures, "
+                             f"pausing requests for {self._open_seconds:.0f}s.", model=self.name)
+
+    def _close(self):
+        self._state = CLOSED
+        self._open_seconds = self.base_open_seconds
+        self._outcomes.clear()
+        logger_utils.info(f"Circuit for {self.name} closed, requests resume.", model=self.name)
+
+
+class BreakerRegistry:
+    """按模型 ID 管理断路器"""
+
+    def __init__(self, **breaker_options):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._options = breaker_options
+
+    def get(self, model_id: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model_id)
+            if breaker is None:
+                breaker = self._breakers[model_id] = CircuitBreaker(model_id, **self._options)
+            return breaker
+
+    def retry_in(self, model_id: Optional[str]) -> float:
+        """模型的断路器打开时返回剩余等待秒数, 否则为 0 (不会创建新的断路器)"""
+        if not model_id:
+            return 0.0
+        with self._lock:
+            breaker = self._breakers.get(model_id)
+        return breaker.retry_in() if breaker else 0.0
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [{"model": b.name, "state": b.state, "retry_in": b.retry_in()} for b in breakers]
+
+    def reset(self):
+        with self._lock:
+            self._breakers.clear()
+
+
+# Global instance
+breakers = BreakerRegistry()
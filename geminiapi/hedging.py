@@ -0,0 +1,73 @@
+import threading
+from typing import Optional
+
+from common import database as db, metrics
+
+# 每个模型至少积累这么多次请求耗时后才会启用对冲, 否则 p90 不可靠
+MIN_SAMPLES = 20
+# 对冲请求的最短等待时间 (秒), 避免在耗时很短的模型上频繁对冲
+MIN_DELAY = 5.0
+DEFAULT_MAX_PERCENT = 10.0
+
+
+class HedgePolicy:
+    """
+    请求对冲 (hedged requests): 请求超过该模型历史耗时的 p90 仍未返回时, 用另一个 Key 再发送一次,
+    先返回的结果生效。对冲请求同样消耗配额, 因此数量不超过总请求数的 max_percent%。
+
+    耗时分布取自每次请求记录的 metrics.REQUEST_LATENCY (与任务耗时分解中的 request 阶段相同)。
+    设置: hedge_requests ("1" 启用) 和 hedge_max_percent。
+    """
+
+    def __init__(self, percentile: float = 0.9, min_samples: int = MIN_SAMPLES, min_delay: float = MIN_DELAY):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.enabled = False
+        self.max_percent = DEFAULT_MAX_PERCENT
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._requests = 0
+        self._hedges = 0
+
+    def configure(self, enabled: bool, max_percent: float = DEFAULT_MAX_PERCENT):
+        with self._lock:
+            self.enabled = enabled
+            self.max_percent = max(0.0, max_percent)
+            self._loaded = True
+
+    def reload(self):
+        """从设置重新加载是否启用及对冲比例上限"""
+        try:
+            max_percent = float(db.get_setting("hedge_max_percent", "") or DEFAULT_MAX_PERCENT)
+        except ValueError:
+            max_percent = DEFAULT_MAX_PERCENT
+        self.configure(bool(db.get_setting("hedge_requests", "")), max_percent)
+
+    def delay_for(self, model_id: str, kind: str = "image") -> Optional[float]:
+        """
+        发送对冲请求前应等待的秒数; 未启用或该模型的历史耗时样本不足时返回 None。
+        每次调用都计入一次请求, 作为对冲比例的分母。
+        """
+        if not self._loaded:
+            self.reload()
+        with self._lock:
+            self._requests += 1
+            if not self.enabled:
+                return None
+        if metrics.REQUEST_LATENCY.count(model=model_id, kind=kind) < self.min_samples:
+            return None
+        p90 = metrics.REQUEST_LATENCY.percentile(self.percentile, model=model_id, kind=kind)
+        return max(p90 or 0.0, self.min_delay)
+
+    def try_hedge(self) -> bool:
+        """申请发送一次对冲请求; 超出比例上限时返回 False"""
+        with self._lock:
+            if self._hedges + 1 > self._requests * self.max_percent / 100:
+                return False
+            self._hedges += 1
+            return True
+
+
+# Global instance
+policy = HedgePolicy()
@@ -0,0 +1,171 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, List, Any
+
+from common import database as db, logger_utils
+from common.token_ledger import fingerprint_key
+
+# 收到 429 且服务器未给出 Retry-After 时的冷却时间 (秒)
+DEFAULT_COOLDOWN = 30.0
+# 所有 Key 都在冷却时, acquire() 最多等待的时间 (秒), 超过后直接使用最快恢复的 Key
+MAX_WAIT = 60.0
+
+
+@dataclass
+class _KeyState:
+    api_key: str
+    label: str
+    fingerprint: str
+    in_flight: int = 0
+    cooldown_until: float = 0.0
+    disabled_reason: Optional[str] = None
+    last_used: float = 0.0
+    requests: int = 0
+    errors: int = 0
+
+    def available(self, now: float) -> bool:
+        return self.disabled_reason is None and self.cooldown_until <= now
+
+
+class KeyPool:
+    """
+    多 API Key 负载均衡:
+    - 每次请求选择当前并发数最少的可用 Key (并列时选最久未使用的)
+    - 429 之后该 Key 冷却一段时间 (优先使用 Retry-After)
+    - 401/403 之后该 Key 在本次运行中不再使用, 直到设置被重新加载
+    Key 来自数据库中的 api_keys 表; 调用方传入的 fallback Key (例如设置里的 api_key) 也会参与轮换。
+
+    吞吐量只在有并发请求时才随 Key 数增加: batchcli (--workers) 和并行的聊天会话 (各自一个 lane) 会同时使用
+    多个 Key。GUI 中的单图和矩阵任务在 job_manager 的默认 lane 中逐个执行, 对它们来说 Key 池只负责
+    故障转移 (429 冷却、失效 Key 跳过), 不会提高吞吐量。
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._states: Dict[str, _KeyState] = {}
+        self._loaded = False
+
+    def reload(self):
+        """从数据库重新加载 Key 列表; 保留仍存在的 Key 的并发计数, 清除冷却和禁用状态"""
+        rows = db.get_api_keys(enabled_only=True)
+        with self._lock:
+            states = {}
+            for row in rows:
+                old = self._states.get(row["api_key"])
+                states[row["api_key"]] = _KeyState(
+                    api_key=row["api_key"], label=row.get("label") or "", fingerprint=fingerprint_key(row["api_key"]),
+                    in_flight=old.in_flight if old else 0, requests=old.requests if old else 0,
+                    errors=old.errors if old else 0)
+            self._states = states
+            self._loaded = True
+            self._lock.notify_all()
+
+    def _load_once(self):
+        if not self._loaded:
+            self.reload()
+
+    def _ensure(self, fallback: Optional[str]):
+        """调用时需持有锁"""
+        if fallback and fallback not in self._states:
+            self._states[fallback] = _KeyState(api_key=fallback, label="settings", fingerprint=fingerprint_key(fallback))
+
+    def _choose(self, now: float) -> Optional[_KeyState]:
+        candidates = [s for s in self._states.values() if s.available(now)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda s: (s.in_flight, s.last_used))
+
+    def acquire(self, fallback: Optional[str] = None, max_wait: float = MAX_WAIT) -> Optional[str]:
+        """
+        选择一个 Key 并计入其并发数, 用完后必须调用 release()。
+        所有 Key 都在冷却时最多等待 max_wait 秒; 所有 Key 都被禁用时返回 None。
+        """
+        self._load_once()
+        deadline = time.monotonic() + max_wait
+        with self._lock:
+            self._ensure(fallback)
+            while True:
+                now = time.time()
+                state = self._choose(now)
+                if state is None:
+                    cooling = [s for s in self._states.values() if s.disabled_reason is None]
+                    if not cooling:
+                        return None
+                    soonest = min(cooling, key=lambda s: s.cooldown_until)
+                    wait = min(soonest.cooldown_until - now, deadline - time.monotonic())
+                    if wait <= 0:
+                        # 等不下去了, 使用最快恢复的 Key
+                        state = soonest
+                    else:
+                        logger_utils.debug(f"All API keys are cooling down, waiting {wait:.1f}s.")
+                        self._lock.wait(wait)
+                        continue
+                state.in_flight += 1
+                state.requests += 1
+                state.last_used = now
+                return state.api_key
+
+    def track(self, api_key: str):
+        """为绑定在某个 Key 上的长连接 (例如聊天会话) 计入一次并发, 用完后调用 release()"""
+        self._load_once()
+        with self._lock:
+            self._ensure(api_key)
+            state = self._states[api_key]
+            state.in_flight += 1
+            state.requests += 1
+            state.last_used = time.time()
+
+    def pick(self, fallback: Optional[str] = None) -> Optional[str]:
+        """只选择当前最合适的 Key, 不计入并发 (用于创建长期使用的 Client)"""
+        self._load_once()
+        with self._lock:
+            self._ensure(fallback)
+            state = self._choose(time.time())
+            return state.api_key if state else fallback
+
+    def release(self, api_key: Optional[str], status_code: Optional[int] = None,
+                retry_after: Optional[float] = None):
+        """归还 Key; status_code 为失败时的 HTTP 状态码, 用于冷却或禁用该 Key"""
+        if not api_key:
+            return
+        with self._lock:
+            state = self._states.get(api_key)
+            if state is None:
+                return
+            state.in_flight = max(0, state.in_flight - 1)
+            if status_code is not None:
+                state.errors += 1
+            if status_code == 429:
+                state.cooldown_until = max(state.cooldown_until, time.time() + (retry_after or DEFAULT_COOLDOWN))
+                logger_utils.warning(f"API key {state.fingerprint} hit its quota, cooling down "
+                                     f"for {retry_after or DEFAULT_COOLDOWN:.0f}s.", key_fingerprint=state.fingerprint)
+            elif status_code in (401, 403):
+                state.disabled_reason = str(status_code)
+                logger_utils.error(f"API key {state.fingerprint} was rejected ({status_code}), "
+                                   f"skipping it until the settings are reloaded.", key_fingerprint=state.fingerprint)
+            self._lock.notify_all()
+
+    def has_alternative(self, api_key: Optional[str]) -> bool:
+        """除 api_key 之外是否还有当前可用的 Key"""
+        now = time.time()
+        with self._lock:
+            return any(s.available(now) for k, s in self._states.items() if k != api_key)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """各 Key 的当前状态, 用于设置页显示 (不含明文 Key)"""
+        now = time.time()
+        with self._lock:
+            return [{
+                "label": s.label,
+                "fingerprint": s.fingerprint,
+                "in_flight": s.in_flight,
+                "requests": s.requests,
+                "errors": s.errors,
+                "cooldown": max(0.0, s.cooldown_until - now),
+                "disabled": s.disabled_reason,
+            } for s in self._states.values()]
+
+
+# Global instance
+pool = KeyPool()
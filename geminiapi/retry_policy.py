@@ -0,0 +1,140 @@
+import random
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from common import logger_utils
+
+# 错误分类
+RETRYABLE = "retryable"          # 5xx / 408 / 网络错误 / 未知异常: 退避后重试
+RATE_LIMITED = "rate_limited"    # 429: 换 Key 或按 Retry-After 等待后重试
+AUTH = "auth"                    # 401 / 403: 换 Key, 否则放弃
+TERMINAL = "terminal"            # 内容被拦截 / 参数无效等: 重试也不会成功
+
+# 明确不可重试的错误信息片段 (SDK 或本模块抛出的 ValueError 之外的情况)
+_TERMINAL_MESSAGES = ("client has been closed", "PROHIBITED_CONTENT", "SAFETY", "blocked due to")
+
+
+def status_code_of(e: Exception) -> Optional[int]:
+    """从 SDK 异常中取出 HTTP 状态码 (APIError.code), 取不到时从错误信息中匹配"""
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    match = re.search(r"\b([45]\d\d)\b", str(e))
+    return int(match.group(1)) if match else None
+
+
+def retry_after_of(e: Exception) -> Optional[float]:
+    """服务器建议的重试等待时间: Retry-After 响应头, 或错误详情中的 RetryInfo.retryDelay"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers:
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(e))
+    return float(match.group(1)) if match else None
+
+
+def _is_network_error(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        import httpx  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return False
+    return isinstance(e, httpx.TransportError)
+
+
+def classify(e: Exception) -> str:
+    """将异常归类为 RETRYABLE / RATE_LIMITED / AUTH / TERMINAL"""
+    if _is_network_error(e):
+        return RETRYABLE
+    message = str(e)
+    if any(fragment in message for fragment in _TERMINAL_MESSAGES):
+        return TERMINAL
+    status = status_code_of(e)
+    if status == 429:
+        return RATE_LIMITED
+    if status in (401, 403):
+        return AUTH
+    if status == 408 or (status and status >= 500):
+        return RETRYABLE
+    if status and 400 <= status < 500:
+        return TERMINAL
+    if isinstance(e, ValueError):
+        # 响应中没有图片 / 只有文本 / 被拦截, 见 api_client
+        return TERMINAL
+    return RETRYABLE
+
+
+@dataclass
+class RetryBudget:
+    """
+    单个任务的重试预算: 任务内所有 API 调用共享 (包括对冲请求所在的线程), 超出后不再重试。
+    """
+    max_retries: int = 6
+    max_backoff: float = 120.0
+    retries_used: int = 0
+    backoff_used: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def spend(self, delay: float) -> bool:
+        """申请一次重试 (等待 delay 秒); 预算不足时返回 False 且不扣减"""
+        with self._lock:
+            if self.retries_used + 1 > self.max_retries or self.backoff_used + delay > self.max_backoff:
+                return False
+            self.retries_used += 1
+            self.backoff_used += delay
+            return True
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    # 服务器要求的等待时间超过该值时放弃 (例如日配额用尽)
+    max_retry_after: float = 120.0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        第 attempt 次 (从 0 开始) 失败后的等待时间: 指数退避 + 抖动 (取上限的 50%~100%),
+        有 Retry-After 时以其为下限。返回 None 表示服务器要求的等待过长, 不应重试。
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(ceiling / 2, ceiling)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # 在服务器给出的时间之上加少量抖动, 避免多个任务同时醒来
+            delay = max(delay, retry_after * random.uniform(1.0, 1.1))
+        return delay
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+# 按任务 ID 保存的重试预算 (只保留最近的任务)
+_MAX_TRACKED_BUDGETS = 256
+_budgets: "OrderedDict[str, RetryBudget]" = OrderedDict()
+_budgets_lock = threading.Lock()
+
+
+def budget_for_current_job() -> RetryBudget:
+    """
+    当前任务的重试预算。JobManager 通过 logger_utils.bind(job_id=...) 标记任务,
+    同一任务内的多次调用共享同一个预算; 不在任务中时每次调用使用新的预算。
+    """
+    job_id = logger_utils.current_fields().get("job_id")
+    if job_id is None:
+        return RetryBudget()
+    # 同一任务的多个线程可能同时取预算, 必须拿到同一个实例
+    with _budgets_lock:
+        budget = _budgets.get(job_id)
+        if budget is None:
+            budget = _budgets[job_id] = RetryBudget()
+            while len(_budgets) > _MAX_TRACKED_BUDGETS:
+                _budgets.popitem(last=False)
+        return budget
@@ -2,6 +2,7 @@ import os
 import sys
 import unittest
 from io import BytesIO
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 
 import gradio as gr
@@ -10,7 +11,10 @@ from PIL import Image
 # 将项目根目录添加到 Python 路径中
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from geminiapi import api_client
+from google.genai import types
+from google.genai.chats import Chat
+
+from geminiapi import api_client, circuit_breaker
 
 
 # 修正：模拟 i18n.get 函数，使其签名与真实函数匹配
@@ -148,5 +152,34 @@ class TestApiClient(unittest.TestCase):
         self.assertIs(sent_contents[1], mock_image_instance)
         self.assertIs(sent_contents[2], mock_image_instance)
 
+
+class TestChatConfig(unittest.TestCase):
+
+    def tearDown(self):
+        circuit_breaker.breakers.reset()
+
+    def test_summary_reaches_model(self):
+        """测试较早消息的摘要 (system_instruction) 随每条消息的 config 一起发给模型"""
+        models = MagicMock()
+        models.generate_content.return_value = types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(role="model", parts=[types.Part(text="hello")]))
+        ])
+        genai_client = SimpleNamespace(chats=SimpleNamespace(
+            create=lambda model, config, history: Chat(modules=models, model=model, config=config,
+                                                       history=history or [])
+        ))
+
+        result = api_client.call_google_chat(genai_client, None, ["hi"], "gemini-3-pro-image-preview", "1:1", "1K",
+                                             history=[("user", ["earlier"], [None])],
+                                             system_instruction="Summary of earlier turns")
+
+        self.assertIsNotNone(result)
+        self.assertEqual(result[1], ["hello"])
+        config = models.generate_content.call_args.kwargs["config"]
+        self.assertEqual(config.system_instruction, "Summary of earlier turns")
+        self.assertEqual(config.response_modalities, ["TEXT", "IMAGE"])
+        self.assertEqual(config.image_config.aspect_ratio, "1:1")
+        self.assertEqual(len(models.generate_content.call_args.kwargs["contents"]), 2)
+
 if __name__ == '__main__':
     unittest.main()
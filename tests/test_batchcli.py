@@ -0,0 +1,79 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from batchcli.manifest import load_manifest, load_results, pending_items
+from batchcli.runner import run_batch, ProgressReporter
+
+
+def fake_generate(prompt, image_paths, api_key, model_id, aspect_ratio, resolution):
+    """代替 call_google_genai: prompt 含 'fail' 时返回 None"""
+    if "fail" in prompt:
+        return None
+    return Image.new("RGB", (8, 8), "red")
+
+
+class TestBatchCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.tmp_dir.name, "out")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def run_items(self, items):
+        reporter = ProgressReporter(len(items), stream=io.StringIO())
+        return asyncio.run(run_batch(items, self.output_dir, "key", workers=2, generate=fake_generate,
+                                     reporter=reporter))
+
+    def test_load_csv_and_jsonl(self):
+        """测试 CSV 与 JSONL 清单解析, 相对图片路径基于清单目录"""
+        csv_path = self.write("jobs.csv", "id,prompt,images,model\na,cat,x.png;y.png,m1\n,dog,,\n")
+        items = load_manifest(csv_path)
+        self.assertEqual([item.id for item in items], ["a", "row00002"])
+        self.assertEqual(items[0].image_paths, [os.path.join(self.tmp_dir.name, "x.png"),
+                                                os.path.join(self.tmp_dir.name, "y.png")])
+        self.assertEqual(items[0].model_id, "m1")
+
+        jsonl_path = self.write("jobs.jsonl", '{"prompt": "cat", "aspect_ratio": "16:9"}\n\n'
+                                              '{"id": "b", "images": ["/abs.png"]}\n')
+        items = load_manifest(jsonl_path)
+        self.assertEqual([item.id for item in items], ["row00001", "b"])
+        self.assertEqual(items[0].aspect_ratio, "16:9")
+        self.assertEqual(items[1].image_paths, ["/abs.png"])
+
+        with self.assertRaises(ValueError):
+            load_manifest(self.write("dup.jsonl", '{"id": "a", "prompt": "x"}\n{"id": "a", "prompt": "y"}\n'))
+
+    def test_run_and_resume(self):
+        """测试批量执行写出图片和结果清单, 续跑时只重跑失败的条目"""
+        items = load_manifest(self.write("jobs.jsonl", "\n".join(
+            json.dumps({"id": f"j{i}", "prompt": "fail" if i == 2 else f"prompt {i}"}) for i in range(4))))
+
+        reporter = self.run_items(items)
+        self.assertEqual((reporter.done, reporter.failed), (4, 1))
+        results = load_results(self.output_dir)
+        self.assertEqual(results["j2"]["status"], "error")
+        self.assertTrue(os.path.exists(results["j0"]["output"]))
+
+        remaining = pending_items(items, self.output_dir)
+        self.assertEqual([item.id for item in remaining], ["j2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
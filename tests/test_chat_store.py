@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.chat_store import ChatStore, ChatTranscript, ContextPolicy, make_part, ROLE_USER, ROLE_MODEL
+from common.image_util import ImageRef
+
+
+class TestChatStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = ChatStore(directory=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_transcript(self, rounds):
+        transcript = ChatTranscript.new(model="test-model")
+        for i in range(rounds):
+            transcript.add_turn(ROLE_USER, [make_part(ImageRef(f"/in/{i}.png", "d" * 64)),
+                                            make_part(f"question {i}")])
+            transcript.add_turn(ROLE_MODEL, [make_part(f"answer {i}", signature=b"sig"),
+                                             make_part(ImageRef(f"/out/{i}.png"))])
+        return transcript
+
+    def test_save_and_load(self):
+        """测试对话记录保存后可以完整读回, 标题取自第一条用户消息, latest 返回最近更新的会话"""
+        old = self.make_transcript(1)
+        old.updated_at = 1.0
+        self.store.save(old)
+        transcript = self.make_transcript(2)
+        self.store.save(transcript)
+
+        loaded = self.store.load(transcript.id)
+        self.assertEqual(loaded.to_dict(), transcript.to_dict())
+        self.assertEqual(loaded.title, "question 0")
+        self.assertEqual(self.store.latest().id, transcript.id)
+        self.assertIsNone(self.store.load("missing"))
+
+        self.store.delete(old.id)
+        self.assertEqual([t.id for t in self.store.list_sessions()], [transcript.id])
+
+    def test_policy_trims_turns_and_images(self):
+        """测试只保留最近 N 轮, 较早的图片换成占位文字, 被裁掉的消息进入摘要"""
+        transcript = self.make_transcript(5)
+        context = ContextPolicy(max_turns=3, image_turns=1).build(transcript.turns)
+
+        self.assertEqual(len(context.history), 6)
+        self.assertEqual(context.dropped_turns, 4)
+        self.assertEqual(context.dropped_images, 4)
+        self.assertIn("User: question 0 [1 image(s)]", context.summary)
+        self.assertIn("Assistant: answer 1", context.summary)
+        self.assertNotIn("question 2", context.summary)
+
+        role, parts, signatures = context.history[0]
+        self.assertEqual(role, ROLE_USER)
+        self.assertEqual(parts, ["[image omitted: 2.png]", "question 2"])
+        _, parts, signatures = context.history[-1]
+        self.assertEqual(parts[0], "answer 4")
+        self.assertIsInstance(parts[1], ImageRef)
+        self.assertEqual(signatures, [b"sig", None])
+
+    def test_policy_from_settings(self):
+        """测试从设置读取策略, 0 表示不限制, 非法值回退到默认值"""
+        policy = ContextPolicy.from_settings({"chat_context_turns": "0", "chat_image_turns": "x",
+                                              "chat_summarize": ""})
+        self.assertEqual((policy.max_turns, policy.image_turns, policy.summarize), (0, 2, False))
+
+        context = policy.build(self.make_transcript(4).turns)
+        self.assertEqual(len(context.history), 8)
+        self.assertEqual(context.summary, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
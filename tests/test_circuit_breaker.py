@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.job_manager import JobManager, Job
+from geminiapi import circuit_breaker
+from geminiapi.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("model-a", min_calls=4, failure_rate=0.5, open_seconds=10,
+                                      max_open_seconds=40, clock=self.clock)
+
+    def record_failures(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(False)
+
+    def test_opens_after_failure_rate(self):
+        """测试失败率达到阈值后断路器打开并拒绝请求"""
+        self.breaker.record(True)
+        self.record_failures(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.record_failures(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertAlmostEqual(self.breaker.retry_in(), 10)
+
+    def test_neutral_outcomes_are_ignored(self):
+        """测试与服务端健康无关的结果 (429 等) 不计入失败率"""
+        for _ in range(10):
+            self.breaker.record(None)
+        self.record_failures(1)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe(self):
+        """测试半开状态只放行一个试探请求, 成功后恢复"""
+        self.record_failures(4)
+        self.clock.now += 10
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens_longer(self):
+        """测试试探失败后重新打开, 等待时间翻倍"""
+        self.record_failures(4)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertAlmostEqual(self.breaker.retry_in(), 20)
+
+
+class TestJobManagerCircuit(unittest.IsolatedAsyncioTestCase):
+
+    def tearDown(self):
+        circuit_breaker.breakers.reset()
+
+    async def test_open_circuit_fails_fast(self):
+        """测试模型断路器打开时, 超过等待上限的任务直接失败, 其他模型的任务正常执行"""
+        breaker = circuit_breaker.breakers.get("broken-model")
+        for _ in range(breaker.min_calls):
+            breaker.record(False)
+
+        calls = []
+
+        def task(model_id):
+            calls.append(model_id)
+
+        manager = JobManager(max_circuit_wait=0)
+        broken = Job(id="broken", name="broken", task_func=task, kwargs={"model_id": "broken-model"})
+        healthy = Job(id="healthy", name="healthy", task_func=task, kwargs={"model_id": "other-model"})
+        await manager.add_job(broken)
+        await manager.add_job(healthy)
+        await asyncio.wait_for(manager.join(), 2)
+
+        self.assertEqual(broken.status, "error")
+        self.assertIn("broken-model", broken.error)
+        self.assertEqual(healthy.status, "success")
+        self.assertEqual(calls, ["other-model"])
+        await manager.stop_workers()
+
+    async def test_paused_job_is_requeued_once(self):
+        """测试断路器打开时任务被搁置, 等待上限到期时只重新入队一次; 取消被搁置的任务立即生效"""
+        breaker = circuit_breaker.breakers.get("broken-model")
+        for _ in range(breaker.min_calls):
+            breaker.record(False)
+
+        manager = JobManager(max_circuit_wait=0.2)
+        checks = []
+        check_circuit = manager._check_circuit
+        manager._check_circuit = lambda job: checks.append(job.id) or check_circuit(job)
+
+        waiting = Job(id="waiting", name="waiting", task_func=lambda model_id: None,
+                      kwargs={"model_id": "broken-model"})
+        await manager.add_job(waiting)
+        await asyncio.wait_for(manager.join(), 2)
+        self.assertEqual(waiting.status, "error")
+        self.assertEqual(checks, ["waiting", "waiting"])
+
+        manager.max_circuit_wait = 60
+        cancelled = Job(id="cancelled", name="cancelled", task_func=lambda model_id: None,
+                        kwargs={"model_id": "broken-model"})
+        await manager.add_job(cancelled)
+        await asyncio.sleep(0.05)
+        self.assertIn("cancelled", manager._parked)
+        self.assertTrue(manager.cancel_job("cancelled"))
+        await asyncio.wait_for(manager.join(), 2)
+        self.assertEqual(cancelled.status, "cancelled")
+        self.assertEqual(manager._parked, {})
+        await manager.stop_workers()
+
+
+if __name__ == '__main__':
+    unittest.main()
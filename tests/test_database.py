@@ -1,13 +1,15 @@
 import os
 import sqlite3
 import sys
+import tempfile
 import unittest
+from types import SimpleNamespace
 
 # 将项目根目录添加到 Python 路径中，以便能够导入 database 模块
 # 这对于在 tests/ 目录下直接运行测试是必需的
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from common import database as db
+from common import database as db, token_ledger
 
 
 class TestDatabase(unittest.TestCase):
@@ -111,5 +113,158 @@ class TestDatabase(unittest.TestCase):
         expected_titles_after_delete = ["---", "A Title", "C Title"]
         self.assertEqual(db.get_all_prompt_titles(), expected_titles_after_delete)
 
+
+class TestSchemaMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_fresh_database_reaches_latest_version(self):
+        """测试空数据库会被迁移到最新版本"""
+        db.migrate_db(self.conn)
+        self.assertEqual(db.get_schema_version(self.conn), db.SCHEMA_VERSION)
+        c = self.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_prompts_order_id'")
+        self.assertIsNotNone(c.fetchone(), "The prompts order index should be created.")
+
+    def test_legacy_database_without_order_id(self):
+        """测试旧版数据库 (无 order_id 列, user_version=0) 的升级"""
+        c = self.conn.cursor()
+        c.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)")
+        c.execute("CREATE TABLE prompts (title TEXT PRIMARY KEY, content TEXT)")
+        c.executemany("INSERT INTO prompts (title, content) VALUES (?, ?)", [("A", "a"), ("B", "b")])
+        self.conn.commit()
+
+        db.migrate_db(self.conn)
+
+        c.execute("SELECT title, order_id FROM prompts ORDER BY order_id")
+        self.assertEqual(c.fetchall(), [("A", 0), ("B", 1)])
+        self.assertEqual(db.get_schema_version(self.conn), db.SCHEMA_VERSION)
+
+    def test_migrate_is_idempotent(self):
+        """测试重复迁移不会出错"""
+        db.migrate_db(self.conn)
+        db.migrate_db(self.conn)
+        self.assertEqual(db.get_schema_version(self.conn), db.SCHEMA_VERSION)
+
+    def test_failed_step_is_rolled_back(self):
+        """测试失败的迁移步骤会整体回滚且不会推进版本号"""
+        def broken_step(c):
+            c.execute("CREATE TABLE half_done (id INTEGER)")
+            raise RuntimeError("boom")
+
+        original = db.MIGRATIONS
+        db.MIGRATIONS = original + [(db.SCHEMA_VERSION + 1, broken_step)]
+        original_version = db.SCHEMA_VERSION
+        db.SCHEMA_VERSION = original_version + 1
+        try:
+            with self.assertRaises(RuntimeError):
+                db.migrate_db(self.conn)
+        finally:
+            db.MIGRATIONS = original
+            db.SCHEMA_VERSION = original_version
+
+        self.assertEqual(db.get_schema_version(self.conn), original_version)
+        c = self.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='half_done'")
+        self.assertIsNone(c.fetchone())
+
+
+class TestNdjsonImportExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = os.path.join(self.tmp_dir.name, "test.sqlite")
+        conn = db.get_db_connection()
+        db.init_db(conn)
+        conn.close()
+
+    def tearDown(self):
+        db.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        """测试 NDJSON 导出后再导入能还原全部数据"""
+        for i in range(7):
+            db.save_prompt(f"Title {i}", f"Content {i}")
+        db.save_setting("api_key", "key_123")
+        export_path = os.path.join(self.tmp_dir.name, "backup.ndjson")
+
+        progress = []
+        exported = db.export_all_data_ndjson(export_path, lambda done, total: progress.append((done, total)),
+                                             chunk_size=3)
+        self.assertEqual(exported, progress[-1][0])
+        self.assertEqual(progress[-1][0], progress[-1][1])
+
+        db.clear_all_data()
+        self.assertEqual(db.get_all_prompt_titles(), [])
+
+        counts = db.import_all_data_ndjson(export_path, chunk_size=3)
+        self.assertEqual(counts["prompts"], 7)
+        self.assertEqual(db.get_all_prompt_titles(), [f"Title {i}" for i in range(7)])
+        self.assertEqual(db.get_setting("api_key"), "key_123")
+
+    def test_invalid_file_rolls_back(self):
+        """测试导入非法文件 (格式不符、空文件、缺少文件头) 时不会清空现有数据"""
+        db.save_prompt("Keep me", "content")
+        bad_path = os.path.join(self.tmp_dir.name, "bad.ndjson")
+        contents = [
+            '{"format": "something-else"}\n',
+            "",
+            "\n  \n",
+            '{"table": "prompts", "row": {"title": "x", "content": "y"}}\n',
+        ]
+        for content in contents:
+            with open(bad_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            with self.assertRaises(ValueError):
+                db.import_all_data_ndjson(bad_path)
+            self.assertEqual(db.get_prompt_content("Keep me"), "content")
+
+class TestTokenLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = os.path.join(self.tmp_dir.name, "test.sqlite")
+        conn = db.get_db_connection()
+        db.init_db(conn)
+        conn.close()
+
+    def tearDown(self):
+        db.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def test_batched_record_and_aggregates(self):
+        """测试账本批量写入以及按天/按模型/按 prompt 的聚合查询"""
+        usage = SimpleNamespace(prompt_token_count=100, candidates_token_count=1290, total_token_count=1390)
+        for _ in range(3):
+            token_ledger.record("model-a", usage, api_key="secret-key", prompt="a cat", job_id="job-1")
+        token_ledger.record("model-b", usage, kind="chat", prompt="a dog")
+        self.assertTrue(token_ledger.flush())
+
+        by_model = db.get_token_usage_by_model()
+        self.assertEqual([row["model"] for row in by_model], ["model-a", "model-b"])
+        self.assertEqual(by_model[0]["requests"], 3)
+        self.assertEqual(by_model[0]["total_tokens"], 3 * 1390)
+
+        by_day = db.get_token_usage_by_day(model="model-b")
+        self.assertEqual(len(by_day), 1)
+        self.assertEqual(by_day[0]["prompt_tokens"], 100)
+
+        top = db.get_top_prompts_by_tokens(limit=1)
+        self.assertEqual(top[0]["prompt_preview"], "a cat")
+
+        conn = db.get_db_connection()
+        fingerprints = {row[0] for row in conn.execute("SELECT key_fingerprint FROM token_usage")}
+        conn.close()
+        self.assertIn(token_ledger.fingerprint_key("secret-key"), fingerprints)
+        self.assertNotIn("secret-key", fingerprints)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.event_bus import EventBus
+
+
+class TestEventBus(unittest.IsolatedAsyncioTestCase):
+
+    async def test_publish_from_thread(self):
+        """测试工作线程发布的事件在事件循环线程中按顺序分发, 启动前发布的事件不会丢失"""
+        bus = EventBus()
+        received = []
+        loop_thread = threading.get_ident()
+        done = asyncio.Event()
+
+        def on_event(payload):
+            received.append((payload, threading.get_ident() == loop_thread))
+            if payload == 3:
+                done.set()
+
+        bus.subscribe("topic", on_event)
+        bus.publish("topic", 1)
+        runner = asyncio.create_task(bus.run())
+        await asyncio.sleep(0)
+        worker = threading.Thread(target=lambda: [bus.publish("topic", i) for i in (2, 3)])
+        worker.start()
+        await asyncio.wait_for(done.wait(), 2)
+        worker.join()
+        runner.cancel()
+
+        self.assertEqual(received, [(1, True), (2, True), (3, True)])
+
+    async def test_async_handler_and_errors(self):
+        """测试异步回调会被等待, 某个回调出错不影响其他订阅者"""
+        bus = EventBus()
+        received = []
+
+        def broken(payload):
+            raise ValueError("boom")
+
+        async def on_event(payload):
+            await asyncio.sleep(0)
+            received.append(payload)
+
+        bus.subscribe("topic", broken)
+        bus.subscribe("topic", on_event)
+        bus.subscribe("other", broken)
+        bus.unsubscribe("other", broken)
+        runner = asyncio.create_task(bus.run())
+        await asyncio.sleep(0)
+        bus.publish("topic", "hello")
+        bus.publish("other", "ignored")
+        for _ in range(10):
+            await asyncio.sleep(0)
+        runner.cancel()
+
+        self.assertEqual(received, ["hello"])
+
+
+if __name__ == '__main__':
+    unittest.main()
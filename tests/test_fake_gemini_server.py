@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import database as db, token_ledger
+from devtools.fake_gemini_server import FakeGeminiServer, FakeConfig
+from geminiapi import api_client, key_pool, circuit_breaker
+from geminiapi.key_pool import KeyPool
+
+MODEL = "gemini-3-pro-image-preview"
+
+
+class TestFakeGeminiServer(unittest.TestCase):
+    """通过本地模拟服务走完真实的 SDK HTTP 请求"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = os.path.join(self.tmp_dir.name, "test.sqlite")
+        conn = db.get_db_connection()
+        db.init_db(conn)
+        conn.close()
+        self.pool_patch = patch.object(key_pool, "pool", KeyPool())
+        self.pool_patch.start()
+        self.server = FakeGeminiServer(FakeConfig(latency_ms=10, latency_sigma=0, seed=1)).start()
+        api_client.set_base_url(self.server.url)
+
+    def tearDown(self):
+        api_client.set_base_url(None)
+        self.server.stop()
+        self.pool_patch.stop()
+        circuit_breaker.breakers.reset()
+        token_ledger.flush()
+        db.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def test_generate_image(self):
+        """测试正常返回图片, 并记录 token 用量"""
+        img = api_client.call_google_genai("a banana", [], "fake-key", MODEL, "1:1", "1K")
+        self.assertIsNotNone(img)
+        self.assertEqual(img.size, (256, 256))
+        self.assertEqual(self.server.snapshot_stats()["ok"], 1)
+        token_ledger.flush()
+        self.assertEqual(db.get_token_usage_by_model()[0]["model"], MODEL)
+
+    def test_blocked_response_is_not_retried(self):
+        """测试被内容策略拦截的请求不会重试"""
+        self.server.update_config(rate_blocked=1.0)
+        self.assertIsNone(api_client.call_google_genai("a banana", [], "fake-key", MODEL, "1:1", "1K"))
+        stats = self.server.snapshot_stats()
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["blocked"], 1)
+
+    def test_rate_limit_switches_key(self):
+        """测试 429 之后换用 Key 池中的另一个 Key 立即重试"""
+        db.add_api_key("second-key", label="second")
+        key_pool.pool.reload()
+        self.server.update_config(rate_429=1.0, retry_after=60)
+        with patch.object(api_client.retry_policy.DEFAULT_POLICY, "max_attempts", 2):
+            self.assertIsNone(api_client.call_google_genai("a banana", [], "fake-key", MODEL, "1:1", "1K"))
+        self.assertEqual(self.server.snapshot_stats()["429"], 2)
+        cooling = [item for item in key_pool.pool.snapshot() if item["cooldown"] > 0]
+        self.assertEqual(len(cooling), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import metrics
+from geminiapi import api_client, hedging
+from geminiapi.hedging import HedgePolicy
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    def test_needs_latency_history(self):
+        """测试样本不足或未启用时不对冲, 样本足够时等待时间取 p90"""
+        policy = HedgePolicy(min_samples=10, min_delay=0.0)
+        policy.configure(enabled=True)
+        self.assertIsNone(policy.delay_for("hedge-test-model"))
+        for i in range(1, 11):
+            metrics.REQUEST_LATENCY.observe(float(i), model="hedge-test-model", kind="image")
+        self.assertAlmostEqual(policy.delay_for("hedge-test-model"), 9.0, delta=1.0)
+        policy.configure(enabled=False)
+        self.assertIsNone(policy.delay_for("hedge-test-model"))
+
+    def test_budget_caps_hedges(self):
+        """测试对冲请求数量不超过总请求数的上限比例"""
+        policy = HedgePolicy()
+        policy.configure(enabled=True, max_percent=10)
+        for _ in range(20):
+            policy.delay_for("hedge-budget-model")
+        self.assertTrue(policy.try_hedge())
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+
+
+class TestHedgedRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_policy = hedging.policy
+        hedging.policy = HedgePolicy(min_samples=0, min_delay=0.0)
+        hedging.policy.configure(enabled=True, max_percent=100)
+
+    def tearDown(self):
+        hedging.policy = self.original_policy
+
+    def test_fast_hedge_wins(self):
+        """测试原请求过慢时发送对冲请求, 先返回的对冲结果生效, 原请求的 Key 在其结束后按错误状态归还"""
+        release_slow = threading.Event()
+
+        slow_error = RuntimeError("429 RESOURCE_EXHAUSTED")
+        slow_error.code = 429
+
+        def make_client(key):
+            client = MagicMock()
+            if key == "slow-key":
+                def slow(**_kw):
+                    release_slow.wait(2)
+                    raise slow_error
+                client.models.generate_content.side_effect = slow
+            else:
+                client.models.generate_content.return_value = "fast"
+            return client
+
+        with patch.object(api_client, "get_client", side_effect=make_client), \
+                patch.object(api_client.key_pool.pool, "acquire", return_value="fast-key"), \
+                patch.object(api_client.key_pool.pool, "release") as release, \
+                patch.object(api_client.token_ledger, "record"), \
+                patch.object(hedging.policy, "delay_for", return_value=0.05), \
+                patch.object(hedging.policy, "try_hedge", return_value=True):
+            response, key, handed_off = api_client._generate_content("slow-key", "slow-key", "hedge-model",
+                                                                     ["prompt"], None, "prompt")
+            self.assertEqual(response, "fast")
+            self.assertEqual(key, "fast-key")
+            # 原请求仍在进行, 它的 Key 由完成回调按真实结果归还
+            self.assertTrue(handed_off)
+            self.assertNotIn("slow-key", [c.args[0] for c in release.call_args_list])
+            release_slow.set()
+            for _ in range(200):
+                if len(release.call_args_list) == 2:
+                    break
+                time.sleep(0.01)
+        released = {c.args[0]: c.args[1:] for c in release.call_args_list}
+        self.assertEqual(released["fast-key"], (None, None))
+        self.assertEqual(released["slow-key"][0], api_client.retry_policy.status_code_of(slow_error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+from common.image_util import list_images, list_images_by_mtime, ImageRef, resolve_parts
+
+
+class TestImageListing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        os.makedirs(os.path.join(self.root, "sub"))
+        for i, name in enumerate(("a.png", "b.JPG", "notes.txt", os.path.join("sub", "c.webp"))):
+            path = os.path.join(self.root, name)
+            with open(path, "wb"):
+                pass
+            os.utime(path, (1000 + i, 1000 + i))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_list_images(self):
+        """测试按扩展名过滤图片, 可选包含子目录"""
+        names = sorted(os.path.basename(p) for p in list_images(self.root))
+        self.assertEqual(names, ["a.png", "b.JPG"])
+        names = sorted(os.path.basename(p) for p in list_images(self.root, recursive=True))
+        self.assertEqual(names, ["a.png", "b.JPG", "c.webp"])
+
+    def test_scan_order_and_errors(self):
+        """测试递归扫描的顺序与 os.walk 一致, 目录不存在时与 os.listdir 一样抛出 OSError"""
+        os.makedirs(os.path.join(self.root, "sub", "deeper"))
+        for name in (os.path.join("sub", "deeper", "d.png"), os.path.join("sub", "e.png")):
+            with open(os.path.join(self.root, name), "wb"):
+                pass
+        expected = [os.path.join(root, name) for root, _, files in os.walk(self.root)
+                    for name in files if not name.endswith(".txt")]
+        self.assertEqual(list_images(self.root, recursive=True), expected)
+
+        missing = os.path.join(self.root, "missing")
+        with self.assertRaises(OSError):
+            list_images(missing)
+        with self.assertRaises(OSError):
+            list_images_by_mtime(missing)
+
+    def test_list_images_by_mtime(self):
+        """测试历史记录按修改时间倒序排列"""
+        names = [os.path.basename(p) for p in list_images_by_mtime(self.root)]
+        self.assertEqual(names, ["b.JPG", "a.png"])
+
+
+class TestImageRef(unittest.TestCase):
+
+    def test_ref_is_resolved_lazily(self):
+        """测试图片引用只保存路径和内容哈希, resolve_parts 时才打开图片"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path_a, path_b = os.path.join(tmp_dir, "a.png"), os.path.join(tmp_dir, "b.png")
+            Image.new("RGB", (8, 4), "red").save(path_a)
+            Image.new("RGB", (8, 4), "red").save(path_b)
+            ref_a, ref_b = ImageRef.from_path(path_a), ImageRef.from_path(path_b)
+            # 内容相同的文件哈希相同
+            self.assertEqual(ref_a.digest, ref_b.digest)
+            self.assertEqual(len(ref_a.digest), 64)
+
+            parts = resolve_parts(["prompt", ref_a])
+            self.assertEqual(parts[0], "prompt")
+            self.assertIsInstance(parts[1], Image.Image)
+            self.assertEqual(parts[1].size, (8, 4))
+            parts[1].close()
+
+    def test_resolve_closes_files_and_skips_missing(self):
+        """测试打开图片后立即关闭文件 (源文件可以删除), 找不到的图片被跳过"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "a.png")
+            Image.new("RGB", (8, 4), "red").save(path)
+            missing = ImageRef(os.path.join(tmp_dir, "missing.png"))
+
+            parts = resolve_parts([ImageRef.from_path(path), missing, "prompt"])
+            self.assertEqual(len(parts), 2)
+            self.assertIsNone(parts[0].fp)
+            os.remove(path)
+            self.assertEqual(parts[0].getpixel((0, 0)), (255, 0, 0))
+            self.assertEqual(parts[1], "prompt")
+
+
+if __name__ == '__main__':
+    unittest.main()
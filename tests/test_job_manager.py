@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+from common import tracing
+from common.image_util import ImageRef
+from common.job_manager import JobManager, Job
+
+
+def traced_task(value):
+    """在工作线程中记录 span 的测试任务"""
+    with tracing.span(tracing.SPAN_PREPROCESS):
+        pass
+    with tracing.span(tracing.SPAN_REQUEST, attempt=1):
+        pass
+    return value * 2
+
+
+class TestJobManager(unittest.IsolatedAsyncioTestCase):
+
+    async def wait_until(self, predicate, timeout=2.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                self.fail("Timed out waiting for job manager")
+            await asyncio.sleep(0.01)
+
+    async def test_job_records_latency_breakdown(self):
+        """测试任务执行时记录各阶段耗时"""
+        manager = JobManager()
+        results = []
+        job = Job(id="job_1", name="traced", task_func=traced_task, kwargs={"value": 21},
+                  on_success=results.append)
+        await manager.add_job(job)
+        await self.wait_until(lambda: job.status == "success")
+
+        self.assertEqual(results, [42])
+        names = [item["name"] for item in job.spans]
+        self.assertEqual(names, [tracing.SPAN_QUEUE_WAIT, tracing.SPAN_PREPROCESS, tracing.SPAN_REQUEST])
+        self.assertEqual(job.spans[2]["attempt"], 1)
+        self.assertEqual(list(job.timing_breakdown()), names)
+        # 导出的耗时数据必须可以序列化为 JSON
+        exported = json.loads(json.dumps(manager.export_timings()))
+        self.assertEqual(exported[0]["id"], "job_1")
+
+    async def test_group_progress_and_cancel(self):
+        """测试批量提交的任务组进度统计, 以及取消组内尚未开始的任务"""
+        manager = JobManager(history_limit=2)
+        jobs = [Job(id=f"g_{i}", name=f"job {i}", task_func=traced_task, kwargs={"value": i}) for i in range(5)]
+        group = await manager.add_jobs(jobs, "group_1", "Matrix")
+        # 第一个任务已开始前取消剩余任务 (工作协程尚未运行)
+        cancelled = manager.cancel_group("group_1")
+        self.assertEqual(cancelled, 5)
+        # 仍在排队的任务不会因 history_limit 被移出历史
+        self.assertEqual(len(manager.history), 5)
+        await manager.join()
+
+        self.assertTrue(group.is_done)
+        self.assertEqual((group.succeeded, group.cancelled), (0, 5))
+
+        more = [Job(id=f"h_{i}", name=f"job {i}", task_func=traced_task, kwargs={"value": i}) for i in range(3)]
+        group = await manager.add_jobs(more, "group_2", "Matrix 2")
+        await manager.join()
+        self.assertEqual((group.succeeded, group.failed, group.progress), (3, 0, 1.0))
+        self.assertEqual({job.group_id for job in more}, {"group_2"})
+        # 超出 history_limit 时先移除已结束的任务, 仍在排队的新任务保留
+        self.assertEqual([job.id for job in manager.history], ["h_0", "h_1", "h_2"])
+        await manager.stop_workers()
+
+    async def test_events_are_batched(self):
+        """测试批量提交时订阅者只收到一次通知, 事件带有新旧状态; 回调出错不影响其他订阅者和任务"""
+        manager = JobManager(notify_window=0.05)
+        batches = []
+
+        def broken(_events):
+            raise RuntimeError("slow UI")
+
+        manager.subscribe(broken)
+        manager.subscribe(batches.append)
+        jobs = [Job(id=f"b_{i}", name=f"job {i}", task_func=traced_task, kwargs={"value": i}) for i in range(500)]
+        manager.cancel_job("unknown")
+        await manager.add_jobs(jobs, "bulk", "Bulk")
+        self.assertEqual(batches, [])  # 在工作协程之外, 窗口结束后才分发
+
+        await self.wait_until(lambda: batches)
+        first = batches[0]
+        self.assertEqual(len(first), 500 + sum(1 for event in first if event.old_status is not None))
+        self.assertEqual((first[0].job_id, first[0].old_status, first[0].new_status, first[0].group_id),
+                         ("b_0", None, "queued", "bulk"))
+
+        await manager.join()
+        await manager.stop_workers()
+        events = [event for batch in batches for event in batch if event.job_id == "b_499"]
+        self.assertEqual([(e.old_status, e.new_status) for e in events],
+                         [(None, "queued"), ("queued", "running"), ("running", "success")])
+        self.assertLess(len(batches), 500)
+
+    async def test_async_subscriber_gets_events_from_threads(self):
+        """测试在其他线程中取消任务时, 异步订阅者也能在工作协程所在的事件循环中收到事件"""
+        manager = JobManager(notify_window=0.01)
+        received = []
+
+        async def subscriber(events):
+            received.extend((event.job_id, event.new_status) for event in events)
+
+        manager.subscribe(subscriber)
+        blocker = threading.Event()
+        await manager.add_job(Job(id="busy", name="busy", task_func=blocker.wait, kwargs={}))
+        await manager.add_job(Job(id="later", name="later", task_func=traced_task, kwargs={"value": 1}))
+        try:
+            await self.wait_until(lambda: ("busy", "running") in received)
+            self.assertTrue(await asyncio.to_thread(manager.cancel_job, "later"))
+            await self.wait_until(lambda: ("later", "cancelled") in received)
+        finally:
+            blocker.set()
+        await manager.join()
+        await manager.stop_workers()
+
+    async def test_payload_released_after_finish(self):
+        """测试任务结束后只保留轻量参数 (文本和图片引用), 客户端、PIL 图片和回调被释放"""
+        manager = JobManager()
+        ref = ImageRef("/tmp/a.png", "abc")
+
+        def task(**_kwargs):
+            return "ok"
+
+        job = Job(id="heavy", name="heavy", task_func=task,
+                  kwargs={"genai_client": object(), "prompt_parts": [Image.new("RGB", (4, 4)), ref, "text"],
+                          "model_id": "m"},
+                  on_success=lambda result: None)
+        await manager.add_job(job)
+        await manager.join()
+        await manager.stop_workers()
+
+        self.assertEqual(job.status, "success")
+        self.assertEqual(job.kwargs, {"prompt_parts": [ref, "text"], "model_id": "m"})
+        self.assertIsNone(job.on_success)
+
+    async def test_lanes_serialize_within_and_overlap_across(self):
+        """测试同一 lane 的任务按提交顺序逐个执行, 不同 lane 的任务并发执行, 被取消的任务不阻塞 lane"""
+        manager = JobManager(max_workers=4)
+        lock = threading.Lock()
+        running = {"a": 0, "b": 0}
+        overlap = {"a": 0, "b": 0, "total": 0}
+        order = []
+
+        def task(lane, index):
+            with lock:
+                running[lane] += 1
+                overlap[lane] = max(overlap[lane], running[lane])
+                overlap["total"] = max(overlap["total"], running["a"] + running["b"])
+                order.append((lane, index))
+            time.sleep(0.03)
+            with lock:
+                running[lane] -= 1
+
+        jobs = [Job(id=f"{lane}{i}", name=lane, task_func=task, kwargs={"lane": lane, "index": i}, lane=lane)
+                for i in range(3) for lane in ("a", "b")]
+        for job in jobs:
+            await manager.add_job(job)
+        self.assertTrue(manager.cancel_job("a1"))
+        await manager.join()
+        await manager.stop_workers()
+
+        self.assertEqual(overlap["a"], 1)
+        self.assertEqual(overlap["b"], 1)
+        self.assertEqual(overlap["total"], 2)
+        self.assertEqual([i for lane, i in order if lane == "a"], [0, 2])
+        self.assertEqual([i for lane, i in order if lane == "b"], [0, 1, 2])
+        self.assertEqual(manager.lane_jobs("a"), [])
+        self.assertEqual(manager._lane_owners, {})
+
+    async def test_default_lane_keeps_plain_jobs_serial(self):
+        """测试设置 default_lane 后未指定 lane 的任务仍逐个执行, 其他 lane 的任务与其并发"""
+        manager = JobManager(max_workers=4, default_lane="default")
+        lock = threading.Lock()
+        running = {"plain": 0, "max_plain": 0, "chat_overlapped": False}
+
+        def plain():
+            with lock:
+                running["plain"] += 1
+                running["max_plain"] = max(running["max_plain"], running["plain"])
+            time.sleep(0.03)
+            with lock:
+                running["plain"] -= 1
+
+        def chat():
+            time.sleep(0.01)
+            with lock:
+                running["chat_overlapped"] = running["plain"] > 0
+
+        for i in range(3):
+            await manager.add_job(Job(id=f"p{i}", name="plain", task_func=plain, kwargs={}))
+        await manager.add_job(Job(id="c0", name="chat", task_func=chat, kwargs={}, lane="chat"))
+        await manager.join()
+        await manager.stop_workers()
+
+        self.assertEqual(running["max_plain"], 1)
+        self.assertTrue(running["chat_overlapped"])
+        self.assertEqual(manager.get_all_jobs()[0].lane, "default")
+
+    async def test_spans_outside_jobs_are_ignored(self):
+        """测试不在任务上下文中时 span 不会被记录"""
+        with tracing.span(tracing.SPAN_SAVE):
+            pass
+        spans = []
+        with tracing.collect(spans):
+            tracing.record_span(tracing.SPAN_SAVE, 0.5)
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(tracing.summarize(spans), {tracing.SPAN_SAVE: 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
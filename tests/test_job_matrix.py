@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.job_matrix import (MatrixSpec, count_matrix, expand_matrix, parse_variables, substitute,
+                               IMAGE_MODE_EACH)
+
+
+class TestJobMatrix(unittest.TestCase):
+
+    def test_expand_parameters_and_placeholders(self):
+        """测试比例 × 分辨率 × 自定义变量的展开和占位符替换"""
+        spec = MatrixSpec(prompt_template="A {style} cat, {ar} at {resolution}",
+                          models=["m1"], aspect_ratios=["1:1", "16:9"], resolutions=["1K", "2K"],
+                          variables={"style": ["oil", "pixel"]})
+        combos = expand_matrix(spec)
+        self.assertEqual(len(combos), count_matrix(spec))
+        self.assertEqual(len(combos), 8)
+        self.assertEqual(combos[0]["prompt"], "A oil cat, 1:1 at 1K")
+        self.assertEqual(combos[-1]["prompt"], "A pixel cat, 16:9 at 2K")
+        self.assertEqual({c["aspect_ratio"] for c in combos}, {"1:1", "16:9"})
+        self.assertEqual(len({c["label"] for c in combos}), 8, "Labels should tell the jobs apart.")
+
+    def test_one_job_per_image(self):
+        """测试每张图片单独生成任务, {image} 为不带扩展名的文件名"""
+        spec = MatrixSpec(prompt_template="Restyle {image}", models=["m1"], aspect_ratios=["ar_none"],
+                          resolutions=["2K"], image_paths=["/a/x.png", "/a/y.jpg"], image_mode=IMAGE_MODE_EACH)
+        combos = expand_matrix(spec)
+        self.assertEqual([c["image_paths"] for c in combos], [["/a/x.png"], ["/a/y.jpg"]])
+        self.assertEqual([c["prompt"] for c in combos], ["Restyle x", "Restyle y"])
+
+    def test_limits_and_parsing(self):
+        """测试空矩阵/超限报错, 未知占位符保持原样, 以及变量解析"""
+        with self.assertRaises(ValueError):
+            expand_matrix(MatrixSpec("p", models=[], aspect_ratios=["1:1"], resolutions=["1K"]))
+        with self.assertRaises(ValueError):
+            expand_matrix(MatrixSpec("p", ["m"], ["1:1", "2:3"], ["1K", "2K"]), max_jobs=3)
+
+        self.assertEqual(substitute("{known} {unknown} {}", {"known": 1}), "1 {unknown} {}")
+        self.assertEqual(parse_variables("# comment\nstyle = a | b |\n\nlight=soft"),
+                         {"style": ["a", "b"], "light": ["soft"]})
+        with self.assertRaises(ValueError):
+            parse_variables("no equals sign")
+
+
+if __name__ == '__main__':
+    unittest.main()
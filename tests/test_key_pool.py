@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import database as db
+from geminiapi.key_pool import KeyPool
+
+
+class TestKeyPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = os.path.join(self.tmp_dir.name, "test.sqlite")
+        conn = db.get_db_connection()
+        db.init_db(conn)
+        conn.close()
+        for key in ("key-a", "key-b", "key-c"):
+            db.add_api_key(key, label=key)
+        self.pool = KeyPool()
+
+    def tearDown(self):
+        db.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def test_least_loaded_first(self):
+        """测试并发请求被均匀分配到所有 Key"""
+        leased = [self.pool.acquire() for _ in range(6)]
+        self.assertEqual(sorted(leased), ["key-a", "key-a", "key-b", "key-b", "key-c", "key-c"])
+        self.pool.release("key-b")
+        self.pool.release("key-b")
+        self.assertEqual(self.pool.acquire(), "key-b")
+
+    def test_cooldown_after_429_and_skip_after_401(self):
+        """测试 429 后冷却, 401/403 后不再使用, 重新加载后恢复"""
+        self.pool.release(self.pool.acquire(), status_code=429, retry_after=60)  # key-a
+        self.pool.release(self.pool.acquire(), status_code=401)  # key-b
+        self.assertEqual({self.pool.acquire() for _ in range(3)}, {"key-c"})
+        self.assertFalse(self.pool.has_alternative("key-c"))
+
+        snapshot = {item["label"]: item for item in self.pool.snapshot()}
+        self.assertGreater(snapshot["key-a"]["cooldown"], 0)
+        self.assertEqual(snapshot["key-b"]["disabled"], "401")
+
+        self.pool.reload()
+        self.assertTrue(self.pool.has_alternative("key-c"))
+
+    def test_all_keys_unavailable(self):
+        """测试全部冷却时使用最快恢复的 Key, 全部被拒绝时返回 None"""
+        for key in ("key-a", "key-b", "key-c"):
+            self.pool.acquire()
+            self.pool.release(key, status_code=429, retry_after=100 if key != "key-b" else 10)
+        self.assertEqual(self.pool.acquire(max_wait=0), "key-b")
+
+        for key in ("key-a", "key-b", "key-c"):
+            self.pool.release(key, status_code=403)
+        self.assertIsNone(self.pool.acquire(max_wait=0))
+
+    def test_fallback_key_and_disabled_rows(self):
+        """测试设置中的 Key 参与轮换, 数据库中被停用的 Key 不参与"""
+        key_id = db.get_api_keys()[0]["id"]
+        db.set_api_key_enabled(key_id, False)
+        self.pool.reload()
+        leased = {self.pool.acquire("settings-key") for _ in range(3)}
+        self.assertEqual(leased, {"key-b", "key-c", "settings-key"})
+        self.assertFalse(db.add_api_key("key-b"), "Duplicate keys are ignored.")
+
+
+if __name__ == '__main__':
+    unittest.main()
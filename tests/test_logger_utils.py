@@ -0,0 +1,154 @@
+import os
+import json
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import logger_utils
+
+
+class TestLoggerUtils(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 测试中不写入用户目录下的日志文件
+        logger_utils.configure_file_sink(enabled=False)
+
+    def setUp(self):
+        logger_utils.clear_logs()
+
+    def test_ring_buffer_keeps_latest_lines(self):
+        """测试环形缓存只保留最近 MAX_LOG_LINES 行"""
+        for i in range(logger_utils.MAX_LOG_LINES + 10):
+            logger_utils.log(f"line {i}")
+        entries = logger_utils.get_logs_since(0)
+        self.assertEqual(len(entries), logger_utils.MAX_LOG_LINES)
+        self.assertTrue(entries[-1].text.endswith(f"line {logger_utils.MAX_LOG_LINES + 9}"))
+        self.assertEqual(logger_utils.get_logs().splitlines()[0], entries[-1].text)
+
+    def test_get_logs_since(self):
+        """测试按序号拉取增量日志"""
+        logger_utils.log("first")
+        seq = logger_utils.get_last_seq()
+        logger_utils.log("second")
+        logger_utils.log("third")
+        texts = [entry.text for entry in logger_utils.get_logs_since(seq)]
+        self.assertEqual(len(texts), 2)
+        self.assertTrue(texts[0].endswith("second"))
+        self.assertEqual(logger_utils.get_logs_since(logger_utils.get_last_seq()), [])
+
+    def test_subscriber_receives_only_new_lines(self):
+        """测试订阅者只收到新增日志"""
+        logger_utils.log("before subscribe")
+        received = []
+
+        def callback(lines, reset):
+            received.append((lines, reset))
+
+        logger_utils.subscribe(callback, interval=0)
+        try:
+            logger_utils.log("after subscribe")
+        finally:
+            logger_utils.unsubscribe(callback)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(len(received[0][0]), 1)
+        self.assertTrue(received[0][0][0].endswith("after subscribe"))
+
+    def test_subscribe_returns_backlog_boundary(self):
+        """测试 subscribe 返回订阅起点: 起点之前的日志从缓存读取, 之后的日志由订阅推送, 不重复也不遗漏"""
+        logger_utils.log("backlog line")
+        received = []
+
+        def callback(lines, reset):
+            received.extend(lines)
+
+        start_seq = logger_utils.subscribe(callback, interval=0)
+        try:
+            logger_utils.log("live line")
+        finally:
+            logger_utils.unsubscribe(callback)
+        backlog = [record.text for record in logger_utils.get_logs_since(0) if record.seq <= start_seq]
+        self.assertTrue(backlog[-1].endswith("backlog line"))
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0].endswith("live line"))
+
+    def test_coalesced_delivery(self):
+        """测试时间窗口内的多条日志合并为一次回调"""
+        received = []
+        done = threading.Event()
+
+        def callback(lines, reset):
+            received.append(lines)
+            done.set()
+
+        logger_utils.subscribe(callback, interval=0.05)
+        try:
+            for i in range(20):
+                logger_utils.log(f"burst {i}")
+            self.assertTrue(done.wait(2))
+        finally:
+            logger_utils.unsubscribe(callback)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(len(received[0]), 20)
+
+    def test_clear_notifies_reset(self):
+        """测试清空日志时通知订阅者重置"""
+        received = []
+
+        def callback(lines, reset):
+            received.append((lines, reset))
+
+        logger_utils.subscribe(callback, interval=0)
+        try:
+            logger_utils.clear_logs()
+        finally:
+            logger_utils.unsubscribe(callback)
+        self.assertEqual(received, [([], True)])
+        self.assertEqual(logger_utils.get_logs(), "")
+
+    def test_levels_and_filtering(self):
+        """测试日志级别过滤"""
+        logger_utils.debug("debug line")
+        logger_utils.error("error line")
+        self.assertEqual(len(logger_utils.get_logs_since(0)), 2)
+        errors = logger_utils.get_logs_since(0, min_level=logger_utils.WARNING)
+        self.assertEqual([record.message for record in errors], ["error line"])
+        self.assertIn("[ERROR]", errors[0].text)
+        self.assertNotIn("debug line", logger_utils.get_logs(min_level=logger_utils.INFO))
+
+    def test_bind_adds_structured_fields(self):
+        """测试 bind() 绑定的字段会附加到日志记录上"""
+        with logger_utils.bind(job_id="job_1"):
+            logger_utils.log("inside", model="m")
+        logger_utils.log("outside")
+        inside, outside = logger_utils.get_logs_since(0)
+        self.assertEqual(inside.fields, {"job_id": "job_1", "model": "m"})
+        self.assertEqual(outside.fields, {})
+
+    def test_file_sink_writes_and_rotates(self):
+        """测试后台线程写入 JSONL 文件并按大小轮转"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "app.jsonl")
+            logger_utils.configure_file_sink(enabled=True, path=path, max_bytes=200, backup_count=2)
+            try:
+                for i in range(30):
+                    logger_utils.log(f"file line {i}", job_id=f"job_{i}")
+            finally:
+                # 关闭时会等待写线程把队列中的记录全部写完
+                logger_utils.configure_file_sink(enabled=False)
+
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(os.path.exists(f"{path}.1"))
+            self.assertFalse(os.path.exists(f"{path}.3"))
+            with open(path, encoding="utf-8") as f:
+                last = json.loads(f.readlines()[-1])
+            self.assertEqual(last["msg"], "file line 29")
+            self.assertEqual(last["level"], "INFO")
+            self.assertEqual(last["job_id"], "job_29")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import socket
+import sys
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_labels_and_total(self):
+        """测试计数器按标签累加以及按部分标签求和"""
+        counter = metrics.Counter("test_errors_total", "test")
+        counter.inc(model="a", status="429")
+        counter.inc(2, model="b", status="429")
+        counter.inc(model="a", status="5xx")
+        self.assertEqual(counter.value(model="a", status="429"), 1)
+        self.assertEqual(counter.total(status="429"), 3)
+        self.assertEqual(counter.total(), 4)
+
+    def test_histogram_percentiles_and_buckets(self):
+        """测试直方图分位数和累积桶计数"""
+        histogram = metrics.Histogram("test_latency_seconds", "test", buckets=(1, 5, 10))
+        for value in range(1, 101):
+            histogram.observe(value / 10, model="m")
+        self.assertEqual(histogram.count(model="m"), 100)
+        self.assertAlmostEqual(histogram.percentile(0.5, model="m"), 5.0, delta=0.1)
+        self.assertAlmostEqual(histogram.percentile(0.95, model="m"), 9.5, delta=0.1)
+        self.assertIsNone(histogram.percentile(0.5, model="other"))
+
+        text = "\n".join(histogram.render())
+        self.assertIn('test_latency_seconds_bucket{model="m",le="1"} 10', text)
+        self.assertIn('test_latency_seconds_bucket{model="m",le="+Inf"} 100', text)
+
+    def test_meter_window(self):
+        """测试滑动窗口速率: 窗口外的事件不计入"""
+        meter = metrics.Meter("test_rate", "test", window=60)
+        meter.mark(now=0)
+        meter.mark(now=50)
+        meter.mark(now=100)
+        self.assertEqual(meter.rate_per_minute(now=100), 2)
+
+    def test_status_class(self):
+        self.assertEqual(metrics.status_class(429), "429")
+        self.assertEqual(metrics.status_class(503), "5xx")
+        self.assertEqual(metrics.status_class(400), "4xx")
+        self.assertEqual(metrics.status_class(None), "other")
+
+    def test_http_endpoint(self):
+        """测试本地 /metrics 文本端点"""
+        server = metrics.start_http_server(0)
+        try:
+            port = server.server_address[1]
+            metrics.JOBS_TOTAL.inc(status="success")
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+                body = resp.read().decode("utf-8")
+            self.assertIn("# TYPE gemini_jobs_total counter", body)
+            self.assertIn('gemini_jobs_total{status="success"}', body)
+        finally:
+            metrics.stop_http_server()
+
+    def test_http_endpoint_restarts_on_port_change(self):
+        """测试端口改变时关闭旧端点并在新端口启动, 端口不变时返回同一实例"""
+        first = metrics.start_http_server(0)
+        try:
+            port = first.server_address[1]
+            self.assertIs(metrics.start_http_server(port), first)
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                new_port = sock.getsockname()[1]
+            second = metrics.start_http_server(new_port)
+            self.assertIsNot(second, first)
+            self.assertEqual(second.server_address[1], new_port)
+            with urllib.request.urlopen(f"http://127.0.0.1:{new_port}/metrics", timeout=5) as resp:
+                self.assertEqual(resp.status, 200)
+        finally:
+            metrics.stop_http_server()
+
+
+if __name__ == '__main__':
+    unittest.main()
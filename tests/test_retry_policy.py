@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import logger_utils
+from geminiapi import retry_policy
+from geminiapi.retry_policy import RetryPolicy, RetryBudget
+
+
+class _ApiError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_classify(self):
+        """测试错误分类: 限流 / 认证 / 服务器错误 / 内容拦截 / 网络错误"""
+        self.assertEqual(retry_policy.classify(_ApiError(429, "RESOURCE_EXHAUSTED")), retry_policy.RATE_LIMITED)
+        self.assertEqual(retry_policy.classify(_ApiError(403, "PERMISSION_DENIED")), retry_policy.AUTH)
+        self.assertEqual(retry_policy.classify(_ApiError(503, "UNAVAILABLE")), retry_policy.RETRYABLE)
+        self.assertEqual(retry_policy.classify(_ApiError(400, "INVALID_ARGUMENT")), retry_policy.TERMINAL)
+        self.assertEqual(retry_policy.classify(ValueError("Request was blocked due to: PROHIBITED_CONTENT")),
+                         retry_policy.TERMINAL)
+        self.assertEqual(retry_policy.classify(ConnectionResetError("reset by peer")), retry_policy.RETRYABLE)
+        self.assertEqual(retry_policy.classify(RuntimeError("something odd")), retry_policy.RETRYABLE)
+
+    def test_retry_after_from_message(self):
+        """测试从错误详情中解析 retryDelay"""
+        e = _ApiError(429, "{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '17s'}")
+        self.assertEqual(retry_policy.retry_after_of(e), 17.0)
+        self.assertIsNone(retry_policy.retry_after_of(_ApiError(500)))
+
+    def test_backoff_is_exponential_with_jitter(self):
+        """测试退避时间按指数增长且落在抖动范围内, 并且不超过上限"""
+        policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+        for attempt, ceiling in ((0, 1.0), (1, 2.0), (2, 4.0), (5, 8.0)):
+            delay = policy.backoff(attempt)
+            self.assertGreaterEqual(delay, ceiling / 2)
+            self.assertLessEqual(delay, ceiling)
+
+    def test_backoff_honors_retry_after(self):
+        """测试 Retry-After 作为等待下限, 过长时放弃"""
+        policy = RetryPolicy(base_delay=1.0, max_retry_after=60.0)
+        self.assertGreaterEqual(policy.backoff(0, retry_after=10.0), 10.0)
+        self.assertIsNone(policy.backoff(0, retry_after=3600.0))
+
+    def test_budget(self):
+        """测试重试预算按次数和等待时间扣减"""
+        budget = RetryBudget(max_retries=2, max_backoff=10.0)
+        self.assertTrue(budget.spend(4.0))
+        self.assertFalse(budget.spend(7.0))
+        self.assertTrue(budget.spend(5.0))
+        self.assertFalse(budget.spend(0.1))
+
+    def test_budget_shared_within_job(self):
+        """测试同一任务内的调用共享预算"""
+        with logger_utils.bind(job_id="job-retry-test"):
+            first = retry_policy.budget_for_current_job()
+            self.assertIs(first, retry_policy.budget_for_current_job())
+        self.assertIsNot(first, retry_policy.budget_for_current_job())
+
+    def test_budget_shared_across_threads(self):
+        """测试同一任务的多个线程同时取预算时拿到同一个实例, 并发扣减不超出预算"""
+        budgets = []
+
+        def worker():
+            with logger_utils.bind(job_id="job-thread-test"):
+                budget = retry_policy.budget_for_current_job()
+                budgets.append(budget)
+                for _ in range(10):
+                    budget.spend(0.0)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(budget) for budget in budgets}), 1)
+        self.assertEqual(budgets[0].retries_used, budgets[0].max_retries)
+
+
+if __name__ == '__main__':
+    unittest.main()
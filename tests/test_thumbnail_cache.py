@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+
+from common.image_util import ImageRef
+from common.thumbnail_cache import ThumbnailCache
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ThumbnailCache(directory=os.path.join(self.tmp_dir.name, "thumbs"), max_files=2)
+
+    def tearDown(self):
+        self.cache.shutdown()
+        self.tmp_dir.cleanup()
+
+    def make_ref(self, name, color):
+        path = os.path.join(self.tmp_dir.name, name)
+        Image.new("RGB", (1024, 512), color).save(path)
+        return ImageRef.from_path(path)
+
+    def test_render_once_per_content(self):
+        """测试缩略图在后台生成为小尺寸 WebP, 内容相同的图片共用一个缓存文件"""
+        ref = self.make_ref("a.png", "red")
+        self.assertIsNone(self.cache.get(ref))
+
+        path = self.cache.submit(ref).result(timeout=5)
+        self.assertEqual(path, self.cache.get(ref))
+        with Image.open(path) as thumb:
+            self.assertEqual(thumb.format, "WEBP")
+            self.assertEqual(thumb.size, (200, 100))
+
+        same_content = self.make_ref("copy.png", "red")
+        self.assertEqual(self.cache.submit(same_content).result(timeout=5), path)
+
+    def test_prefetch_and_prune(self):
+        """测试 prefetch 只处理图片引用, 无法读取的文件返回 None, prune 只保留 max_files 个文件"""
+        refs = [self.make_ref(f"{i}.png", (i * 60, 0, 0)) for i in range(3)]
+        self.cache.prefetch(["text", *refs])
+        paths = [self.cache.submit(ref).result(timeout=5) for ref in refs]
+        self.assertTrue(all(paths))
+        self.assertIsNone(self.cache.submit(ImageRef("/missing.png", "0" * 64)).result(timeout=5))
+
+        self.cache.prune()
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common import logger_utils
+from gapp import app_logic
+from gapp.ui_stream import ChangeNotifier
+
+
+class TestChangeNotifier(unittest.IsolatedAsyncioTestCase):
+
+    async def test_wait_wakes_on_notify_from_thread(self):
+        """测试后台线程的 notify() 会唤醒等待方, 版本号已变化时 wait() 立即返回"""
+        notifier = ChangeNotifier()
+        seen = notifier.version
+        waiter = asyncio.create_task(notifier.wait(seen))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        threading.Thread(target=notifier.notify).start()
+        self.assertEqual(await asyncio.wait_for(waiter, 2), seen + 1)
+        self.assertEqual(await asyncio.wait_for(notifier.wait(seen), 0.1), seen + 1)
+
+    async def test_wait_timeout(self):
+        """测试超时后返回原版本号, 且不会遗留等待方"""
+        notifier = ChangeNotifier()
+        self.assertEqual(await notifier.wait(notifier.version, timeout=0.01), 0)
+        self.assertFalse(notifier._waiters)  # pylint: disable=protected-access
+
+
+class TestStreamUiUpdates(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # 其他测试留下的日志不应影响结果
+        logger_utils.clear_logs()
+
+    def tearDown(self):
+        for session_id in ("tab-a", "tab-b"):
+            app_logic.release_session(SimpleNamespace(session_hash=session_id))
+
+    async def test_pushes_only_on_change(self):
+        """测试流式事件先推送一次日志, 之后只在任务结束时推送, 未变化的输出为 gr.skip()"""
+        notifier = ChangeNotifier()
+        with patch("gapp.ui_stream.notifier", notifier), patch("gapp.app_logic.gr.Warning"):
+            stream = app_logic.stream_ui_updates(SimpleNamespace(session_hash="tab-a"))
+            first = await stream.__anext__()
+            self.assertEqual(len(first), 7)
+
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.05)
+            self.assertFalse(pending.done())
+
+            chat_state = app_logic.session_tasks("tab-a")["chat"]
+            app_logic._finish(chat_state, status="error", error_msg="boom")  # pylint: disable=protected-access
+            outputs = await asyncio.wait_for(pending, 2)
+            await stream.aclose()
+
+        self.assertIsNone(outputs[2])
+        self.assertEqual(outputs[0], outputs[1])  # 两者都是 gr.skip()
+        self.assertNotEqual(outputs[0], outputs[2])
+
+    async def test_sessions_are_isolated(self):
+        """测试一个会话的任务结果和任务日志不会推送给其他会话"""
+        notifier = ChangeNotifier()
+        with patch("gapp.ui_stream.notifier", notifier):
+            stream = app_logic.stream_ui_updates(SimpleNamespace(session_hash="tab-b"))
+            await stream.__anext__()
+            pending = asyncio.ensure_future(stream.__anext__())
+
+            with logger_utils.bind(session="tab-a"):
+                logger_utils.log("private line of tab-a")
+            app_logic._finish(app_logic.session_tasks("tab-a")["generation"],  # pylint: disable=protected-access
+                              status="success", result_path="a.png")
+            await asyncio.sleep(0.05)
+            self.assertFalse(pending.done())
+
+            logger_utils.log("shared line")
+            outputs = await asyncio.wait_for(pending, 2)
+            await stream.aclose()
+
+        self.assertIn("shared line", outputs[6].split("\n")[0])  # 只追加新日志, 最新的在最上面
+        self.assertNotIn("private line of tab-a", outputs[6])
+        self.assertEqual(app_logic.session_tasks("tab-b")["generation"]["revision"], 0)
+
+    async def test_full_buffer_does_not_leak_other_sessions(self):
+        """测试日志缓存已满时, 其他会话的日志挤掉旧日志不会触发本会话的推送"""
+        for i in range(logger_utils.MAX_LOG_LINES + 100):
+            logger_utils.log(f"filler {i}")
+        notifier = ChangeNotifier()
+        with patch("gapp.ui_stream.notifier", notifier):
+            stream = app_logic.stream_ui_updates(SimpleNamespace(session_hash="tab-b"))
+            await stream.__anext__()
+            pending = asyncio.ensure_future(stream.__anext__())
+
+            with logger_utils.bind(session="tab-a"):
+                logger_utils.log("private line of tab-a")
+            notifier.notify()
+            await asyncio.sleep(0.05)
+            self.assertFalse(pending.done())
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+            await stream.aclose()
+
+
+if __name__ == '__main__':
+    unittest.main()